@@ -0,0 +1,175 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional, List, Tuple
+
+import psycopg2.extras
+from dotenv import load_dotenv
+
+from database import get_db_connection
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many events are buffered...
+BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "100"))
+# ...or when the oldest buffered event is this many seconds old
+FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "2.0"))
+# Hard cap on buffered events while the database is unreachable
+MAX_BUFFER = int(os.getenv("ACTIVITY_LOG_MAX_BUFFER", "10000"))
+
+INSERT_QUERY = """
+    INSERT INTO regops_app.tbl_globi_eu_am_99_activity_log
+        (request_id, activity_type, activity_description, performed_by,
+         performed_date, old_value, new_value)
+    VALUES %s
+"""
+
+
+class ActivityType:
+    CREATED = "Created"
+    STATUS_CHANGED = "Status Changed"
+    ATTACHMENT_UPLOADED = "Attachment Uploaded"
+    ATTACHMENT_DOWNLOADED = "Attachment Downloaded"
+
+
+class ActivityLogWriter:
+    """
+    Buffers audit events in memory and writes them to the activity log table
+    in multi-row INSERT batches from a background thread.
+
+    A batch is flushed when BATCH_SIZE events are waiting or FLUSH_INTERVAL
+    seconds have passed since the first buffered event, whichever comes first.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_buffer: int = MAX_BUFFER):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Tuple] = []
+        self._first_event_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.dropped = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="activity-log-writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the background thread and flush everything still buffered."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def log(
+        self,
+        request_id: Optional[int],
+        activity_type: str,
+        description: Optional[str] = None,
+        performed_by: Optional[str] = None,
+        old_value: Optional[str] = None,
+        new_value: Optional[str] = None
+    ):
+        """Queue one activity log entry. Never touches the database."""
+        event = (request_id, activity_type, description, performed_by,
+                 datetime.now(), old_value, new_value)
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                # Database has been unreachable for a while - shed the oldest entry
+                self._buffer.pop(0)
+                self.dropped += 1
+            self._buffer.append(event)
+            if self._first_event_at is None:
+                self._first_event_at = time.monotonic()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self) -> int:
+        """Write all buffered events in one statement. Returns rows written."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                self._first_event_at = None
+            if not batch:
+                return 0
+
+            try:
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    psycopg2.extras.execute_values(
+                        cursor, INSERT_QUERY, batch, page_size=max(len(batch), 1)
+                    )
+                return len(batch)
+            except Exception as e:
+                logger.error("Activity log flush failed (%d events): %s", len(batch), e)
+                # Put the batch back in front so it is retried on the next flush
+                with self._cond:
+                    self._buffer = (batch + self._buffer)[-self.max_buffer:]
+                    if self._first_event_at is None:
+                        self._first_event_at = time.monotonic()
+                return 0
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._buffer)
+
+    def _due(self) -> bool:
+        if not self._buffer:
+            return False
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return time.monotonic() - self._first_event_at >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    if self._first_event_at is None:
+                        self._cond.wait()
+                    else:
+                        remaining = self.flush_interval - (time.monotonic() - self._first_event_at)
+                        self._cond.wait(max(remaining, 0.01))
+                if self._stopping:
+                    return
+            if self.flush() == 0 and self.pending():
+                # Flush failed - back off before retrying
+                time.sleep(self.flush_interval)
+
+
+activity_log = ActivityLogWriter()
+
+# Last line of defence if the app exits without running the shutdown hook
+atexit.register(activity_log.flush)
+
+
+def log_activity(
+    request_id: Optional[int],
+    activity_type: str,
+    description: Optional[str] = None,
+    performed_by: Optional[str] = None,
+    old_value: Optional[str] = None,
+    new_value: Optional[str] = None
+):
+    """
+    Record an audit trail entry for a service request.
+    The entry is written asynchronously in a batch with other entries.
+    """
+    activity_log.log(request_id, activity_type, description, performed_by, old_value, new_value)
@@ -0,0 +1,536 @@
+"""
+Content-addressed attachment storage.
+
+The same quotes, photos and contracts get attached to request after
+request. Each distinct file is stored once, under its SHA-256
+(content/<ab>/<sha256>, table attachment_contents, migrations/
+add_attachment_content.sql); attachment rows reference the content and keep
+their own name ({request_id}/{uuid}_{filename}) for the API.
+
+How a file gets there depends on who wrote it:
+
+- /upload (through the API): the upload is hashed in one streaming pass and
+  written to its content path, or not at all if the content is already
+  stored (store_content).
+- /upload/authorize + /upload/finalize (client writes the blob): a client
+  that sends a file's SHA-256 to authorize is told when the content is
+  already attached to a request the caller can access, and skips the
+  upload; content stored only for others is never revealed this way. Blobs the client did write are
+  queued (content_status = 'pending'); a background thread claims one
+  ('hashing'), hashes it from storage and copies new content to its content
+  path without holding a database connection, then links it ('stored') and
+  drops the uploaded blob. A client-supplied hash only ever saves an upload; bytes the client
+  wrote are always hashed here.
+
+A trigger on attachments keeps attachment_contents.ref_count. Content
+unreferenced for CONTENT_GC_GRACE seconds is deleted with its renditions,
+unless an archived partition still refers to it (partitions.py).
+
+Direct uploads that were authorized but never finalized (table
+upload_authorizations) are swept UPLOAD_SWEEP_GRACE seconds after their SAS
+expired, with whatever blob the client wrote.
+
+    python attachment_store.py status
+    python attachment_store.py dedup        # work through the queue once, then exit
+    python attachment_store.py gc [--dry-run]
+    python attachment_store.py sweep [--dry-run]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_DEDUP_ENABLED = os.getenv("ATTACHMENT_DEDUP_ENABLED", "true").lower() == "true"
+# Seconds between queue polls when idle (finalized uploads wake the thread directly)
+CONTENT_POLL_INTERVAL = float(os.getenv("CONTENT_POLL_INTERVAL", "60"))
+CONTENT_GC_INTERVAL = int(os.getenv("CONTENT_GC_INTERVAL", "3600"))
+# How long unreferenced content is kept; covers uploads between authorize and finalize
+CONTENT_GC_GRACE = int(os.getenv("CONTENT_GC_GRACE", "86400"))
+CONTENT_GC_BATCH = 100
+# A claimed attachment not linked within this many seconds (worker died) is hashed again
+CONTENT_CLAIM_TIMEOUT = int(os.getenv("CONTENT_CLAIM_TIMEOUT", "900"))
+# Seconds after an upload SAS expired before an unfinalized upload is removed
+UPLOAD_SWEEP_GRACE = int(os.getenv("UPLOAD_SWEEP_GRACE", "3600"))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = "regops_app"
+ATTACHMENTS = f"{SCHEMA}.tbl_globi_eu_am_99_attachments"
+CONTENTS = f"{SCHEMA}.tbl_globi_eu_am_99_attachment_contents"
+REQUESTS = f"{SCHEMA}.tbl_globi_eu_am_99_service_requests"
+UPLOAD_AUTHORIZATIONS = f"{SCHEMA}.tbl_globi_eu_am_99_upload_authorizations"
+
+attachment_content_total = metrics.Counter(
+    "attachment_content_total", "Attachment files by deduplication outcome", ("source", "outcome")
+)
+attachment_dedup_bytes_total = metrics.Counter(
+    "attachment_dedup_bytes_total", "Bytes not stored again because the content already was", ("source",)
+)
+attachment_content_collected_total = metrics.Counter(
+    "attachment_content_collected_total", "Unreferenced contents deleted by the garbage collector"
+)
+attachment_uploads_swept_total = metrics.Counter(
+    "attachment_uploads_swept_total", "Authorized direct uploads removed because they were never finalized"
+)
+
+
+def content_blob_path(sha256: str) -> str:
+    return f"content/{sha256[:2]}/{sha256}"
+
+
+def hash_chunks(chunks: Iterable[bytes]) -> Tuple[str, int]:
+    """SHA-256 and size of a stream of chunks, without holding it in memory."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def hash_file(fileobj) -> Tuple[str, int]:
+    fileobj.seek(0)
+    result = hash_chunks(iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""))
+    fileobj.seek(0)
+    return result
+
+
+_container_client = None
+
+
+def _container():
+    global _container_client
+    if _container_client is None:
+        from azure.storage.blob import BlobServiceClient
+        from routers.upload import CONTAINER_NAME
+        service = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
+        _container_client = service.get_container_client(CONTAINER_NAME)
+    return _container_client
+
+
+def _content_settings(content_type: Optional[str]):
+    from azure.storage.blob import ContentSettings
+    # Content never changes under its hash
+    return ContentSettings(content_type=content_type, cache_control="private, max-age=31536000, immutable")
+
+
+def lookup_content(sha256: str, size: Optional[int] = None,
+                   scope: Optional[Tuple[str, list]] = None) -> Optional[Dict[str, Any]]:
+    """
+    The stored content with this hash (and size), or None. Unreferenced
+    content found here gets a fresh grace period, so the garbage collector
+    leaves it alone until the caller has attached it.
+
+    For a hash the client supplied, pass `scope` (authorization.scope_predicate
+    over `sr`): only content an attachment of a request in that scope already
+    refers to is found, so a hash reveals or grants nothing beyond it.
+    """
+    from database import execute_query
+    condition, scope_params = "", []
+    if scope is not None:
+        predicate, scope_params = scope
+        condition = f"""
+          AND EXISTS (
+              SELECT 1 FROM {ATTACHMENTS} a
+              JOIN {REQUESTS} sr ON sr.id = a.request_id
+              WHERE a.content_sha256 = c.sha256 AND {predicate}
+          )"""
+    rows = execute_query(f"""
+        UPDATE {CONTENTS} c
+        SET orphaned_since = CASE WHEN c.ref_count = 0 THEN CURRENT_TIMESTAMP END
+        WHERE c.sha256 = %s AND (%s::bigint IS NULL OR c.file_size = %s::bigint){condition}
+        RETURNING c.sha256, c.blob_path, c.file_size, c.content_type
+    """, tuple([sha256, size, size] + list(scope_params)))
+    return rows[0] if rows else None
+
+
+def store_content(container, data, sha256: str, size: int,
+                  content_type: Optional[str]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Store a file that has been hashed already (hash_file) under its content
+    path, unless that content is stored. Returns the content and whether it
+    was written.
+    """
+    from database import execute_query
+    existing = lookup_content(sha256, size)
+    if existing:
+        attachment_content_total.inc(source="api", outcome="duplicate")
+        attachment_dedup_bytes_total.inc(size, source="api")
+        return existing, False
+
+    blob_path = content_blob_path(sha256)
+    # Concurrent uploads of the same new file write identical bytes
+    container.get_blob_client(blob_path).upload_blob(
+        data, overwrite=True, content_settings=_content_settings(content_type)
+    )
+    execute_query(f"""
+        INSERT INTO {CONTENTS} (sha256, blob_path, file_size, content_type)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING
+    """, (sha256, blob_path, size, content_type), fetch=False)
+    attachment_content_total.inc(source="api", outcome="new")
+    return {"sha256": sha256, "blob_path": blob_path, "file_size": size, "content_type": content_type}, True
+
+
+def adopt_renditions(sha256s: List[str]):
+    """Attachments waiting for previews of content rendered before take the existing renditions."""
+    if not sha256s:
+        return
+    from database import execute_query
+    execute_query(f"""
+        UPDATE {ATTACHMENTS} a
+        SET media_status = 'ready', renditions = r.renditions, media_error = NULL
+        FROM (
+            SELECT DISTINCT ON (content_sha256) content_sha256, renditions
+            FROM {ATTACHMENTS}
+            WHERE content_sha256 = ANY(%s) AND media_status = 'ready' AND renditions IS NOT NULL
+            ORDER BY content_sha256, id
+        ) r
+        WHERE a.content_sha256 = r.content_sha256 AND a.media_status = 'pending'
+    """, (list(sha256s),), fetch=False)
+
+
+def initial_status() -> Optional[str]:
+    """content_status for an attachment whose bytes the client wrote to blob_path."""
+    return "pending" if ATTACHMENT_DEDUP_ENABLED else None
+
+
+# ----------------------------------------------------------------------------
+# Deduplication of client-written blobs
+# ----------------------------------------------------------------------------
+
+def _copy_blob(container, source: str, target: str, content_type: Optional[str], timeout: float = 300):
+    """Server-side copy within the storage account."""
+    source_client = container.get_blob_client(source)
+    target_client = container.get_blob_client(target)
+    target_client.start_copy_from_url(source_client.url)
+    deadline = time.monotonic() + timeout
+    while True:
+        copy = target_client.get_blob_properties().copy
+        if copy.status == "success":
+            break
+        if copy.status != "pending" or time.monotonic() > deadline:
+            raise RuntimeError(f"Copy of {source} ended as {copy.status}: {copy.status_description}")
+        time.sleep(0.5)
+    target_client.set_http_headers(_content_settings(content_type))
+
+
+def _claim_next() -> Optional[Dict[str, Any]]:
+    """Mark the next queued attachment as being hashed (or one whose claim timed out)."""
+    from database import execute_query
+    rows = execute_query(f"""
+        UPDATE {ATTACHMENTS} a
+        SET content_status = 'hashing', content_claimed_at = clock_timestamp()
+        WHERE a.id = (
+            SELECT id FROM {ATTACHMENTS}
+            WHERE content_status = 'pending'
+               OR (content_status = 'hashing'
+                   AND content_claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING a.id, a.blob_path, a.content_type, a.content_claimed_at
+    """, (CONTENT_CLAIM_TIMEOUT,))
+    return rows[0] if rows else None
+
+
+def _release(claim: Dict[str, Any], status: str) -> bool:
+    """End a claim with `status`; False if it timed out and another worker took it over."""
+    from database import execute_query
+    return execute_query(f"""
+        UPDATE {ATTACHMENTS}
+        SET content_status = %s, content_claimed_at = NULL
+        WHERE id = %s AND content_status = 'hashing' AND content_claimed_at = %s
+    """, (status, claim["id"], claim["content_claimed_at"]), fetch=False) > 0
+
+
+def deduplicate_next() -> Optional[str]:
+    """
+    Hash one queued attachment's blob and move it to content storage.
+    Returns the outcome (new, duplicate, failed, or lost when the claim timed
+    out or the content was collected meanwhile), or None when the queue is empty.
+
+    No connection is held while the blob is downloaded and copied: the
+    attachment is claimed (content_status = 'hashing') in one short
+    transaction and linked to its content in another.
+    """
+    from azure.core.exceptions import AzureError, ResourceNotFoundError
+    from database import execute_query, get_db_connection
+
+    claim = _claim_next()
+    if claim is None:
+        return None
+    attachment_id, blob_path = claim["id"], claim["blob_path"]
+
+    container = _container()
+    copied = False
+    try:
+        sha256, size = hash_chunks(container.get_blob_client(blob_path).download_blob().chunks())
+        target = content_blob_path(sha256)
+        if not execute_query(f"SELECT 1 FROM {CONTENTS} WHERE sha256 = %s", (sha256,)):
+            _copy_blob(container, blob_path, target, claim["content_type"])
+            copied = True
+    except (AzureError, RuntimeError) as e:
+        # The attachment keeps working from its own blob; it just isn't deduplicated
+        if not isinstance(e, ResourceNotFoundError):
+            logger.warning("Deduplication failed", extra={"attachment_id": attachment_id, "error": str(e)})
+        _release(claim, "failed")
+        attachment_content_total.inc(source="direct", outcome="failed")
+        return "failed"
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if copied:
+            cursor.execute(f"""
+                INSERT INTO {CONTENTS} (sha256, blob_path, file_size, content_type)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (sha256) DO NOTHING
+            """, (sha256, target, size, claim["content_type"]))
+        # Locks the content row: the garbage collector skips it while we link to it
+        cursor.execute(f"SELECT 1 FROM {CONTENTS} WHERE sha256 = %s FOR UPDATE", (sha256,))
+        exists = cursor.fetchone() is not None
+        if exists:
+            cursor.execute(f"""
+                UPDATE {ATTACHMENTS}
+                SET content_sha256 = %s, content_status = 'stored', file_size = %s, content_claimed_at = NULL
+                WHERE id = %s AND content_status = 'hashing' AND content_claimed_at = %s
+            """, (sha256, size, attachment_id, claim["content_claimed_at"]))
+            linked = cursor.rowcount > 0
+    if not exists:
+        # Collected since we looked it up: queue again, the next attempt copies it
+        _release(claim, "pending")
+    if not exists or not linked:
+        attachment_content_total.inc(source="direct", outcome="lost")
+        return "lost"
+    outcome = "new" if copied else "duplicate"
+
+    # Committed: nothing refers to the uploaded blob any more
+    try:
+        container.get_blob_client(blob_path).delete_blob()
+    except AzureError as e:
+        logger.warning("Could not delete deduplicated blob %s: %s", blob_path, e)
+    if outcome == "duplicate":
+        adopt_renditions([sha256])
+        attachment_dedup_bytes_total.inc(size, source="direct")
+    attachment_content_total.inc(source="direct", outcome=outcome)
+    return outcome
+
+
+# ----------------------------------------------------------------------------
+# Garbage collection
+# ----------------------------------------------------------------------------
+
+def collect_garbage(limit: int = CONTENT_GC_BATCH, dry_run: bool = False) -> Dict[str, Any]:
+    """Delete up to `limit` contents nothing has referred to for CONTENT_GC_GRACE seconds."""
+    from azure.core.exceptions import AzureError, ResourceNotFoundError
+    from database import get_db_connection
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT sha256, blob_path, file_size FROM {CONTENTS}
+            WHERE ref_count = 0 AND NOT archived
+              AND orphaned_since < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ORDER BY orphaned_since
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (CONTENT_GC_GRACE, limit))
+        candidates = cursor.fetchall()
+        if dry_run or not candidates:
+            return {"contents": len(candidates), "bytes": sum(row[2] for row in candidates), "dry_run": dry_run}
+
+        container = _container()
+        deleted, freed = [], 0
+        for sha256, blob_path, file_size in candidates:
+            # Renditions (<blob_path>.thumb.jpg, ...) first: the row goes only once the original is gone
+            names = [blob.name for blob in container.list_blobs(name_starts_with=blob_path + ".")]
+            try:
+                for name in names + [blob_path]:
+                    try:
+                        container.get_blob_client(name).delete_blob()
+                    except ResourceNotFoundError:
+                        pass
+            except AzureError as e:
+                logger.warning("Could not delete content %s: %s", blob_path, e)
+                continue
+            deleted.append(sha256)
+            freed += file_size
+
+        cursor.execute(f"DELETE FROM {CONTENTS} WHERE sha256 = ANY(%s)", (deleted,))
+
+    attachment_content_collected_total.inc(len(deleted))
+    if deleted:
+        logger.info("Collected unreferenced attachment contents", extra={"contents": len(deleted), "bytes": freed})
+    return {"contents": len(deleted), "bytes": freed, "dry_run": False}
+
+
+def sweep_uploads(limit: int = CONTENT_GC_BATCH, dry_run: bool = False) -> Dict[str, Any]:
+    """Remove up to `limit` direct uploads whose SAS expired UPLOAD_SWEEP_GRACE seconds ago unfinalized."""
+    from azure.core.exceptions import AzureError, ResourceNotFoundError
+    from database import get_db_connection
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Locked rows: a finalize claiming the same upload waits, then finds nothing to claim
+        cursor.execute(f"""
+            SELECT blob_path FROM {UPLOAD_AUTHORIZATIONS}
+            WHERE expires_at < %s
+            ORDER BY expires_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (datetime.utcnow() - timedelta(seconds=UPLOAD_SWEEP_GRACE), limit))
+        expired = [row[0] for row in cursor.fetchall()]
+        if dry_run or not expired:
+            return {"uploads": len(expired), "dry_run": dry_run}
+
+        container = _container()
+        swept = []
+        for blob_path in expired:
+            try:
+                container.get_blob_client(blob_path).delete_blob()
+            except ResourceNotFoundError:
+                pass  # never uploaded, or skipped as already stored
+            except AzureError as e:
+                logger.warning("Could not delete abandoned upload %s: %s", blob_path, e)
+                continue
+            swept.append(blob_path)
+
+        cursor.execute(f"DELETE FROM {UPLOAD_AUTHORIZATIONS} WHERE blob_path = ANY(%s)", (swept,))
+
+    attachment_uploads_swept_total.inc(len(swept))
+    if swept:
+        logger.info("Swept abandoned uploads", extra={"uploads": len(swept)})
+    return {"uploads": len(swept), "dry_run": False}
+
+
+def storage_status() -> Dict[str, Any]:
+    from database import execute_query
+    contents = execute_query(f"""
+        SELECT count(*) AS contents,
+               COALESCE(sum(file_size), 0) AS stored_bytes,
+               COALESCE(sum(file_size * ref_count), 0) AS referenced_bytes,
+               count(*) FILTER (WHERE ref_count = 0 AND NOT archived) AS unreferenced
+        FROM {CONTENTS}
+    """)[0]
+    queue = execute_query(f"""
+        SELECT COALESCE(content_status, 'none') AS content_status, count(*) AS attachments
+        FROM {ATTACHMENTS}
+        GROUP BY content_status
+    """)
+    return {
+        "contents": contents["contents"],
+        "stored_bytes": int(contents["stored_bytes"]),
+        # What the same attachments would take without deduplication
+        "referenced_bytes": int(contents["referenced_bytes"]),
+        "unreferenced": contents["unreferenced"],
+        "attachments": {row["content_status"]: row["attachments"] for row in queue},
+    }
+
+
+class ContentStore:
+    """Background thread deduplicating client-written blobs, collecting orphaned content and abandoned uploads."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_gc = 0.0
+
+    def start(self):
+        if not os.getenv("AZURE_BLOB_CONNECTION_STRING"):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="content-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def wake(self):
+        """An upload was queued; don't wait for the next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while ATTACHMENT_DEDUP_ENABLED and not self._stop.is_set() and deduplicate_next():
+                    pass
+                if time.monotonic() >= self._next_gc:
+                    self._next_gc = time.monotonic() + CONTENT_GC_INTERVAL
+                    collect_garbage()
+                    sweep_uploads()
+            except Exception:
+                logger.exception("Attachment content maintenance failed")
+            self._wake.wait(CONTENT_POLL_INTERVAL)
+            self._wake.clear()
+
+
+content_store = ContentStore()
+
+
+def main():
+    from logging_config import configure_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Content-addressed attachment storage")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Stored contents and deduplication queue")
+    sub.add_parser("dedup", help="Work through the deduplication queue once, then exit")
+    gc = sub.add_parser("gc", help="Delete unreferenced contents past the grace period")
+    gc.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    sweep = sub.add_parser("sweep", help="Remove authorized uploads that were never finalized")
+    sweep.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for key, value in storage_status().items():
+            print(f"{key:<18} {value}")
+    elif args.command == "dedup":
+        outcomes: Dict[str, int] = {}
+        while True:
+            outcome = deduplicate_next()
+            if outcome is None:
+                break
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        print(f"Deduplicated: {outcomes or 'queue empty'}")
+    elif args.command == "sweep":
+        total = 0
+        while True:
+            result = sweep_uploads(dry_run=args.dry_run)
+            total += result["uploads"]
+            if args.dry_run or result["uploads"] < CONTENT_GC_BATCH:
+                break
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {total} abandoned uploads")
+    else:
+        total = {"contents": 0, "bytes": 0}
+        while True:
+            result = collect_garbage(dry_run=args.dry_run)
+            total["contents"] += result["contents"]
+            total["bytes"] += result["bytes"]
+            if args.dry_run or result["contents"] < CONTENT_GC_BATCH:
+                break
+        print(f"{'Would delete' if args.dry_run else 'Deleted'} {total['contents']} contents, {total['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,9 @@ from typing import Optional
 from pydantic import BaseModel
 import base64
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Roles:
     CUSTOMER = "Customer"
@@ -53,7 +56,7 @@ async def verify_entra_token(request: Request) -> TokenData:
             role = user_data.get("role", Roles.CUSTOMER)
             valid_roles = [Roles.CUSTOMER, Roles.SALES_TECH, Roles.ADMIN]
             if role not in valid_roles:
-                print(f"Invalid role in token: {role}, defaulting to Customer")
+                logger.warning("Invalid role in token: %s, defaulting to Customer", role)
                 role = Roles.CUSTOMER
 
             # Return TokenData with actual user info
@@ -66,7 +69,7 @@ async def verify_entra_token(request: Request) -> TokenData:
             )
         except Exception as e:
             # If decoding fails, return anonymous user
-            print(f"Token decode error: {e}")
+            logger.warning("Token decode error: %s", e)
             return TokenData(
                 email="anonymous@stryker.com",
                 role=Roles.CUSTOMER,
@@ -0,0 +1,194 @@
+"""
+Central authorization: which service requests and customers a user may see.
+
+The demo token carries role, customer number and territories as the client
+stored them at login. Here they are resolved server-side instead, from
+tbl_globi_eu_am_99_customer_users and tbl_globi_eu_am_99_user_territories,
+and cached per user for AUTHZ_CACHE_TTL seconds (at most
+AUTHZ_CACHE_MAX_ENTRIES users, least recently used evicted). Users that are not
+provisioned in those tables (e.g. Entra accounts not yet onboarded) keep
+the claims from their token.
+
+Access rules (one place for every endpoint):
+- Admin: everything
+- SalesTech: rows in one of their territories
+- Customer: rows of their own customer number
+- Deactivated users: nothing, whatever their role
+
+Endpoints apply them inside their main query via scope_predicate(), so no
+separate ownership lookup is needed.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+
+from auth import verify_entra_token, Roles, TokenData
+from database import execute_query
+from named_queries import execute_named
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AUTHZ_CACHE_TTL = float(os.getenv("AUTHZ_CACHE_TTL", "300"))
+# The email comes from the client's token: bound the cache against made-up ones
+AUTHZ_CACHE_MAX_ENTRIES = int(os.getenv("AUTHZ_CACHE_MAX_ENTRIES", "5000"))
+
+ANONYMOUS_EMAIL = "anonymous@stryker.com"
+
+
+class UserAccess:
+    __slots__ = ("email", "role", "customer_number", "territories", "active")
+
+    def __init__(self, email: str, role: str, customer_number: Optional[str], territories: List[str],
+                 active: bool = True):
+        self.email = email
+        self.role = role
+        self.customer_number = customer_number
+        self.territories = territories
+        self.active = active
+
+    def __repr__(self):
+        return (f"UserAccess({self.email!r}, {self.role!r}, {self.customer_number!r}, {self.territories!r}, "
+                f"active={self.active!r})")
+
+
+class AccessResolver:
+    def __init__(self, ttl: float = AUTHZ_CACHE_TTL, max_entries: int = AUTHZ_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # email -> (expires_at, access), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, Optional[UserAccess]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, token_data: TokenData) -> UserAccess:
+        if token_data.email == ANONYMOUS_EMAIL:
+            return self._from_token(token_data)
+
+        key = token_data.email.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+        if entry is None or entry[0] < time.monotonic():
+            access = self._load(token_data.email)
+            with self._lock:
+                self._store(key, access)
+        else:
+            access = entry[1]
+
+        # Not provisioned in the user tables: fall back to the token's claims
+        return access if access is not None else self._from_token(token_data)
+
+    def invalidate(self, email: Optional[str] = None):
+        """Forget one user (after their role or territories changed) or everyone."""
+        with self._lock:
+            if email is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(email.lower(), None)
+
+    def _store(self, key: str, access: Optional[UserAccess]):
+        now = time.monotonic()
+        self._entries[key] = (now + self.ttl, access)
+        self._entries.move_to_end(key)
+        # Expired entries first (oldest at the front), then least recently used
+        while self._entries:
+            oldest_key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_key]
+
+    @staticmethod
+    def _from_token(token_data: TokenData) -> UserAccess:
+        return UserAccess(
+            token_data.email, token_data.role, token_data.customer_number, list(token_data.territories or [])
+        )
+
+    @staticmethod
+    def _load(email: str) -> Optional[UserAccess]:
+        query = """
+            SELECT
+                cu.email,
+                cu.role,
+                cu.customer_number,
+                cu.is_active,
+                COALESCE(
+                    array_agg(ut.territory_code ORDER BY ut.territory_code)
+                        FILTER (WHERE ut.territory_code IS NOT NULL),
+                    '{}'
+                ) AS territories
+            FROM regops_app.tbl_globi_eu_am_99_customer_users cu
+            LEFT JOIN regops_app.tbl_globi_eu_am_99_user_territories ut
+                ON ut.user_email = cu.email
+            WHERE cu.email = %s
+            GROUP BY cu.email, cu.role, cu.customer_number, cu.is_active
+        """
+        rows = execute_named("user_access", query, (email,))
+        if not rows:
+            return None
+        user = rows[0]
+        if not user['is_active']:
+            # Deactivated accounts: scope_predicate and require_access_role deny everything
+            return UserAccess(user['email'], user['role'] or Roles.CUSTOMER, None, [], active=False)
+        return UserAccess(user['email'], user['role'] or Roles.CUSTOMER, user['customer_number'], user['territories'])
+
+
+access_resolver = AccessResolver()
+
+
+def get_user_access(token_data: TokenData = Depends(verify_entra_token)) -> UserAccess:
+    """FastAPI dependency: the caller's resolved role, customer and territories."""
+    return access_resolver.resolve(token_data)
+
+
+def require_access_role(allowed_roles: List[str]):
+    """Like auth.require_role, but checks the server-side resolved role."""
+    def role_checker(access: UserAccess = Depends(get_user_access)) -> UserAccess:
+        if not access.active:
+            raise HTTPException(403, "Account is inactive")
+        if access.role not in allowed_roles:
+            raise HTTPException(403, f"Access denied. Required roles: {', '.join(allowed_roles)}")
+        return access
+    return role_checker
+
+
+def scope_predicate(
+    access: UserAccess,
+    territory_column: str = "sr.territory_code",
+    customer_column: str = "sr.customer_number"
+) -> Tuple[str, list]:
+    """
+    SQL condition (and its parameters) limiting rows to what `access` may see.
+    Works for any table with territory and customer number columns.
+    """
+    if not access.active:
+        return "FALSE", []
+    if access.role == Roles.ADMIN:
+        return "TRUE", []
+    if access.role == Roles.SALES_TECH:
+        return f"{territory_column} = ANY(%s)", [list(access.territories)]
+    if access.customer_number:
+        return f"{customer_column} = %s", [access.customer_number]
+    return "FALSE", []
+
+
+def require_request_access(request_id: int, access: UserAccess):
+    """Raise 404/403 unless `access` covers the service request (one query)."""
+    predicate, params = scope_predicate(access)
+    query = f"""
+        SELECT ({predicate}) AS allowed
+        FROM regops_app.tbl_globi_eu_am_99_service_requests sr
+        WHERE sr.id = %s
+    """
+    rows = execute_query(query, tuple(params + [request_id]))
+    if not rows:
+        raise HTTPException(404, "Request not found")
+    if not rows[0]['allowed']:
+        raise HTTPException(403, "Access denied")
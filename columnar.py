@@ -0,0 +1,36 @@
+"""
+Optional columnar JSON for list endpoints.
+
+Clients opt in with ?format=columnar or
+Accept: application/vnd.servicerequest.columnar+json and receive
+
+    {"columns": ["id", "request_code", ...], "rows": [[1, "SR-...", ...], ...], "count": N}
+
+instead of one object per row, so the column names are sent once.
+Existing clients keep getting the row-of-objects format.
+"""
+from typing import Optional, List, Any
+
+from fastapi import Query, Request
+from fastapi.responses import JSONResponse
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.servicerequest.columnar+json"
+
+
+def wants_columnar(
+    request: Request,
+    response_format: Optional[str] = Query(None, alias="format", description="'columnar' for column names once, then value arrays")
+) -> bool:
+    """Dependency: True when the client asked for the columnar format."""
+    if response_format:
+        return response_format.lower() == "columnar"
+    return COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def columnar_response(columns: List[str], rows: List[List[Any]]) -> JSONResponse:
+    # Values are already JSON-native (see database.execute_query_columnar), so
+    # skip FastAPI's per-value jsonable_encoder pass
+    return JSONResponse(
+        {"columns": columns, "rows": rows, "count": len(rows)},
+        headers={"Vary": "Accept"},
+    )
@@ -0,0 +1,187 @@
+"""
+Negotiated response compression (brotli or gzip).
+
+Responses smaller than COMPRESSION_MIN_SIZE, responses that already carry a
+Content-Encoding, partial (range) responses, and media that is already
+compressed (images, video, zip) are passed through untouched. Brotli is used when the `brotli` package is
+installed and the client accepts it; otherwise gzip.
+"""
+import gzip
+import os
+import zlib
+from typing import Optional, List, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+load_dotenv()
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# 4-5 is the sweet spot for on-the-fly brotli: gzip-like speed, ~15-20% smaller
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+SKIP_MEDIA_PREFIXES = ("image/", "video/", "audio/", "application/zip", "application/gzip",
+                       "application/x-gzip", "application/octet-stream", "text/event-stream")
+
+response_bytes_total = metrics.Counter(
+    "http_response_bytes_total", "Response body bytes before and after compression", ("stage", "encoding")
+)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, honouring q-values."""
+    if not accept_encoding:
+        return None
+    offered = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[token] = q
+
+    wildcard = offered.get("*", 0.0)
+    candidates = []
+    if brotli is not None:
+        candidates.append(("br", offered.get("br", wildcard)))
+    candidates.append(("gzip", offered.get("gzip", wildcard)))
+    encoding, q = max(candidates, key=lambda c: c[1])  # first wins ties, so br is preferred
+    return encoding if q > 0 else None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._impl = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._impl.process(data) + self._impl.flush()
+        return self._impl.compress(data) + self._impl.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._impl.finish() if self.encoding == "br" else self._impl.flush(zlib.Z_FINISH)
+
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware so streamed responses are compressed chunk by chunk."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _Responder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self._start: Optional[dict] = None
+        self._mode: Optional[str] = None  # 'passthrough' | 'stream'
+        self._compressor: Optional[_Compressor] = None
+
+    async def send(self, message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            self._start = message
+            return
+        if kind != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._mode is None:
+            headers = self._start.get("headers", [])
+            if self._skip(headers) or (not more_body and len(body) < self.minimum_size):
+                self._mode = "passthrough"
+                await self._send(self._start)
+                await self._send(message)
+                return
+
+            if not more_body:
+                compressed = compress_body(body, self.encoding)
+                self._count(len(body), len(compressed))
+                self._start["headers"] = self._rewrite_headers(headers, len(compressed))
+                await self._send(self._start)
+                await self._send({"type": "http.response.body", "body": compressed})
+                return
+
+            self._mode = "stream"
+            self._compressor = _Compressor(self.encoding)
+            self._start["headers"] = self._rewrite_headers(headers, None)
+            await self._send(self._start)
+
+        if self._mode == "passthrough":
+            await self._send(message)
+            return
+
+        chunk = self._compressor.compress(body) if body else b""
+        if not more_body:
+            chunk += self._compressor.finish()
+        self._count(len(body), len(chunk))
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    @staticmethod
+    def _skip(headers: List[Tuple[bytes, bytes]]) -> bool:
+        for name, value in headers:
+            if name in (b"content-encoding", b"content-range"):
+                return True
+            if name == b"content-type":
+                if value.decode("latin-1").lower().startswith(SKIP_MEDIA_PREFIXES):
+                    return True
+        return False
+
+    def _rewrite_headers(self, headers, length: Optional[int]):
+        kept = [(n, v) for n, v in headers if n not in (b"content-length", b"vary")]
+        vary = [v for n, v in headers if n == b"vary"]
+        vary_value = b", ".join(vary + [b"Accept-Encoding"]) if vary else b"Accept-Encoding"
+        kept.append((b"content-encoding", self.encoding.encode("latin-1")))
+        kept.append((b"vary", vary_value))
+        if length is not None:
+            kept.append((b"content-length", str(length).encode("latin-1")))
+        return kept
+
+    def _count(self, raw: int, compressed: int):
+        response_bytes_total.inc(raw, stage="uncompressed", encoding=self.encoding)
+        response_bytes_total.inc(compressed, stage="compressed", encoding=self.encoding)
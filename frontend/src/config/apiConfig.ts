@@ -20,6 +20,7 @@ export const API_ENDPOINTS = {
   SUBMIT_REQUEST: '/api/intake/submit',
   ISSUE_REASONS: '/api/intake/issue-reasons',
   REPAIRABILITY_STATUSES: '/api/intake/repairability-statuses',
+  INTAKE_BOOTSTRAP: '/api/intake/bootstrap',
 
   // Requests
   REQUESTS: '/api/requests',
@@ -28,6 +29,8 @@ export const API_ENDPOINTS = {
 
   // Upload
   UPLOAD: '/api/upload',
+  UPLOAD_AUTHORIZE: '/api/upload/authorize',
+  UPLOAD_FINALIZE: '/api/upload/finalize',
   DOWNLOAD: (requestId: number, filename: string) => `/api/download/${requestId}/${filename}`,
 
   // Lookups
@@ -4,6 +4,7 @@ import { API_ENDPOINTS } from '../config/apiConfig';
 import {
   Country,
   Language,
+  IntakeBootstrap,
   ServiceRequestCreate,
   ValidationResponse,
   SubmitResponse,
@@ -88,7 +89,6 @@ const IntakeForm: React.FC<IntakeFormProps> = ({ onSubmit: onSubmitCallback, onC
   const [showItemDropdown, setShowItemDropdown] = useState(false);
 
   useEffect(() => {
-    loadInitialData();
     // Detect user role from localStorage
     const userStr = localStorage.getItem('user');
     if (userStr) {
@@ -102,49 +102,21 @@ const IntakeForm: React.FC<IntakeFormProps> = ({ onSubmit: onSubmitCallback, onC
   }, []);
 
   useEffect(() => {
-    if (formData.country_code) {
-      loadCountryLanguages(formData.country_code);
-    }
-  }, [formData.country_code]);
-
-  useEffect(() => {
-    if (formData.language_code) {
-      loadIssueReasons(formData.language_code);
-    }
-  }, [formData.language_code]);
-
-  const loadInitialData = async () => {
-    try {
-      const countriesData = await apiService.get<Country[]>(
-        API_ENDPOINTS.COUNTRIES
-      );
-      setCountries(countriesData);
-    } catch (error) {
-      console.error('Failed to load countries:', error);
-    }
-  };
-
-  const loadCountryLanguages = async (countryCode: string) => {
-    try {
-      const languagesData = await apiService.get<Language[]>(
-        API_ENDPOINTS.COUNTRY_LANGUAGES(countryCode)
-      );
-      setLanguages(languagesData);
-    } catch (error) {
-      console.error('Failed to load languages:', error);
-    }
-  };
+    loadBootstrap(formData.country_code, formData.language_code);
+  }, [formData.country_code, formData.language_code]);
 
-  const loadIssueReasons = async (languageCode: string) => {
+  // Countries, languages and issue reasons in one request (revalidated via ETag)
+  const loadBootstrap = async (countryCode?: string, languageCode?: string) => {
     try {
-      const params = { language_code: languageCode };
-      const reasons = await apiService.get<Record<string, string[]>>(
-        API_ENDPOINTS.ISSUE_REASONS,
-        params
+      const data = await apiService.get<IntakeBootstrap>(
+        API_ENDPOINTS.INTAKE_BOOTSTRAP,
+        { country: countryCode || undefined, lang: languageCode || undefined }
       );
-      setIssueReasons(reasons);
+      setCountries(data.countries);
+      setLanguages(data.languages);
+      setIssueReasons(data.issue_reasons);
     } catch (error) {
-      console.error('Failed to load issue reasons:', error);
+      console.error('Failed to load form data:', error);
     }
   };
 
@@ -1,5 +1,5 @@
 import axios, { AxiosInstance } from 'axios';
-import { API_BASE_URL } from '../config/apiConfig';
+import { API_BASE_URL, API_ENDPOINTS } from '../config/apiConfig';
 
 class ApiService {
   private api: AxiosInstance;
@@ -82,6 +82,47 @@ class ApiService {
     });
     return response.data;
   }
+
+  // Attachments go straight to blob storage: the API hands out a write-only
+  // URL per file and records the files once they are uploaded
+  private async sha256(file: File): Promise<string | undefined> {
+    // crypto.subtle is only there on https (and localhost); without it the file is simply uploaded
+    if (!window.crypto?.subtle) return undefined;
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  async uploadAttachments(requestId: number, files: File[]): Promise<any> {
+    const hashes = await Promise.all(files.map((file) => this.sha256(file)));
+    const { files: targets } = await this.post<any>(API_ENDPOINTS.UPLOAD_AUTHORIZE, {
+      request_id: requestId,
+      files: files.map((file, i) => ({
+        filename: file.name,
+        size: file.size,
+        content_type: file.type || undefined,
+        sha256: hashes[i],
+      })),
+    });
+
+    // Plain axios: the SAS URL carries its own authorization.
+    // Files the server already has are not uploaded again.
+    await Promise.all(
+      targets.map((target: any, i: number) =>
+        target.exists ? undefined : axios.put(target.upload_url, files[i], { headers: target.headers })
+      )
+    );
+
+    const sha256: Record<string, string> = {};
+    targets.forEach((target: any, i: number) => {
+      if (target.exists) sha256[target.blob_path] = hashes[i] as string;
+    });
+
+    return this.post(API_ENDPOINTS.UPLOAD_FINALIZE, {
+      request_id: requestId,
+      blob_paths: targets.map((target: any) => target.blob_path),
+      sha256,
+    });
+  }
 }
 
 export default new ApiService();
@@ -23,11 +23,27 @@ export interface Language {
 export interface LegalDocument {
   DocumentType: string;
   DocumentURL: string;
-  DocumentContent: string;
+  ContentURL: string;
   Version: string;
   EffectiveDate: string;
 }
 
+export interface IntakeBootstrap {
+  version: string;
+  country_code: string | null;
+  language_code: string;
+  countries: Country[];
+  languages: Language[];
+  legal_documents: LegalDocument[];
+  issue_reasons: Record<string, string[]>;
+  repairability_statuses: {
+    status_code: string;
+    status_name: string;
+    description?: string;
+    repair_location?: string;
+  }[];
+}
+
 export interface Item {
   ItemNumber: string;
   ItemDescription: string;
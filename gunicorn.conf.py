@@ -0,0 +1,101 @@
+"""
+Production server profile: gunicorn managing uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+Worker count defaults to one per CPU (2 * CPU + 1 is for sync workers; each
+uvicorn worker already overlaps I/O). Every worker gets an equal share of the
+database connection budget (see database.pool_size). With more than one
+worker, /metrics adds up every worker's series through PROMETHEUS_MULTIPROC_DIR
+(see metrics.py).
+"""
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def _available_cpus() -> int:
+    """CPUs this container may actually use (affinity mask and cgroup v2 quota)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(int(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or _available_cpus()
+# Workers read this to size their DB pool
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+if workers > 1:
+    # Set before the app is imported: metrics reads it at import time
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"service-request-metrics-{os.getpid()}")
+    )
+
+# Import the app once in the master so workers share its memory copy-on-write
+preload_app = True
+
+# SIGTERM: stop accepting, let in-flight requests finish, then run shutdown hooks
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers now and then to cap slow leaks; jitter avoids restarting all at once
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+accesslog = None
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear_multiproc_dir()
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated out of the GC's reach, so
+    # collections in the workers don't touch (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+    server.log.info(
+        "Serving with %s workers, %s DB connections each",
+        workers, _pool_size_hint()
+    )
+
+
+def post_fork(server, worker):
+    # Never inherit a pool from the master - connections must not cross processes
+    import database
+    database.close_pool(close_connections=False)
+
+
+def worker_exit(server, worker):
+    import database
+    database.close_pool()
+
+
+def child_exit(server, worker):
+    # Runs in the master once the worker is gone
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def _pool_size_hint():
+    try:
+        import database
+        return database.pool_size()
+    except Exception:
+        return "?"
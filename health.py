@@ -0,0 +1,175 @@
+"""
+Dependency health probes for /health/ready.
+
+Probes run on a background thread every HEALTH_PROBE_INTERVAL seconds, each
+bounded by HEALTH_PROBE_TIMEOUT. The endpoints only read the cached results,
+so health checks from Render and uptime monitors never touch the database
+or blob storage themselves.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Any, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+# A cached result older than this counts as failed (the prober itself is stuck)
+HEALTH_MAX_AGE = float(os.getenv("HEALTH_MAX_AGE", str(HEALTH_PROBE_INTERVAL * 4)))
+# Dependencies that must be up for /health/ready to return 200
+HEALTH_REQUIRED = [d.strip() for d in os.getenv("HEALTH_REQUIRED", "database").split(",") if d.strip()]
+
+
+class ProbeNotConfigured(Exception):
+    pass
+
+
+def probe_database():
+    from database import execute_scalar
+    execute_scalar("SELECT 1")
+
+
+def probe_replica():
+    """Measure the read replica's lag; also refreshes the lag the query router uses."""
+    import database
+    if not database.DB_REPLICA_URL:
+        raise ProbeNotConfigured()
+    pool = database.get_replica_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        lag = database.measure_replica_lag(conn)
+        conn.rollback()
+    except Exception:
+        broken = True
+        database.replica_router.mark_down()
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+    if not database.replica_router.record_lag(lag):
+        raise RuntimeError(f"replica lag {lag}s exceeds {database.DB_REPLICA_MAX_LAG}s")
+
+
+_blob_client = None
+
+
+def probe_blob_storage():
+    global _blob_client
+    conn_str = os.getenv("AZURE_BLOB_CONNECTION_STRING")
+    if not conn_str:
+        raise ProbeNotConfigured()
+    if _blob_client is None:
+        from azure.storage.blob import BlobServiceClient
+        _blob_client = BlobServiceClient.from_connection_string(conn_str)
+    # One cheap authenticated round trip
+    _blob_client.get_account_information()
+
+
+class HealthMonitor:
+    def __init__(self, probes: Dict[str, Callable[[], None]], interval: float = HEALTH_PROBE_INTERVAL,
+                 timeout: float = HEALTH_PROBE_TIMEOUT):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self._results: Dict[str, Dict[str, Any]] = {
+            name: {"status": "unknown", "latency_ms": None, "checked_at": None, "error": None}
+            for name in probes
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max_workers=len(probes) or 1, thread_name_prefix="health-probe")
+        self._in_flight: Dict[str, Any] = {}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.timeout + 1)
+            self._thread = None
+
+    def run_once(self):
+        """Run all probes concurrently and cache their outcome."""
+        futures = {}
+        for name, probe in self.probes.items():
+            previous = self._in_flight.get(name)
+            if previous is not None and not previous.done():
+                # Last probe is still hanging - don't pile up more threads behind it
+                self._store(name, "timeout", None, "previous probe still running")
+                continue
+            futures[name] = (self._executor.submit(self._timed, probe), time.perf_counter())
+            self._in_flight[name] = futures[name][0]
+
+        for name, (future, started) in futures.items():
+            remaining = max(self.timeout - (time.perf_counter() - started), 0)
+            try:
+                latency = future.result(timeout=remaining)
+                self._store(name, "ok", latency, None)
+            except FutureTimeout:
+                self._store(name, "timeout", None, f"no response within {self.timeout:.0f}s")
+            except ProbeNotConfigured:
+                self._store(name, "not_configured", None, None)
+            except Exception as e:
+                self._store(name, "error", None, str(e))
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            snapshot = {name: dict(result) for name, result in self._results.items()}
+        for result in snapshot.values():
+            checked_at = result["checked_at"]
+            result["age_s"] = round(now - checked_at, 1) if checked_at else None
+            if checked_at and now - checked_at > HEALTH_MAX_AGE and result["status"] == "ok":
+                result["status"] = "stale"
+        return snapshot
+
+    def is_ready(self, results: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        results = results or self.results()
+        return all(results.get(name, {}).get("status") == "ok" for name in HEALTH_REQUIRED)
+
+    @staticmethod
+    def _timed(probe: Callable[[], None]) -> float:
+        start = time.perf_counter()
+        probe()
+        return time.perf_counter() - start
+
+    def _store(self, name: str, status: str, latency: Optional[float], error: Optional[str]):
+        with self._lock:
+            previous = self._results.get(name, {}).get("status")
+            self._results[name] = {
+                "status": status,
+                "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+                "checked_at": time.time(),
+                "error": error,
+            }
+        if status != previous and previous != "unknown":
+            log = logger.info if status in ("ok", "not_configured") else logger.warning
+            log("Dependency %s is now %s", name, status, extra={"error": error})
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Health probe cycle failed")
+            self._stop.wait(self.interval)
+
+
+health_monitor = HealthMonitor({
+    "database": probe_database,
+    "replica": probe_replica,
+    "blob_storage": probe_blob_storage,
+})
@@ -0,0 +1,223 @@
+"""
+Precomputed reference data for the intake form.
+
+IntakeForm.tsx used to load countries, the country's languages, legal
+documents, issue reasons and repairability statuses with five requests (five
+DB round trips) before the user could type. /api/intake/bootstrap returns all
+of it in one response, served from memory.
+
+Payloads are built for every (country, language) pair - and for each
+language without a country - in one pass over the reference tables, and
+serialized once. Each carries a `version` (hash of its content, also the
+ETag), so clients keep it and revalidate with If-None-Match for free.
+
+Every INTAKE_BOOTSTRAP_REFRESH seconds a single query digests the reference
+tables; the payloads are rebuilt only when that digest changes.
+"""
+import json
+import logging
+import os
+import threading
+from hashlib import sha256
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+
+import metrics
+import legal_assets
+from database import get_db_connection
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTAKE_BOOTSTRAP_REFRESH = float(os.getenv("INTAKE_BOOTSTRAP_REFRESH", "60"))
+
+intake_bootstrap_builds_total = metrics.Counter(
+    "intake_bootstrap_builds_total", "Rebuilds of the intake bootstrap payloads", ("outcome",)
+)
+
+# Legal documents by their metadata only; document_content is large and already in content_sha256
+DIGEST_QUERY = """
+    SELECT md5(concat_ws('|',
+        (SELECT string_agg(md5(t::text), ',' ORDER BY t.country_code)
+         FROM regops_app.tbl_globi_eu_am_99_countries t),
+        (SELECT string_agg(md5(t::text), ',' ORDER BY t.language_code)
+         FROM regops_app.tbl_globi_eu_am_99_languages t),
+        (SELECT string_agg(md5(t::text), ',' ORDER BY t.id)
+         FROM regops_app.tbl_globi_eu_am_99_issue_reasons t),
+        (SELECT string_agg(md5(t::text), ',' ORDER BY t.status_code)
+         FROM regops_app.tbl_globi_eu_am_99_repairability_statuses t),
+        (SELECT string_agg(concat_ws(',', t.id, t.country_code, t.language_code, t.document_type,
+                                     t.document_url, t.version, t.effective_date, t.is_active,
+                                     t.content_sha256, t.content_type), ';' ORDER BY t.id)
+         FROM regops_app.tbl_globi_eu_am_99_legal_documents t)
+    )) AS digest
+"""
+
+COUNTRIES_QUERY = """
+    SELECT country_code, country_name, default_language, supported_languages
+    FROM regops_app.tbl_globi_eu_am_99_countries
+    WHERE is_active = true
+    ORDER BY country_name
+"""
+
+LANGUAGES_QUERY = """
+    SELECT language_code, language_name
+    FROM regops_app.tbl_globi_eu_am_99_languages
+    WHERE is_active = true
+    ORDER BY language_code
+"""
+
+LEGAL_QUERY = """
+    SELECT country_code, language_code, document_type, document_url, version, effective_date,
+           content_sha256, content_size, content_type
+    FROM regops_app.tbl_globi_eu_am_99_legal_documents
+    WHERE is_active = true
+    ORDER BY id
+"""
+
+ISSUE_REASONS_QUERY = """
+    SELECT language_code, main_reason, sub_reason
+    FROM regops_app.tbl_globi_eu_am_99_issue_reasons
+    WHERE is_active = true
+    ORDER BY display_order, main_reason, sub_reason
+"""
+
+STATUSES_QUERY = """
+    SELECT status_code, status_name, description, repair_location
+    FROM regops_app.tbl_globi_eu_am_99_repairability_statuses
+    WHERE is_active = true
+    ORDER BY status_name
+"""
+
+
+class Payload:
+    __slots__ = ("version", "body")
+
+    def __init__(self, data: Dict[str, Any]):
+        content = json.dumps(jsonable_encoder(data), sort_keys=True, separators=(",", ":"))
+        self.version = sha256(content.encode()).hexdigest()[:16]
+        # Version first, so it is visible at a glance
+        self.body = ('{"version":"%s",%s' % (self.version, content[1:])).encode()
+
+
+def _supported_languages(country: Dict[str, Any]) -> List[str]:
+    try:
+        return json.loads(country["supported_languages"] or "[]")
+    except ValueError:
+        return []
+
+
+def build_payloads(countries: List[Dict[str, Any]], languages: List[Dict[str, Any]],
+                   legal: List[Dict[str, Any]], reasons: List[Dict[str, Any]],
+                   statuses: List[Dict[str, Any]]) -> Dict[Tuple[Optional[str], str], Payload]:
+    """(country_code or None, language_code) -> Payload for every active country and language."""
+    # Same shape as /api/intake/issue-reasons: main reason -> sub reasons
+    reasons_by_language: Dict[str, Dict[str, List[str]]] = {}
+    for row in reasons:
+        grouped = reasons_by_language.setdefault(row["language_code"], {})
+        subs = grouped.setdefault(row["main_reason"], [])
+        if row["sub_reason"]:
+            subs.append(row["sub_reason"])
+
+    legal_by_key: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for row in legal:
+        document = {k: v for k, v in row.items() if k not in ("country_code", "language_code")}
+        document["content_url"] = legal_assets.asset_url(row["content_sha256"], row["content_type"])
+        legal_by_key.setdefault((row["country_code"], row["language_code"]), []).append(document)
+
+    payloads = {}
+    for country in [None] + countries:
+        if country is None:
+            country_languages = languages
+        else:
+            supported = _supported_languages(country)
+            country_languages = [l for l in languages if l["language_code"] in supported]
+        for language in languages:
+            code = language["language_code"]
+            country_code = country["country_code"] if country else None
+            payloads[(country_code, code)] = Payload({
+                "country_code": country_code,
+                "language_code": code,
+                "countries": countries,
+                "languages": country_languages,
+                "legal_documents": legal_by_key.get((country_code, code), []),
+                "issue_reasons": reasons_by_language.get(code, {}),
+                "repairability_statuses": statuses,
+            })
+    return payloads
+
+
+class IntakeBootstrap:
+    def __init__(self):
+        self._payloads: Optional[Dict[Tuple[Optional[str], str], Payload]] = None
+        self._defaults: Dict[str, str] = {}
+        self._digest: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="intake-bootstrap", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rebuild if the reference tables changed. Returns whether it rebuilt."""
+        with self._lock:
+            with get_db_connection(read_only=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(DIGEST_QUERY)
+                digest = cursor.fetchone()[0]
+                if digest == self._digest and self._payloads is not None and not force:
+                    intake_bootstrap_builds_total.inc(outcome="unchanged")
+                    return False
+                tables = []
+                for query in (COUNTRIES_QUERY, LANGUAGES_QUERY, LEGAL_QUERY, ISSUE_REASONS_QUERY, STATUSES_QUERY):
+                    cursor.execute(query)
+                    columns = [c[0] for c in cursor.description]
+                    tables.append([dict(zip(columns, row)) for row in cursor.fetchall()])
+
+            self._payloads = build_payloads(*tables)
+            self._defaults = {c["country_code"]: c["default_language"] for c in tables[0]}
+            self._digest = digest
+            intake_bootstrap_builds_total.inc(outcome="rebuilt")
+            logger.info("Intake bootstrap rebuilt", extra={"payloads": len(self._payloads)})
+            return True
+
+    def get(self, country_code: Optional[str], language_code: Optional[str]) -> Optional[Payload]:
+        """Payload for the form; language defaults to the country's. None if unknown."""
+        if self._payloads is None:
+            self.refresh()
+        if not language_code:
+            language_code = self._defaults.get(country_code) or "en"
+        return self._payloads.get((country_code or None, language_code))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "payloads": len(self._payloads or {}),
+            "digest": self._digest,
+            "refresh_interval": INTAKE_BOOTSTRAP_REFRESH,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                intake_bootstrap_builds_total.inc(outcome="failed")
+                logger.error("Intake bootstrap refresh failed: %s", e)
+            self._stop.wait(INTAKE_BOOTSTRAP_REFRESH)
+
+
+intake_bootstrap = IntakeBootstrap()
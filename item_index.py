@@ -0,0 +1,392 @@
+"""
+Optional in-process index of the item catalog (tbl_globi_eu_am_99_items).
+
+With ITEM_INDEX_ENABLED=true every worker loads the catalog at startup and
+answers the typeahead lookups and item validation from memory:
+
+- records are `__slots__` objects; repeated values (product family, status,
+  eligibility lists) are interned
+- serial, lot and item number each have an array of record ids sorted by that
+  key and then item_number, in code-point order like the database fallback in
+  routers/lookups.py (ORDER BY ... COLLATE "C"), so both return the same rows
+  (exact lookups by bisection, ordered scans)
+- trigram postings per searchable field hold positions in that sorted array,
+  so a LIKE '%q%' search walks the candidates in ORDER BY order and stops at
+  the LIMIT
+
+The index follows modified_date (maintained by the update trigger) every
+ITEM_INDEX_REFRESH_INTERVAL seconds and is rebuilt from scratch every
+ITEM_INDEX_FULL_RELOAD seconds, which also picks up deleted items. Until the
+first load finishes every call returns None and callers use the database.
+"""
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ITEM_INDEX_ENABLED = os.getenv("ITEM_INDEX_ENABLED", "false").lower() == "true"
+ITEM_INDEX_REFRESH_INTERVAL = float(os.getenv("ITEM_INDEX_REFRESH_INTERVAL", "30"))
+ITEM_INDEX_FULL_RELOAD = float(os.getenv("ITEM_INDEX_FULL_RELOAD", "3600"))
+# Re-read rows modified slightly before the last seen timestamp: inserts get
+# their transaction's start time, so a long transaction can commit "in the past"
+ITEM_INDEX_REFRESH_OVERLAP = float(os.getenv("ITEM_INDEX_REFRESH_OVERLAP", "120"))
+# Rebuild once this share of records is superseded or waiting in the delta
+_MAX_STALE_RATIO = 0.1
+
+FIELDS = (
+    "item_number", "item_description", "serial_number", "lot_number", "product_family",
+    "product_line", "is_serviceable", "repairability_status", "install_base_status",
+    "eligibility_countries",
+)
+# Low-cardinality columns worth interning
+_INTERNED = ("product_family", "product_line", "repairability_status", "install_base_status",
+             "eligibility_countries")
+
+SERIAL_LOOKUP_FIELDS = ("serial_number", "item_number", "item_description", "lot_number")
+
+
+class ItemRecord:
+    __slots__ = FIELDS
+
+    def __init__(self, values: Iterable[Any]):
+        for name, value in zip(FIELDS, values):
+            if name in _INTERNED and value is not None:
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, name) for name in FIELDS)
+
+    def as_dict(self, fields: Iterable[str] = FIELDS) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in fields}
+
+
+def trigrams(value: Optional[str]) -> set:
+    if not value:
+        return set()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _contains(value: Optional[str], q: str) -> bool:
+    return value is not None and q in value
+
+
+class _Field:
+    """Record ids in key order, plus trigram postings over positions in that order."""
+
+    def __init__(self, key: str, text: Callable[[ItemRecord], Iterable[Optional[str]]]):
+        self.key = key
+        self.text = text
+        self.order = array("I")
+        self.postings: Dict[str, array] = {}
+
+    def sort_key(self, records: List[ItemRecord]):
+        key = self.key
+        # item_number (unique) breaks ties so equal keys come back in a stable order
+        return lambda i: (getattr(records[i], key), records[i].item_number)
+
+    def build(self, records: List[ItemRecord]):
+        rids = [i for i, record in enumerate(records) if getattr(record, self.key) is not None]
+        rids.sort(key=self.sort_key(records))
+        postings: Dict[str, array] = {}
+        for position, rid in enumerate(rids):
+            grams = set()
+            for value in self.text(records[rid]):
+                grams |= trigrams(value)
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("I")
+                posting.append(position)
+        self.order = array("I", rids)
+        self.postings = postings
+
+    def candidates(self, q: str) -> Iterable[int]:
+        """Positions (ascending, so in key order) that may contain `q`."""
+        if len(q) < 3:
+            return range(len(self.order))
+        smallest = None
+        for gram in trigrams(q):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return ()
+            if smallest is None or len(posting) < len(smallest):
+                smallest = posting
+        return smallest
+
+
+class _Catalog:
+    """
+    Records loaded by the last full build are indexed by every _Field; rows
+    changed since then sit in `delta` and are searched linearly until the
+    next rebuild. Superseded versions stay in place with live=0.
+    """
+
+    def __init__(self):
+        self.records: List[ItemRecord] = []
+        self.live = bytearray()
+        self.by_item: Dict[str, int] = {}
+        self.delta: List[int] = []
+        self.fields = {
+            "serial": _Field("serial_number", lambda r: (r.serial_number,)),
+            "lot": _Field("lot_number", lambda r: (r.lot_number,)),
+            "item": _Field("item_number", lambda r: (r.item_number, r.item_description)),
+        }
+        self.max_modified = None
+        self.dead = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple]) -> "_Catalog":
+        catalog = cls()
+        for row in rows:
+            catalog._append(ItemRecord(row[:-1]), row[-1])
+        for field in catalog.fields.values():
+            field.build(catalog.records)
+        return catalog
+
+    def apply(self, rows: Iterable[tuple]) -> int:
+        """Upsert changed rows into the delta; returns how many actually changed."""
+        changed = 0
+        with self.lock:
+            for row in rows:
+                record = ItemRecord(row[:-1])
+                old = self.by_item.get(record.item_number)
+                if old is not None:
+                    if self.records[old].values() == record.values():
+                        continue
+                    self.live[old] = 0
+                    self.dead += 1
+                self.delta.append(self._append(record, row[-1]))
+                changed += 1
+        return changed
+
+    def needs_rebuild(self) -> bool:
+        return self.dead + len(self.delta) > len(self.records) * _MAX_STALE_RATIO
+
+    def _append(self, record: ItemRecord, modified_date) -> int:
+        rid = len(self.records)
+        self.records.append(record)
+        self.live.append(1)
+        self.by_item[record.item_number] = rid
+        if modified_date is not None and (self.max_modified is None or modified_date > self.max_modified):
+            self.max_modified = modified_date
+        return rid
+
+    def search(self, field_name: str, q: str, matches: Callable[[ItemRecord, str], bool],
+               limit: int) -> List[ItemRecord]:
+        field = self.fields[field_name]
+        records, live, order = self.records, self.live, field.order
+        with self.lock:
+            # Candidates come in key order, so stop as soon as LIMIT rows matched
+            hits = []
+            for position in field.candidates(q):
+                rid = order[position]
+                if live[rid] and matches(records[rid], q):
+                    hits.append(records[rid])
+                    if len(hits) >= limit:
+                        break
+
+            changed = [
+                records[rid] for rid in self.delta
+                if live[rid] and getattr(records[rid], field.key) is not None and matches(records[rid], q)
+            ]
+        if changed:
+            hits = sorted(hits + changed, key=lambda r: (getattr(r, field.key), r.item_number))[:limit]
+        return hits
+
+    def find(self, field_name: str, value: str) -> Optional[ItemRecord]:
+        field = self.fields[field_name]
+        with self.lock:
+            records, order = self.records, field.order
+            i = bisect.bisect_left(order, (value, ""), key=field.sort_key(records))
+            while i < len(order) and getattr(records[order[i]], field.key) == value:
+                if self.live[order[i]]:
+                    return records[order[i]]
+                i += 1
+            for rid in self.delta:
+                if self.live[rid] and getattr(records[rid], field.key) == value:
+                    return records[rid]
+        return None
+
+    def get(self, item_number: str) -> Optional[ItemRecord]:
+        with self.lock:
+            rid = self.by_item.get(item_number)
+            return self.records[rid] if rid is not None and self.live[rid] else None
+
+    def memory_footprint(self) -> Dict[str, Any]:
+        """Approximate resident size (sys.getsizeof, shared strings counted once)."""
+        with self.lock:
+            seen = set()
+
+            def size(obj) -> int:
+                if id(obj) in seen:
+                    return 0
+                seen.add(id(obj))
+                return sys.getsizeof(obj)
+
+            records = sys.getsizeof(self.records) + sys.getsizeof(self.live) + sys.getsizeof(self.delta)
+            for record in self.records:
+                records += size(record)
+                for name in FIELDS:
+                    value = getattr(record, name)
+                    if isinstance(value, str):
+                        records += size(value)
+            lookup = sys.getsizeof(self.by_item)
+            orders = sum(sys.getsizeof(f.order) for f in self.fields.values())
+            postings = 0
+            for field in self.fields.values():
+                postings += sys.getsizeof(field.postings)
+                for gram, posting in field.postings.items():
+                    postings += size(gram) + sys.getsizeof(posting)
+
+        total = records + lookup + orders + postings
+        items = len(self.by_item)
+        return {
+            "items": items,
+            "bytes": total,
+            "records_bytes": records,
+            "item_lookup_bytes": lookup,
+            "sorted_orders_bytes": orders,
+            "trigram_postings_bytes": postings,
+            "mb_per_million_items": round(total / items * 1_000_000 / 2**20, 1) if items else None,
+        }
+
+
+def _read_rows(consume: Callable[[Iterable[tuple]], Any], since=None):
+    """Stream item rows (FIELDS + modified_date) into `consume` via a server-side cursor."""
+    from database import get_db_connection
+    query = f"SELECT {', '.join(FIELDS)}, modified_date FROM regops_app.tbl_globi_eu_am_99_items"
+    params = None
+    if since is not None:
+        query += " WHERE modified_date >= %s"
+        params = (since,)
+    with get_db_connection() as conn:
+        cursor = conn.cursor(name="item_index_load")
+        cursor.itersize = 10000
+        cursor.execute(query, params)
+        return consume(cursor)
+
+
+class ItemIndex:
+    def __init__(self):
+        self._catalog: Optional[_Catalog] = None
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._catalog is not None
+
+    def start(self):
+        if not ITEM_INDEX_ENABLED or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="item-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def load(self):
+        start = time.perf_counter()
+        catalog = _read_rows(_Catalog.build)
+        self._catalog = catalog
+        self._loaded_at = self._refreshed_at = time.time()
+        logger.info("Item index loaded", extra={
+            "items": len(catalog.by_item), "seconds": round(time.perf_counter() - start, 2)
+        })
+
+    def refresh(self):
+        catalog = self._catalog
+        if catalog is None or catalog.max_modified is None:
+            self.load()
+            return
+        since = catalog.max_modified - timedelta(seconds=ITEM_INDEX_REFRESH_OVERLAP)
+        changed = _read_rows(catalog.apply, since)
+        self._refreshed_at = time.time()
+        if changed:
+            logger.info("Item index refreshed", extra={"changed": changed})
+        if catalog.needs_rebuild():
+            self.load()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._catalog is None or time.time() - self._loaded_at > ITEM_INDEX_FULL_RELOAD:
+                    self.load()
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception("Item index refresh failed")
+            self._stop.wait(ITEM_INDEX_REFRESH_INTERVAL)
+
+    # Queries - all return None while the index is not loaded
+
+    def search_serial(self, q: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        catalog = self._catalog
+        if catalog is None:
+            return None
+        hits = catalog.search("serial", q, lambda r, q: _contains(r.serial_number, q), limit)
+        return [r.as_dict(SERIAL_LOOKUP_FIELDS) for r in hits]
+
+    def search_lot(self, q: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        catalog = self._catalog
+        if catalog is None:
+            return None
+        hits = catalog.search("lot", q, lambda r, q: _contains(r.lot_number, q), limit)
+        # item_number is the primary key, so each (lot, item) group is a single item
+        return [{**r.as_dict(("lot_number", "item_number", "item_description")), "item_count": 1} for r in hits]
+
+    def search_item(self, q: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        catalog = self._catalog
+        if catalog is None:
+            return None
+        hits = catalog.search(
+            "item", q, lambda r, q: _contains(r.item_number, q) or _contains(r.item_description, q), limit
+        )
+        return [{**r.as_dict(("item_number", "item_description")), "instance_count": 1} for r in hits]
+
+    def find_by_serial(self, serial_number: str) -> Optional[Dict[str, Any]]:
+        catalog = self._catalog
+        record = catalog.find("serial", serial_number) if catalog else None
+        return record.as_dict() if record else None
+
+    def get_item(self, item_number: str) -> Optional[Dict[str, Any]]:
+        catalog = self._catalog
+        record = catalog.get(item_number) if catalog else None
+        return record.as_dict() if record else None
+
+    def stats(self) -> Dict[str, Any]:
+        catalog = self._catalog
+        if catalog is None:
+            return {"enabled": ITEM_INDEX_ENABLED, "ready": False}
+        return {
+            "enabled": ITEM_INDEX_ENABLED,
+            "ready": True,
+            "loaded_at": self._loaded_at,
+            "refreshed_at": self._refreshed_at,
+            "max_modified_date": catalog.max_modified.isoformat() if catalog.max_modified else None,
+            "superseded_records": catalog.dead,
+            "delta_records": len(catalog.delta),
+            "memory": catalog.memory_footprint(),
+        }
+
+
+item_index = ItemIndex()
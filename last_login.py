@@ -0,0 +1,114 @@
+"""
+Write-behind buffer for login bookkeeping.
+
+A successful login used to run its own UPDATE of last_login_date before it
+could answer. Logins now only note the time (and, when the stored password
+was plaintext or an outdated hash, its replacement) in memory; a background
+thread writes everything noted in one UPDATE every LAST_LOGIN_FLUSH_INTERVAL
+seconds. Repeated logins of one user between flushes are one row.
+
+A replacement hash is only written if the stored value is still the one the
+password was verified against, so a password changed in the meantime wins.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from database import get_db_connection
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LAST_LOGIN_FLUSH_INTERVAL = float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", "5"))
+
+UPDATE_QUERY = """
+    UPDATE regops_app.tbl_globi_eu_am_99_customer_users cu
+    SET last_login_date = v.logged_in,
+        password_hash = CASE
+            WHEN v.new_hash IS NOT NULL AND cu.password_hash = v.old_hash THEN v.new_hash
+            ELSE cu.password_hash
+        END
+    FROM unnest(%s::varchar[], %s::timestamp[], %s::varchar[], %s::varchar[])
+        AS v(email, logged_in, old_hash, new_hash)
+    WHERE cu.email = v.email
+"""
+
+
+class LastLoginWriter:
+    """Background thread flushing buffered logins every LAST_LOGIN_FLUSH_INTERVAL seconds."""
+
+    def __init__(self, flush_interval: float = LAST_LOGIN_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # email -> (logged_in, old_hash, new_hash)
+        self._buffer: Dict[str, Tuple[datetime, Optional[str], Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="last-login-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and write what is still buffered."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        self.flush()
+
+    def record(self, email: str, old_hash: Optional[str] = None, new_hash: Optional[str] = None):
+        """Note a successful login. Never touches the database."""
+        with self._lock:
+            previous = self._buffer.get(email)
+            if new_hash is None and previous is not None:
+                # Keep a pending rehash from an earlier login
+                old_hash, new_hash = previous[1], previous[2]
+            self._buffer[email] = (datetime.now(), old_hash, new_hash)
+
+    def flush(self) -> int:
+        """Write all buffered logins in one statement. Returns users updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, {}
+            if not batch:
+                return 0
+
+            emails = sorted(batch)
+            try:
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(UPDATE_QUERY, (
+                        emails,
+                        [batch[email][0] for email in emails],
+                        [batch[email][1] for email in emails],
+                        [batch[email][2] for email in emails],
+                    ))
+                return len(batch)
+            except Exception as e:
+                logger.error("Last login flush failed (%d users): %s", len(batch), e)
+                # Retry with the next flush; newer logins noted meanwhile win
+                with self._lock:
+                    for email, entry in batch.items():
+                        self._buffer.setdefault(email, entry)
+                return 0
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+last_login_writer = LastLoginWriter()
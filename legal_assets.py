@@ -0,0 +1,279 @@
+"""
+Legal documents as immutable, content-addressed static files.
+
+Every version of a Terms & Conditions or Privacy Policy text is published to
+LEGAL_ASSET_DIR as <sha256>.html / .txt plus precompressed .gz (and .br when
+brotli is installed) variants, and served from /api/legal/<sha256>.<ext>.
+The name changes whenever the text does, so responses are cacheable forever
+(Cache-Control: immutable); the legal endpoint only returns version,
+effective_date and the asset URL. Requires
+migrations/add_legal_document_assets.sql.
+
+The database stays the source of the texts. Each instance publishes the active
+documents at startup, and any other version (or a file lost with Render's
+ephemeral disk) the first time it is requested. Names that turn out not to
+exist are remembered for LEGAL_ASSET_MISS_TTL seconds, and lookups in the
+database are rate limited per client IP (RATE_LIMIT_LEGAL), so requests for
+made-up names can't keep the database busy.
+
+    python legal_assets.py publish          # write the active versions missing from LEGAL_ASSET_DIR
+    python legal_assets.py publish --all    # also superseded ones, e.g. into a CDN origin directory
+"""
+import argparse
+import gzip
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+import metrics
+import rate_limit
+from compression import choose_encoding
+from database import execute_query
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LEGAL_ASSET_DIR = os.getenv(
+    "LEGAL_ASSET_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "legal")
+)
+LEGAL_ASSET_MAX_AGE = int(os.getenv("LEGAL_ASSET_MAX_AGE", "31536000"))
+LEGAL_ASSET_PATH = "/api/legal"
+# Names not found in the database are answered 404 without asking it again for this long
+LEGAL_ASSET_MISS_TTL = float(os.getenv("LEGAL_ASSET_MISS_TTL", "300"))
+LEGAL_ASSET_MISS_MAX_ENTRIES = 10000
+
+EXTENSIONS = {"text/html": "html", "text/plain": "txt"}
+MEDIA_TYPES = {ext: media_type for media_type, ext in EXTENSIONS.items()}
+VARIANTS = {"br": ".br", "gzip": ".gz"}
+ASSET_NAME = re.compile(r"^([0-9a-f]{64})\.(html|txt)$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Legal texts are written by us, but are still kept from running scripts
+HTML_POLICY = "default-src 'none'; style-src 'unsafe-inline'; img-src https: data:"
+
+legal_asset_responses_total = metrics.Counter(
+    "legal_asset_responses_total", "Legal document asset responses", ("encoding", "status")
+)
+
+
+def asset_name(content_sha256: str, content_type: Optional[str]) -> str:
+    return f"{content_sha256}.{EXTENSIONS.get(content_type, 'txt')}"
+
+
+def asset_url(content_sha256: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    if not content_sha256:
+        return None
+    return f"{LEGAL_ASSET_PATH}/{asset_name(content_sha256, content_type)}"
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_asset(content_sha256: str, content_type: Optional[str], content: str) -> str:
+    """Write one text and its compressed variants; returns the file name."""
+    data = content.encode("utf-8")
+    if sha256(data).hexdigest() != content_sha256:
+        raise ValueError(f"Legal document content does not match {content_sha256}")
+    os.makedirs(LEGAL_ASSET_DIR, exist_ok=True)
+    name = asset_name(content_sha256, content_type)
+    path = os.path.join(LEGAL_ASSET_DIR, name)
+    # Variants first: the plain file existing means the asset is complete
+    _write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(path + ".br", brotli.compress(data, quality=11, mode=brotli.MODE_TEXT))
+    _write_atomic(path, data)
+    return name
+
+
+def publish(shas: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Write the given versions (default: all active documents) that are not on
+    disk yet. Returns the names written.
+    """
+    if shas is None:
+        query = """
+            SELECT DISTINCT content_sha256, content_type
+            FROM regops_app.tbl_globi_eu_am_99_legal_documents
+            WHERE is_active = true AND content_sha256 IS NOT NULL
+        """
+        params: Tuple = ()
+    else:
+        query = """
+            SELECT DISTINCT content_sha256, content_type
+            FROM regops_app.tbl_globi_eu_am_99_legal_documents
+            WHERE content_sha256 = ANY(%s)
+        """
+        params = (list(shas),)
+    missing = [
+        row["content_sha256"] for row in execute_query(query, params, read_only=True)
+        if not os.path.exists(os.path.join(LEGAL_ASSET_DIR, asset_name(row["content_sha256"], row["content_type"])))
+    ]
+    if not missing:
+        return []
+
+    # Only now read the texts themselves
+    rows = execute_query("""
+        SELECT DISTINCT ON (content_sha256) content_sha256, content_type, document_content
+        FROM regops_app.tbl_globi_eu_am_99_legal_documents
+        WHERE content_sha256 = ANY(%s)
+    """, (missing,), read_only=True)
+    written = []
+    for row in rows:
+        written.append(write_asset(row["content_sha256"], row["content_type"], row["document_content"]))
+    if written:
+        logger.info("Published legal documents", extra={"count": len(written)})
+    return written
+
+
+_misses: "OrderedDict[str, float]" = OrderedDict()  # name -> expires_at
+_misses_lock = threading.Lock()
+
+
+def _known_missing(name: str) -> bool:
+    with _misses_lock:
+        expires_at = _misses.get(name)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _misses[name]
+            return False
+        return True
+
+
+def _remember_missing(name: str):
+    with _misses_lock:
+        _misses[name] = time.monotonic() + LEGAL_ASSET_MISS_TTL
+        _misses.move_to_end(name)
+        while len(_misses) > LEGAL_ASSET_MISS_MAX_ENTRIES:
+            _misses.popitem(last=False)
+
+
+def _publish_on_demand(request: Request, name: str, content_sha256: str, path: str):
+    """Fetch a version that is not on disk from the database, or raise 404."""
+    if _known_missing(name):
+        legal_asset_responses_total.inc(encoding="identity", status="missing")
+        raise HTTPException(404, "Document not found")
+    if rate_limit.RATE_LIMIT_ENABLED:
+        rate_limit.limiter.check("legal", f"ip:{rate_limit.client_ip(request)}")
+    publish([content_sha256])
+    if not os.path.exists(path):
+        _remember_missing(name)
+        legal_asset_responses_total.inc(encoding="identity", status="missing")
+        raise HTTPException(404, "Document not found")
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Single byte range -> (start, end) inclusive; None to send the whole file. 416 if unsatisfiable."""
+    match = RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None  # multiple or malformed ranges: the full body is a valid answer
+    first, last = match.group(1), match.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        raise HTTPException(416, "Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def serve(request: Request, name: str) -> Response:
+    """Full, ranged or precompressed response for one asset."""
+    match = ASSET_NAME.match(name)
+    if not match:
+        raise HTTPException(404, "Document not found")
+    content_sha256, ext = match.groups()
+    path = os.path.join(LEGAL_ASSET_DIR, name)
+    if not os.path.exists(path):
+        _publish_on_demand(request, name, content_sha256, path)
+
+    etag = f'"{content_sha256}"'
+    headers = {
+        "Cache-Control": f"public, max-age={LEGAL_ASSET_MAX_AGE}, immutable",
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if ext == "html":
+        headers["Content-Security-Policy"] = HTML_POLICY
+    media_type = MEDIA_TYPES[ext]  # Starlette adds charset=utf-8
+
+    # Any variant's tag revalidates: all encodings of one name are the same text
+    if_none_match = request.headers.get("if-none-match", "")
+    if content_sha256 in if_none_match or if_none_match.strip() == "*":
+        legal_asset_responses_total.inc(encoding="identity", status="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    # Ranges address the uncompressed bytes
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        size = os.path.getsize(path)
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            with open(path, "rb") as f:
+                f.seek(start)
+                body = f.read(end - start + 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            legal_asset_responses_total.inc(encoding="identity", status="partial")
+            return Response(body, status_code=206, media_type=media_type, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and os.path.exists(path + VARIANTS[encoding]):
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'"{content_sha256}-{encoding}"'
+        legal_asset_responses_total.inc(encoding=encoding, status="full")
+        return FileResponse(path + VARIANTS[encoding], media_type=media_type, headers=headers)
+    legal_asset_responses_total.inc(encoding="identity", status="full")
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legal document assets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish_cmd = sub.add_parser("publish", help="Write legal document assets to LEGAL_ASSET_DIR")
+    publish_cmd.add_argument("--all", action="store_true", help="Also inactive (superseded) versions")
+    args = parser.parse_args()
+
+    shas = None
+    if args.all:
+        shas = [row["content_sha256"] for row in execute_query("""
+            SELECT DISTINCT content_sha256 FROM regops_app.tbl_globi_eu_am_99_legal_documents
+            WHERE content_sha256 IS NOT NULL
+        """)]
+    written = publish(shas)
+    print(f"{len(written)} written to {LEGAL_ASSET_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import logging
+import os
+import sys
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Single-line key=value log records that Render's log search can filter on.
+    Anything passed via `extra={...}` is appended as additional fields.
+    """
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = [
+            f"ts={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+            f"msg={self._quote(record.getMessage())}",
+        ]
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED and not key.startswith("_"):
+                fields.append(f"{key}={self._quote(value)}")
+        if record.exc_info:
+            fields.append(f"exc={self._quote(self.formatException(record.exc_info))}")
+        return " ".join(fields)
+
+    @staticmethod
+    def _quote(value) -> str:
+        text = str(value)
+        if not text or any(c in text for c in ' "=\n'):
+            return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        return text
+
+
+def configure_logging():
+    """Configure root logging once from LOG_LEVEL (default INFO)."""
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(KeyValueFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
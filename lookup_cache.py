@@ -0,0 +1,139 @@
+"""
+Result cache for the typeahead lookups (/api/lookups/*).
+
+- Identical queries arriving while one is already running wait for it
+  instead of issuing their own (single-flight).
+- Results are cached per query for LOOKUP_CACHE_TTL seconds, LRU-bounded.
+- Lookups match with LIKE '%q%', so the rows for "1234" are a subset of the
+  rows for "123". If "123" is cached and returned fewer than LIMIT rows (the
+  result is complete), "1234" is answered by filtering it in memory.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "30"))
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "2000"))
+# Followers give up waiting on a stuck leader after this and query themselves
+LOOKUP_COALESCE_TIMEOUT = float(os.getenv("LOOKUP_COALESCE_TIMEOUT", "10"))
+
+lookup_cache_requests_total = metrics.Counter(
+    "lookup_cache_requests_total", "Typeahead lookups by how they were answered", ("cache", "outcome")
+)
+
+Row = Dict[str, Any]
+
+# LIKE wildcards make the in-memory substring test disagree with the database
+_LIKE_SPECIAL = ("%", "_", "\\")
+
+
+class _Flight:
+    __slots__ = ("done", "rows", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rows: Optional[List[Row]] = None
+        self.error: Optional[BaseException] = None
+
+
+class LookupCache:
+    def __init__(self, name: str, limit: int, matches: Callable[[Row, str], bool],
+                 ttl: float = LOOKUP_CACHE_TTL, max_entries: int = LOOKUP_CACHE_MAX_ENTRIES):
+        """
+        name: label for metrics
+        limit: the LIMIT of the underlying query; shorter results are complete
+        matches: row, query -> whether the database query for `query` returns `row`
+        """
+        self.name = name
+        self.limit = limit
+        self.matches = matches
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # q -> (expires_at, rows)
+        self._in_flight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def get(self, q: str, loader: Callable[[str], List[Row]]) -> List[Row]:
+        with self._lock:
+            rows = self._cached(q)
+            if rows is not None:
+                outcome = "hit"
+            else:
+                rows = self._derived(q)
+                outcome = "derived" if rows is not None else None
+            if rows is None:
+                flight = self._in_flight.get(q)
+                leader = flight is None
+                if leader:
+                    flight = self._in_flight[q] = _Flight()
+
+        if rows is not None:
+            lookup_cache_requests_total.inc(cache=self.name, outcome=outcome)
+            return rows
+
+        if not leader:
+            lookup_cache_requests_total.inc(cache=self.name, outcome="coalesced")
+            if flight.done.wait(LOOKUP_COALESCE_TIMEOUT):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.rows
+            return loader(q)
+
+        lookup_cache_requests_total.inc(cache=self.name, outcome="miss")
+        try:
+            rows = loader(q)
+            flight.rows = rows
+            with self._lock:
+                self._store(q, rows)
+            return rows
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(q, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _cached(self, q: str) -> Optional[List[Row]]:
+        entry = self._entries.get(q)
+        if entry is None:
+            return None
+        expires_at, rows = entry
+        if expires_at < time.monotonic():
+            del self._entries[q]
+            return None
+        self._entries.move_to_end(q)
+        return rows
+
+    def _derived(self, q: str) -> Optional[List[Row]]:
+        if any(c in q for c in _LIKE_SPECIAL):
+            return None
+        # Longest cached prefix first: the smallest superset to filter
+        for end in range(len(q) - 1, 0, -1):
+            shorter = q[:end]
+            rows = self._cached(shorter)
+            if rows is None or len(rows) >= self.limit:
+                continue
+            derived = [row for row in rows if self.matches(row, q)]
+            # Never outlive the result it was derived from
+            self._store(q, derived, expires_at=self._entries[shorter][0])
+            return derived
+        return None
+
+    def _store(self, q: str, rows: List[Row], expires_at: Optional[float] = None):
+        self._entries[q] = (expires_at or time.monotonic() + self.ttl, rows)
+        self._entries.move_to_end(q)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -1,14 +1,66 @@
-from fastapi import FastAPI
+import time
+_imports_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
 import os
 from dotenv import load_dotenv
 
+from logging_config import configure_logging
+from auth import verify_entra_token, Roles
+import metrics
+import profiling
+import startup
+import query_budget
+from compression import CompressionMiddleware
+
 load_dotenv()
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from activity_log import activity_log
+    from health import health_monitor
+    from item_index import item_index
+    from partitions import partition_maintainer
+    from media import media_processor
+    from attachment_store import content_store
+    from last_login import last_login_writer
+    from passwords import password_verifier
+    from intake_bootstrap import intake_bootstrap
+    from database import close_pool
+
+    # DB connections and caches are warmed concurrently before the first request
+    await startup.warm_up()
+    activity_log.start()
+    health_monitor.start()
+    item_index.start()
+    partition_maintainer.start()
+    media_processor.start()
+    content_store.start()
+    last_login_writer.start()
+    intake_bootstrap.start()
+    metrics.snapshot_writer.start()
+    yield
+    metrics.snapshot_writer.stop()
+    intake_bootstrap.stop()
+    last_login_writer.stop()
+    password_verifier.stop()
+    content_store.stop()
+    media_processor.stop()
+    partition_maintainer.stop()
+    item_index.stop()
+    health_monitor.stop()
+    activity_log.stop()
+    close_pool()
 
 app = FastAPI(
     title="Service Request Portal API",
     description="API for Stryker Service Request Portal",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS - Allow all origins for PoC/Demo (configure ALLOWED_ORIGINS in production)
@@ -21,8 +73,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# gzip/brotli for responses over COMPRESSION_MIN_SIZE bytes
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """
+    Per-request latency, DB time and query count.
+    Also returned to the client as a Server-Timing header.
+    """
+    stats = metrics.begin_request(request.url.path)
+    metrics.http_requests_in_progress.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.http_requests_in_progress.dec()
+        # Label by route template (/api/requests/{request_id}), not the raw path
+        route = request.scope.get("route")
+        route_label = getattr(route, "path", None) or "unmatched"
+        stats.route = route_label
+        metrics.record_request(request.method, route_label, status_code, elapsed, stats)
+
+    response.headers["Server-Timing"] = (
+        f"app;dur={elapsed * 1000:.1f}, db;dur={stats.db_time * 1000:.1f}, "
+        f"connect;dur={stats.connect_time * 1000:.1f}"
+    )
+    response.headers["X-DB-Queries"] = str(stats.query_count)
+    return response
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """
+    Capture a stack + SQL profile for Admin requests sent with `X-Profile: 1`,
+    and for slow requests when PROFILE_SLOW_MS is set.
+    """
+    forced = False
+    if request.headers.get(profiling.PROFILE_HEADER) == "1":
+        token_data = await verify_entra_token(request)
+        forced = token_data.role == Roles.ADMIN
+
+    session = profiling.start_session(request.method, request.url.path, forced)
+    if session is None:
+        return await call_next(request)
+
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        kept = profiling.finish_session(session, status_code, time.perf_counter() - start)
+
+    if kept:
+        response.headers["X-Profile-Id"] = str(session.id)
+    return response
+
 @app.get("/")
 def root():
     return {
@@ -32,42 +144,73 @@ def root():
         "auth": "Entra ID"
     }
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/health/live")
+def liveness():
+    """Process is up and serving. No I/O - safe to poll as often as you like."""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness():
+    """
+    Cached dependency status from the background prober, with per-dependency latency.
+    Returns 503 while a required dependency (HEALTH_REQUIRED) is failing.
+    """
+    from health import health_monitor
+    results = health_monitor.results()
+    ready = health_monitor.is_ready(results)
+    return JSONResponse(
+        {"status": "ok" if ready else "unavailable", "dependencies": results},
+        status_code=200 if ready else 503
+    )
+
 @app.get("/health")
 def health_check():
-    health_status = {
-        "api": "ok",
-        "database": "unknown",
-        "blob_storage": "unknown"
-    }
-    
-    try:
-        from database import execute_query
-        execute_query("SELECT 1")
-        health_status["database"] = "ok"
-    except Exception as e:
-        health_status["database"] = f"error: {str(e)}"
-    
-    try:
-        from azure.storage.blob import BlobServiceClient
-        blob_conn = os.getenv("AZURE_BLOB_CONNECTION_STRING")
-        BlobServiceClient.from_connection_string(blob_conn).list_containers()
-        health_status["blob_storage"] = "ok"
-    except Exception as e:
-        health_status["blob_storage"] = f"error: {str(e)}"
-    
+    # Legacy shape kept for existing monitors; served from the same cache as /health/ready
+    from health import health_monitor
+    health_status = {"api": "ok"}
+    for name, result in health_monitor.results().items():
+        status = result["status"]
+        health_status[name] = f"{status}: {result['error']}" if result["error"] else status
     return health_status
 
-from routers import requests, lookups, upload, auth, countries, validation, intake, login
+from routers import requests, lookups, upload, auth, countries, validation, intake, login, admin
+from rate_limit import rate_limit
+from psycopg2.extensions import QueryCanceledError
+
+app.add_exception_handler(QueryCanceledError, query_budget.query_canceled_handler)
 
-app.include_router(login.router, prefix="/api", tags=["Login"])
+app.include_router(login.router, prefix="/api", tags=["Login"],
+                   dependencies=[Depends(rate_limit("login", by_ip=True))])
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(requests.router, prefix="/api/requests", tags=["Requests"])
-app.include_router(lookups.router, prefix="/api/lookups", tags=["Lookups"])
+app.include_router(lookups.router, prefix="/api/lookups", tags=["Lookups"],
+                   dependencies=[Depends(rate_limit("lookups")),
+                                 # Lookup results are shared by single-flight; one client leaving must not cancel them
+                                 Depends(query_budget.query_budget("lookups", cancel_on_disconnect=False))])
 app.include_router(upload.router, prefix="/api", tags=["Upload"])
 app.include_router(countries.router, prefix="/api", tags=["Countries & Languages"])
 app.include_router(validation.router, prefix="/api", tags=["Validation"])
 app.include_router(intake.router, prefix="/api", tags=["Intake Form"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+
+# Must run after all routers are included
+profiling.instrument_routes(app)
+
+startup.record_phase("imports", time.perf_counter() - _imports_started)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Local development server. Production runs gunicorn with gunicorn.conf.py.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        reload=os.getenv("RELOAD", "false").lower() == "true"
+    )
\ No newline at end of file
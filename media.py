@@ -0,0 +1,449 @@
+"""
+Thumbnails and previews for photo and video attachments.
+
+Techs triage from photos and phone videos; opening 25 MB originals for that
+is slow on site. After an upload is recorded, its attachment row is queued
+(media_status = 'pending', migrations/add_attachment_media.sql) and a
+background thread in each API worker claims queued rows and renders them in
+a process pool, so decoding and encoding never hold the GIL of the worker
+serving requests:
+
+- photos: a 320px thumbnail and a 1600px preview (JPEG, EXIF-rotated)
+- videos: a poster frame (+ thumbnail) and a 720p H.264 preview
+
+Renditions are uploaded next to the original (<blob_path>.thumb.jpg, ...;
+for deduplicated attachments next to the shared content blob, see
+attachment_store.py) and recorded in the row's `renditions` column. Rows are claimed with
+SKIP LOCKED, so several workers and instances can share the queue; a claim
+older than MEDIA_CLAIM_TIMEOUT (crashed worker) is picked up again, up to
+MEDIA_MAX_ATTEMPTS times.
+
+Videos need ffmpeg: MEDIA_FFMPEG, `ffmpeg` on PATH, or the binary shipped
+with the imageio-ffmpeg package. Without it videos are marked 'skipped'.
+
+    python media.py status
+    python media.py process          # work through the queue once, then exit
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PROCESSING_ENABLED = os.getenv("MEDIA_PROCESSING_ENABLED", "true").lower() == "true"
+# Pool processes per API worker; each renders one attachment at a time
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "1"))
+# Seconds between queue polls when idle (new uploads wake the processor directly)
+MEDIA_POLL_INTERVAL = float(os.getenv("MEDIA_POLL_INTERVAL", "60"))
+MEDIA_MAX_ATTEMPTS = int(os.getenv("MEDIA_MAX_ATTEMPTS", "3"))
+MEDIA_CLAIM_TIMEOUT = int(os.getenv("MEDIA_CLAIM_TIMEOUT", "900"))
+# Upper bound for one ffmpeg run
+MEDIA_FFMPEG_TIMEOUT = int(os.getenv("MEDIA_FFMPEG_TIMEOUT", "300"))
+MEDIA_FFMPEG = os.getenv("MEDIA_FFMPEG")
+
+THUMBNAIL_SIZE = 320
+PREVIEW_SIZE = 1600
+VIDEO_PREVIEW_HEIGHT = 720
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_EXTENSIONS = ('.mov', '.mp4', '.avi', '.3gp')
+
+# Read links to renditions embedded in request details
+PREVIEW_LINK_TTL = int(os.getenv("PREVIEW_LINK_TTL", "3600"))
+
+SCHEMA = "regops_app"
+ATTACHMENTS = f"{SCHEMA}.tbl_globi_eu_am_99_attachments"
+
+media_attachments_total = metrics.Counter(
+    "media_attachments_total", "Attachments processed by the media pipeline", ("kind", "outcome")
+)
+media_processing_seconds = metrics.Histogram(
+    "media_processing_seconds", "Time to download, render and upload one attachment", ("kind",),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+
+class MediaUnsupported(Exception):
+    """The attachment can't be rendered here (no ffmpeg, unreadable format); not retried."""
+
+
+def media_kind(filename: str) -> Optional[str]:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return "image"
+    if ext in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def initial_status(filename: str) -> Optional[str]:
+    """media_status for a newly recorded attachment."""
+    return "pending" if media_kind(filename) else None
+
+
+# ----------------------------------------------------------------------------
+# Rendering (runs in the pool processes)
+# ----------------------------------------------------------------------------
+
+_container_client = None
+
+
+def _container():
+    global _container_client
+    if _container_client is None:
+        from azure.storage.blob import BlobServiceClient
+        from routers.upload import CONTAINER_NAME
+        service = BlobServiceClient.from_connection_string(os.environ["AZURE_BLOB_CONNECTION_STRING"])
+        _container_client = service.get_container_client(CONTAINER_NAME)
+    return _container_client
+
+
+def _ffmpeg_path() -> Optional[str]:
+    if MEDIA_FFMPEG:
+        return MEDIA_FFMPEG
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def _ffmpeg(*args: str):
+    ffmpeg = _ffmpeg_path()
+    if not ffmpeg:
+        raise MediaUnsupported("ffmpeg not available")
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *args],
+        capture_output=True, timeout=MEDIA_FFMPEG_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace')[-300:]}")
+
+
+def render_image(source: str, workdir: str, prefix: str = "") -> Dict[str, Dict[str, Any]]:
+    """Preview and thumbnail JPEGs of an image file."""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(source)
+    except UnidentifiedImageError as e:
+        raise MediaUnsupported(str(e))
+    with image:
+        # JPEG decoders can scale down by 2/4/8 while decoding: much less work for phone photos
+        image.draft("RGB", (PREVIEW_SIZE, PREVIEW_SIZE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        renditions = {}
+        for name, size, quality in (("preview", PREVIEW_SIZE, 82), ("thumb", THUMBNAIL_SIZE, 75)):
+            image.thumbnail((size, size), Image.LANCZOS)
+            path = os.path.join(workdir, f"{prefix}{name}.jpg")
+            image.save(path, "JPEG", quality=quality, optimize=True, progressive=True)
+            renditions[name] = {
+                "path": path, "suffix": f".{name}.jpg", "content_type": "image/jpeg",
+                "width": image.width, "height": image.height,
+            }
+    return renditions
+
+
+def render_video(source: str, workdir: str) -> Dict[str, Dict[str, Any]]:
+    """Poster frame, its thumbnail, and a 720p H.264 preview of a video file."""
+    frame = os.path.join(workdir, "frame.png")
+    # A second in skips the black first frame most phones record; short clips fall back to the start
+    try:
+        _ffmpeg("-ss", "1", "-i", source, "-frames:v", "1", frame)
+    except RuntimeError:
+        pass
+    if not os.path.exists(frame):
+        _ffmpeg("-i", source, "-frames:v", "1", frame)
+
+    images = render_image(frame, workdir, prefix="poster-")
+    poster = dict(images["preview"], suffix=".poster.jpg")
+
+    preview = os.path.join(workdir, "preview.mp4")
+    _ffmpeg(
+        "-i", source,
+        # Even dimensions for yuv420p; -2 keeps the aspect ratio
+        "-vf", f"scale=-2:'trunc(min({VIDEO_PREVIEW_HEIGHT},ih)/2)*2'",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "28", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "96k",
+        # moov atom first: browsers can start playing before the download finishes
+        "-movflags", "+faststart",
+        preview
+    )
+    return {
+        "poster": poster,
+        "thumb": images["thumb"],
+        "preview": {"path": preview, "suffix": ".preview.mp4", "content_type": "video/mp4"},
+    }
+
+
+def process_attachment(blob_path: str, file_name: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Download an original, render it and upload the renditions next to it.
+    Returns the renditions as stored in the `renditions` column.
+    """
+    from azure.storage.blob import ContentSettings
+
+    kind = media_kind(file_name)
+    if kind is None:
+        raise MediaUnsupported(f"{file_name} is not a photo or video")
+
+    container = _container()
+    with tempfile.TemporaryDirectory(prefix="media-") as workdir:
+        source = os.path.join(workdir, "source" + os.path.splitext(file_name)[1].lower())
+        with open(source, "wb") as f:
+            container.get_blob_client(blob_path).download_blob().readinto(f)
+
+        rendered = render_image(source, workdir) if kind == "image" else render_video(source, workdir)
+
+        renditions = {}
+        for name, rendition in rendered.items():
+            target = blob_path + rendition["suffix"]
+            with open(rendition["path"], "rb") as data:
+                container.get_blob_client(target).upload_blob(
+                    data, overwrite=True,
+                    content_settings=ContentSettings(
+                        content_type=rendition["content_type"],
+                        # Renditions never change under the same name
+                        cache_control="private, max-age=31536000, immutable"
+                    )
+                )
+            renditions[name] = {
+                "blob_path": target,
+                "content_type": rendition["content_type"],
+                "size": os.path.getsize(rendition["path"]),
+                **{key: rendition[key] for key in ("width", "height") if key in rendition},
+            }
+    return renditions
+
+
+# ----------------------------------------------------------------------------
+# Queue (API worker side)
+# ----------------------------------------------------------------------------
+
+def claim_batch(limit: int) -> List[Dict[str, Any]]:
+    """Mark up to `limit` queued attachments as processing and return them."""
+    from database import execute_query
+    from attachment_store import ATTACHMENT_DEDUP_ENABLED, CONTENTS
+    # Claims that outlived every attempt (worker died each time) are given up on
+    execute_query(f"""
+        UPDATE {ATTACHMENTS}
+        SET media_status = 'failed', media_error = 'processing did not finish', media_claimed_at = NULL
+        WHERE media_status = 'processing'
+          AND media_claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+          AND media_attempts >= %s
+    """, (MEDIA_CLAIM_TIMEOUT, MEDIA_MAX_ATTEMPTS), fetch=False)
+    return execute_query(f"""
+        UPDATE {ATTACHMENTS} a
+        SET media_status = 'processing',
+            media_claimed_at = CURRENT_TIMESTAMP,
+            media_attempts = a.media_attempts + 1
+        WHERE a.id IN (
+            SELECT id FROM {ATTACHMENTS}
+            WHERE (media_status = 'pending'
+                   OR (media_status = 'processing'
+                       AND media_claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)))
+              AND media_attempts < %s
+              -- Uploads waiting for deduplication are rendered from their content blob afterwards
+              AND (COALESCE(content_status, '') NOT IN ('pending', 'hashing') OR NOT %s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING a.id, a.file_name, a.media_attempts,
+                  COALESCE((SELECT c.blob_path FROM {CONTENTS} c WHERE c.sha256 = a.content_sha256),
+                           a.blob_path) AS blob_path
+    """, (MEDIA_CLAIM_TIMEOUT, MEDIA_MAX_ATTEMPTS, ATTACHMENT_DEDUP_ENABLED, limit))
+
+
+def record_result(attachment_id: int, status: str, renditions: Optional[Dict[str, Any]] = None,
+                  error: Optional[str] = None):
+    from psycopg2.extras import Json
+    from database import execute_query
+    execute_query(f"""
+        UPDATE {ATTACHMENTS}
+        SET media_status = %s, renditions = %s, media_error = %s, media_claimed_at = NULL
+        WHERE id = %s
+    """, (status, Json(renditions) if renditions is not None else None, error[:500] if error else None,
+          attachment_id), fetch=False)
+
+
+def queue_status() -> Dict[str, Any]:
+    from database import execute_query
+    rows = execute_query(f"""
+        SELECT media_status, count(*) AS attachments,
+               EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - min(uploaded_date)) AS oldest_seconds
+        FROM {ATTACHMENTS}
+        WHERE media_status IS NOT NULL
+        GROUP BY media_status
+    """)
+    return {
+        row["media_status"]: {
+            "attachments": row["attachments"],
+            "oldest_seconds": round(float(row["oldest_seconds"])) if row["oldest_seconds"] is not None else None,
+        }
+        for row in rows
+    }
+
+
+class MediaProcessor:
+    """Background thread feeding queued attachments to a process pool."""
+
+    def __init__(self, workers: int = MEDIA_WORKERS):
+        self.workers = max(workers, 1)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if not MEDIA_PROCESSING_ENABLED or not os.getenv("AZURE_BLOB_CONNECTION_STRING"):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="media-processor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def wake(self):
+        """New work was queued; don't wait for the next poll."""
+        self._wake.set()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the API worker has threads and open database sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def run_once(self) -> int:
+        """Claim and process one batch; returns how many attachments were claimed."""
+        rows = claim_batch(self.workers)
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        futures = {
+            self._pool().submit(process_attachment, row["blob_path"], row["file_name"]): row
+            for row in rows
+        }
+        for future in as_completed(futures):
+            row = futures[future]
+            kind = media_kind(row["file_name"]) or "other"
+            try:
+                record_result(row["id"], "ready", future.result())
+                outcome = "ready"
+            except MediaUnsupported as e:
+                record_result(row["id"], "skipped", error=str(e))
+                outcome = "skipped"
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # A pool process died (out of memory on a huge image?); start a fresh pool next batch
+                    self._executor = None
+                # Back to the queue until the attempts are used up
+                final = row["media_attempts"] >= MEDIA_MAX_ATTEMPTS
+                outcome = "failed" if final else "retry"
+                record_result(row["id"], "failed" if final else "pending", error=str(e))
+                logger.warning("Media processing failed", extra={
+                    "attachment_id": row["id"], "attempt": row["media_attempts"], "error": str(e)
+                })
+            media_attachments_total.inc(kind=kind, outcome=outcome)
+            media_processing_seconds.observe(time.perf_counter() - started, kind=kind)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception("Media processing cycle failed")
+            self._wake.wait(MEDIA_POLL_INTERVAL)
+            self._wake.clear()
+
+
+media_processor = MediaProcessor()
+
+
+def preview_links(renditions: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Short-lived read URLs for an attachment's renditions, by name."""
+    if not renditions or not os.getenv("AZURE_STORAGE_ACCOUNT_KEY"):
+        return {}
+    from azure.storage.blob import BlobSasPermissions
+    from routers.upload import blob_sas_url
+    expiry = datetime.utcnow() + timedelta(seconds=PREVIEW_LINK_TTL)
+    permission = BlobSasPermissions(read=True)
+    return {
+        name: blob_sas_url(rendition["blob_path"], permission, expiry)
+        for name, rendition in renditions.items()
+    }
+
+
+def main():
+    from logging_config import configure_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Attachment thumbnails and previews")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Attachments per media status")
+    sub.add_parser("process", help="Work through the queue once, then exit")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for status, info in sorted(queue_status().items()):
+            print(f"{status:<12} {info['attachments']:>8}  oldest {info['oldest_seconds']}s")
+        return
+
+    processor = MediaProcessor()
+    total = 0
+    try:
+        while True:
+            claimed = processor.run_once()
+            if not claimed:
+                break
+            total += claimed
+    finally:
+        processor.stop()
+    print(f"Processed {total} attachments")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
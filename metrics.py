@@ -0,0 +1,439 @@
+"""
+In-process metrics for the API, exposed in Prometheus text format on /metrics.
+
+Request-scoped counters (query count, DB time) live in a RequestStats object
+held in a context variable. The timing middleware creates it; FastAPI copies
+the context into the threadpool that runs sync endpoints, so the database
+layer can add to the same object from any thread serving the request.
+
+Every metric lives in the memory of the process that recorded it, and under
+gunicorn each scrape of /metrics lands on one worker. With
+PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py sets it when it runs more than
+one worker), each worker writes its series to <dir>/<pid>.json every
+METRICS_WRITE_INTERVAL seconds, and /metrics adds up the files of all workers:
+counters and histograms are summed, gauges are summed or take the maximum.
+Files of exited workers are kept so counters never go backwards, but their
+gauges are dropped. The slow-query samples behind /api/admin/slow-queries
+are still per worker.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional, Dict, Tuple, List, Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", "100"))
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+METRICS_WRITE_INTERVAL = float(os.getenv("METRICS_WRITE_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+def _label_str(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self, series: Optional[Dict[Tuple[str, ...], Any]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples(self.collect() if series is None else series))
+        return lines
+
+    def collect(self) -> Dict[Tuple[str, ...], Any]:
+        """Copy of this process's series, label values -> value."""
+        raise NotImplementedError
+
+    def combine(self, current: Any, other: Any) -> Any:
+        """Merge one series as recorded by two processes."""
+        raise NotImplementedError
+
+    def _samples(self, series: Dict[Tuple[str, ...], Any]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def combine(self, current: float, other: float) -> float:
+        return current + other
+
+    def _samples(self, series: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}" for key, value in series.items()]
+
+
+class Gauge(Counter):
+    """
+    multiprocess_mode says how workers' values add up: "sum" for things every
+    worker holds a share of, "max" for the same reading taken in each worker.
+    """
+    type_name = "gauge"
+
+    def __init__(self, *args, multiprocess_mode: str = "sum", **kwargs):
+        super().__init__(*args, **kwargs)
+        if multiprocess_mode not in ("sum", "max"):
+            raise ValueError(f"unknown multiprocess_mode {multiprocess_mode!r}")
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def combine(self, current: float, other: float) -> float:
+        if self.multiprocess_mode == "max":
+            return max(current, other)
+        return current + other
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    def collect(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+
+    def combine(self, current: Tuple[List[int], float], other: Tuple[List[int], float]) -> Tuple[List[int], float]:
+        counts = [a + b for a, b in zip(current[0], other[0])]
+        return counts, current[1] + other[1]
+
+    def _samples(self, series: Dict[Tuple[str, ...], Tuple[List[int], float]]) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(names, key + (repr(float(bound)),))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests served", ("method", "route", "status")
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency", ("method", "route")
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served"
+)
+db_time_per_request_seconds = Histogram(
+    "db_time_per_request_seconds", "Time spent in database calls per request", ("route",)
+)
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "Number of SQL statements executed per request", ("route",),
+    buckets=QUERY_COUNT_BUCKETS
+)
+db_connection_acquire_seconds = Histogram(
+    "db_connection_acquire_seconds", "Time to obtain a database connection"
+)
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds", "Duration of individual SQL statements"
+)
+db_slow_queries_total = Counter(
+    "db_slow_queries_total", "Statements slower than SLOW_QUERY_MS, by normalized query fingerprint",
+    ("fingerprint",)
+)
+
+
+class RequestStats:
+    __slots__ = ("route", "query_count", "db_time", "connect_time", "_lock")
+
+    def __init__(self, route: str = "unknown"):
+        self.route = route
+        self.query_count = 0
+        self.db_time = 0.0
+        self.connect_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, duration: float):
+        with self._lock:
+            self.query_count += 1
+            self.db_time += duration
+
+    def add_connect(self, duration: float):
+        with self._lock:
+            self.connect_time += duration
+            self.db_time += duration
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+_slow_queries = deque(maxlen=SLOW_QUERY_SAMPLES)
+
+
+def begin_request(route: str = "unknown") -> RequestStats:
+    stats = RequestStats(route)
+    _current_request.set(stats)
+    return stats
+
+
+def current_request() -> Optional[RequestStats]:
+    return _current_request.get()
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql) -> str:
+    """
+    Reduce a statement to its shape: literals and placeholders become '?',
+    IN-lists and multi-row VALUES collapse, and whitespace is squeezed.
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _LINE_COMMENT.sub(" ", str(sql))
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _VALUES_LIST.sub(r"\1, ...", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def fingerprint(normalized_sql: str) -> str:
+    return hashlib.md5(normalized_sql.encode("utf-8")).hexdigest()[:12]
+
+
+def record_query(sql, duration: float):
+    """Called by the database layer after every statement."""
+    db_query_duration_seconds.observe(duration)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add_query(duration)
+
+    if duration * 1000 >= SLOW_QUERY_MS:
+        normalized = normalize_sql(sql)
+        query_id = fingerprint(normalized)
+        db_slow_queries_total.inc(fingerprint=query_id)
+        _slow_queries.append({
+            "fingerprint": query_id,
+            "query": normalized,
+            "duration_ms": round(duration * 1000, 2),
+            "route": stats.route if stats else None,
+            "at": time.time(),
+        })
+
+
+def record_connection_acquire(duration: float):
+    db_connection_acquire_seconds.observe(duration)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add_connect(duration)
+
+
+def record_request(method: str, route: str, status_code: int, duration: float, stats: RequestStats):
+    http_requests_total.inc(method=method, route=route, status=status_code)
+    http_request_duration_seconds.observe(duration, method=method, route=route)
+    db_time_per_request_seconds.observe(stats.db_time, route=route)
+    db_queries_per_request.observe(stats.query_count, route=route)
+
+
+def slow_query_samples() -> List[Dict[str, Any]]:
+    """Most recent slow statements, newest first."""
+    return list(reversed(_slow_queries))
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(MULTIPROC_DIR, f"{pid}.json")
+
+
+def _write_file(path: str, snapshot: Dict[str, Any]):
+    # Readers only ever see a complete file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(temporary, path)
+
+
+def write_snapshot():
+    """Write this process's series to the shared directory (multiprocess mode only)."""
+    if not MULTIPROC_DIR:
+        return
+    snapshot = {
+        metric.name: {
+            "type": metric.type_name,
+            "series": [[list(key), value] for key, value in metric.collect().items()],
+        }
+        for metric in REGISTRY
+    }
+    _write_file(_snapshot_path(os.getpid()), snapshot)
+
+
+def mark_process_dead(pid: int):
+    """
+    Called by the gunicorn master when a worker exits. Its counters and
+    histograms stay in the total; its gauges no longer describe anything.
+    """
+    if not MULTIPROC_DIR:
+        return
+    path = _snapshot_path(pid)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    _write_file(path, {name: entry for name, entry in snapshot.items() if entry["type"] != "gauge"})
+
+
+def clear_multiproc_dir():
+    """Start from zero when the server starts; files left by a previous run are stale."""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.json*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _merged_series() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    write_snapshot()
+    by_name = {metric.name: metric for metric in REGISTRY}
+    merged: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in by_name}
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping metrics snapshot %s: %s", path, e)
+            continue
+        for name, entry in snapshot.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            series = merged[name]
+            for key, value in entry["series"]:
+                key = tuple(key)
+                if isinstance(value, list):
+                    value = (value[0], value[1])
+                series[key] = value if key not in series else metric.combine(series[key], value)
+    return merged
+
+
+def render_prometheus() -> str:
+    merged = _merged_series() if MULTIPROC_DIR else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(merged.get(metric.name)))
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotWriter:
+    """Keeps this worker's file in the shared directory current."""
+
+    def __init__(self, interval: float = METRICS_WRITE_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not MULTIPROC_DIR or (self._thread and self._thread.is_alive()):
+            return
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.interval + 1)
+            self._thread = None
+        self._write()
+
+    def _write(self):
+        try:
+            write_snapshot()
+        except Exception as e:
+            logger.warning("Could not write metrics snapshot: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+
+snapshot_writer = SnapshotWriter()
@@ -0,0 +1,92 @@
+-- ============================================================================
+-- Migration: Content-addressed attachment storage
+-- Date: 2026-10-19
+-- Description: The same quotes, photos and contracts get attached to request
+--              after request. File contents are now stored once, under their
+--              SHA-256 (content/<ab>/<sha256>), and attachments reference
+--              them (see attachment_store.py).
+--
+-- attachments.blob_path stays the attachment's own name ({request_id}/
+-- {uuid}_{filename}) used by the API; where the bytes live is
+-- attachment_contents.blob_path once content_status = 'stored'.
+-- content_status: NULL (not deduplicated, bytes at blob_path),
+-- pending -> hashing -> stored / failed. content_claimed_at is when a worker
+-- claimed the row for hashing; claims older than CONTENT_CLAIM_TIMEOUT are
+-- taken over by another worker.
+--
+-- ref_count is kept by a trigger on attachments, so every way a row goes
+-- away (request deletion cascade, partition archival) is counted. Content
+-- whose count has been 0 for the grace period is garbage collected, unless
+-- an archived attachment still refers to it (`archived`).
+--
+-- Existing attachments are queued, so their files are deduplicated after
+-- deployment. Run with `python run_migration.py up`: the indexes on
+-- attachments are built concurrently and the queueing runs in batches.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS regops_app.tbl_globi_eu_am_99_attachment_contents (
+    sha256 CHAR(64) PRIMARY KEY,
+    blob_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NOT NULL,
+    content_type VARCHAR(100),
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    -- When ref_count last dropped to 0 (or the content was stored or looked up unreferenced)
+    orphaned_since TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    archived BOOLEAN NOT NULL DEFAULT false,
+    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_attachment_contents_orphaned
+    ON regops_app.tbl_globi_eu_am_99_attachment_contents (orphaned_since)
+    WHERE ref_count = 0;
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_attachments
+    ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64)
+        REFERENCES regops_app.tbl_globi_eu_am_99_attachment_contents (sha256),
+    ADD COLUMN IF NOT EXISTS content_status VARCHAR(20),
+    ADD COLUMN IF NOT EXISTS content_claimed_at TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION regops_app.attachment_content_refs() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.content_sha256 IS NOT NULL THEN
+        UPDATE regops_app.tbl_globi_eu_am_99_attachment_contents
+        SET ref_count = ref_count - 1,
+            orphaned_since = CASE WHEN ref_count = 1 THEN CURRENT_TIMESTAMP ELSE orphaned_since END
+        WHERE sha256 = OLD.content_sha256;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.content_sha256 IS NOT NULL THEN
+        UPDATE regops_app.tbl_globi_eu_am_99_attachment_contents
+        SET ref_count = ref_count + 1, orphaned_since = NULL
+        WHERE sha256 = NEW.content_sha256;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_attachment_content_refs ON regops_app.tbl_globi_eu_am_99_attachments;
+CREATE TRIGGER trg_attachment_content_refs
+    AFTER INSERT OR DELETE OR UPDATE OF content_sha256 ON regops_app.tbl_globi_eu_am_99_attachments
+    FOR EACH ROW EXECUTE FUNCTION regops_app.attachment_content_refs();
+
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attachments_content
+    ON regops_app.tbl_globi_eu_am_99_attachments (content_sha256)
+    WHERE content_sha256 IS NOT NULL;
+
+-- The deduplication queue
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attachments_content_queue
+    ON regops_app.tbl_globi_eu_am_99_attachments (id)
+    WHERE content_status IN ('pending', 'hashing');
+
+-- migrate:backfill table=regops_app.tbl_globi_eu_am_99_attachments key=id
+UPDATE regops_app.tbl_globi_eu_am_99_attachments
+SET content_status = 'pending'
+WHERE id >= %(lo)s AND id < %(hi)s
+  AND content_status IS NULL AND content_sha256 IS NULL;
+
+-- migrate:step
+-- Verify
+SELECT content_status, count(*)
+FROM regops_app.tbl_globi_eu_am_99_attachments
+GROUP BY content_status;
@@ -0,0 +1,42 @@
+-- ============================================================================
+-- Migration: Thumbnails and previews for photo and video attachments
+-- Date: 2026-10-19
+-- Description: Adds the media processing state of each attachment and the
+--              renditions derived from it (see media.py). media_status is
+--              NULL for files that are not photos or videos, otherwise
+--              pending -> processing -> ready / failed / skipped.
+--
+-- renditions: {"thumb": {...}, "preview": {...}, "poster": {...}}, each with
+-- blob_path, content_type, size and (for images) width/height. The blobs
+-- sit next to the original: <blob_path>.thumb.jpg, .preview.jpg, ...
+--
+-- Existing photos and videos are queued, so the processor works through
+-- the backlog after deployment. Run with `python run_migration.py up`: the
+-- index is built concurrently and the queueing runs in batches.
+-- ============================================================================
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_attachments
+    ADD COLUMN IF NOT EXISTS media_status VARCHAR(20),
+    ADD COLUMN IF NOT EXISTS media_attempts SMALLINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS media_claimed_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS media_error VARCHAR(500),
+    ADD COLUMN IF NOT EXISTS renditions JSONB;
+
+-- The work queue: small, since finished rows drop out of it
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attachments_media_queue
+    ON regops_app.tbl_globi_eu_am_99_attachments (id)
+    WHERE media_status IN ('pending', 'processing');
+
+-- migrate:backfill table=regops_app.tbl_globi_eu_am_99_attachments key=id
+UPDATE regops_app.tbl_globi_eu_am_99_attachments
+SET media_status = 'pending'
+WHERE id >= %(lo)s AND id < %(hi)s
+  AND media_status IS NULL
+  AND lower(file_name) ~ '\.(jpe?g|png|mov|mp4|avi|3gp)$';
+
+-- migrate:step
+-- Verify
+SELECT media_status, count(*)
+FROM regops_app.tbl_globi_eu_am_99_attachments
+GROUP BY media_status;
@@ -0,0 +1,23 @@
+-- ============================================================================
+-- Migration: Code-point order for the typeahead lookups
+-- Date: 2026-10-19
+-- Description: /api/lookups/{serial,lot,item} sort with COLLATE "C" (code
+--              point order, item_number breaking ties), so the database
+--              returns the same rows in the same order as the in-memory item
+--              index (ITEM_INDEX_ENABLED). The existing indexes use the
+--              database's default collation and can't serve that ORDER BY.
+--              These let the lookups keep walking an index in order and stop
+--              at the LIMIT.
+-- ============================================================================
+
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_serial_number_c
+    ON regops_app.tbl_globi_eu_am_99_items (serial_number COLLATE "C", item_number COLLATE "C");
+
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_lot_number_c
+    ON regops_app.tbl_globi_eu_am_99_items (lot_number COLLATE "C", item_number COLLATE "C");
+
+-- migrate:step no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_item_number_c
+    ON regops_app.tbl_globi_eu_am_99_items (item_number COLLATE "C");
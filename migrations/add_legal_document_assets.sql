@@ -0,0 +1,57 @@
+-- ============================================================================
+-- Migration: Legal documents as content-addressed static assets
+-- Date: 2026-10-19
+-- Description: The intake form loaded the full Terms & Conditions and Privacy
+--              Policy text from the database on every page load. The texts are
+--              now published as immutable files named after their SHA-256
+--              (legal_assets.py) and the legal endpoint returns metadata and
+--              the file's URL only.
+--
+-- content_sha256, content_size and content_type are kept by a trigger, so
+-- editing document_content (or inserting a new version) yields a new asset
+-- name without anything else to update. The texts stay in document_content
+-- as the source the assets are published from.
+-- ============================================================================
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_legal_documents
+    ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64),
+    ADD COLUMN IF NOT EXISTS content_size INTEGER,
+    ADD COLUMN IF NOT EXISTS content_type VARCHAR(50);
+
+CREATE OR REPLACE FUNCTION regops_app.legal_document_digest() RETURNS trigger AS $$
+BEGIN
+    IF NEW.document_content IS NULL THEN
+        NEW.content_sha256 := NULL;
+        NEW.content_size := NULL;
+        NEW.content_type := NULL;
+    ELSE
+        NEW.content_sha256 := encode(sha256(convert_to(NEW.document_content, 'UTF8')), 'hex');
+        NEW.content_size := octet_length(convert_to(NEW.document_content, 'UTF8'));
+        NEW.content_type := CASE WHEN ltrim(NEW.document_content) LIKE '<%' THEN 'text/html' ELSE 'text/plain' END;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_legal_document_digest ON regops_app.tbl_globi_eu_am_99_legal_documents;
+CREATE TRIGGER trg_legal_document_digest
+    BEFORE INSERT OR UPDATE OF document_content ON regops_app.tbl_globi_eu_am_99_legal_documents
+    FOR EACH ROW EXECUTE FUNCTION regops_app.legal_document_digest();
+
+-- A handful of rows per country: fires the trigger for the existing texts
+UPDATE regops_app.tbl_globi_eu_am_99_legal_documents
+SET document_content = document_content
+WHERE document_content IS NOT NULL AND content_sha256 IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_legal_documents_content
+    ON regops_app.tbl_globi_eu_am_99_legal_documents (content_sha256);
+
+CREATE INDEX IF NOT EXISTS idx_legal_documents_lookup
+    ON regops_app.tbl_globi_eu_am_99_legal_documents (country_code, language_code)
+    WHERE is_active = true;
+
+-- migrate:step
+-- Verify
+SELECT country_code, language_code, document_type, version, content_size, content_sha256
+FROM regops_app.tbl_globi_eu_am_99_legal_documents
+ORDER BY country_code, language_code, document_type;
@@ -0,0 +1,56 @@
+-- ============================================================================
+-- Migration: Full-text search over service request texts
+-- Date: 2026-10-19
+-- Description: Adds a generated tsvector over issue_description,
+--              customer_notes and internal_notes, stemmed with the text
+--              search configuration of each request's language_code, and a
+--              GIN index on it. Used by GET /api/requests/search.
+--
+-- Weights: A = issue_description, B = customer_notes, C = internal_notes.
+-- Customers only match on A and B (internal notes stay internal).
+--
+-- Note: adding a STORED generated column rewrites the table under an
+-- ACCESS EXCLUSIVE lock. Run it in a maintenance window on large tables.
+-- ============================================================================
+
+BEGIN;
+
+-- Language code (en, de, de-AT, ...) -> text search configuration.
+-- Marked IMMUTABLE so it can be used in the generated column; only change
+-- it together with a rebuild of search_vector.
+CREATE OR REPLACE FUNCTION regops_app.request_search_config(language_code TEXT)
+RETURNS regconfig
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE lower(split_part(COALESCE(language_code, 'en'), '-', 1))
+        WHEN 'en' THEN 'pg_catalog.english'::regconfig
+        WHEN 'de' THEN 'pg_catalog.german'::regconfig
+        WHEN 'fr' THEN 'pg_catalog.french'::regconfig
+        WHEN 'it' THEN 'pg_catalog.italian'::regconfig
+        WHEN 'es' THEN 'pg_catalog.spanish'::regconfig
+        WHEN 'nl' THEN 'pg_catalog.dutch'::regconfig
+        WHEN 'pt' THEN 'pg_catalog.portuguese'::regconfig
+        WHEN 'sv' THEN 'pg_catalog.swedish'::regconfig
+        WHEN 'da' THEN 'pg_catalog.danish'::regconfig
+        WHEN 'no' THEN 'pg_catalog.norwegian'::regconfig
+        WHEN 'fi' THEN 'pg_catalog.finnish'::regconfig
+        ELSE 'pg_catalog.simple'::regconfig
+    END
+$$;
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_service_requests
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector(regops_app.request_search_config(language_code), COALESCE(issue_description, '')), 'A') ||
+        setweight(to_tsvector(regops_app.request_search_config(language_code), COALESCE(customer_notes, '')), 'B') ||
+        setweight(to_tsvector(regops_app.request_search_config(language_code), COALESCE(internal_notes, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_service_requests_search
+    ON regops_app.tbl_globi_eu_am_99_service_requests USING GIN (search_vector);
+
+COMMIT;
+
+-- Verify
+SELECT language_code, count(*) AS requests, count(*) FILTER (WHERE search_vector <> '') AS indexed
+FROM regops_app.tbl_globi_eu_am_99_service_requests
+GROUP BY language_code
+ORDER BY language_code;
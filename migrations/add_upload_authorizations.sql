@@ -0,0 +1,29 @@
+-- ============================================================================
+-- Migration: Track authorized direct uploads
+-- Date: 2026-10-19
+-- Description: /upload/authorize hands out create-only SAS URLs for blob
+--              names under {request_id}/. Each name is recorded here until
+--              /upload/finalize turns it into an attachment. Names whose
+--              SAS expired without a finalize are swept, together with any
+--              blob the client wrote (attachment_store.py sweep).
+--
+-- finalize only accepts recorded names and removes them in the same
+-- statement that inserts the attachments, so a sweep and a late finalize
+-- can't both act on one upload.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS regops_app.tbl_globi_eu_am_99_upload_authorizations (
+    blob_path VARCHAR(500) PRIMARY KEY,
+    request_id INTEGER NOT NULL,
+    authorized_by VARCHAR(255),
+    expires_at TIMESTAMP NOT NULL,
+    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_authorizations_expires
+    ON regops_app.tbl_globi_eu_am_99_upload_authorizations (expires_at);
+
+-- migrate:step
+-- Verify
+SELECT count(*) AS open_authorizations
+FROM regops_app.tbl_globi_eu_am_99_upload_authorizations;
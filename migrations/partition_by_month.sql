@@ -0,0 +1,281 @@
+-- ============================================================================
+-- Migration: Monthly range partitioning for service requests and activity log
+-- Date: 2026-10-19
+-- Description: Converts tbl_globi_eu_am_99_service_requests (by submitted_date)
+--              and tbl_globi_eu_am_99_activity_log (by performed_date) into
+--              natively range-partitioned tables with one partition per month
+--              (<table>_pYYYYMM) plus a default partition.
+--
+-- Run after add_request_search.sql (the search column and its GIN index are
+-- carried over if present). Runs in a single transaction and takes ACCESS
+-- EXCLUSIVE locks on both tables while the rows are copied: schedule a
+-- maintenance window and take a backup first.
+--
+-- Consequences of partitioning:
+-- - Primary keys become (id, submitted_date) / (id, performed_date); ids keep
+--   coming from the same sequences, so they stay unique in practice.
+-- - request_code is NO LONGER globally unique: a unique constraint on a
+--   partitioned table must include the partition key, so it becomes
+--   UNIQUE (request_code, submitted_date), which two requests submitted at
+--   different times never violate. Uniqueness is kept by
+--   generate_request_code() instead, which holds a transaction-level advisory
+--   lock per country and month until the caller commits its INSERT, so
+--   concurrent intakes can't number two requests alike.
+-- - The foreign keys from tbl_globi_eu_am_99_attachments and
+--   tbl_globi_eu_am_99_activity_log to service_requests(id) are DROPPED:
+--   Postgres cannot reference a partitioned table by id alone. Nothing stops
+--   orphaned rows any more; the API only writes them for requests it has just
+--   checked.
+--
+-- Future partitions are created by regops_app.create_monthly_partitions(),
+-- which the API calls at startup and every few hours (partitions.py).
+-- Old partitions are exported to blob storage and dropped with
+-- `python partitions.py archive`.
+-- ============================================================================
+
+BEGIN;
+
+-- ----------------------------------------------------------------------------
+-- Partition maintenance (idempotent, safe to call from several workers)
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION regops_app.create_monthly_partitions(p_parent REGCLASS, p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    v_schema TEXT;
+    v_table TEXT;
+    v_month DATE;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    SELECT n.nspname, c.relname INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    -- Serialize concurrent callers per parent table
+    PERFORM pg_advisory_xact_lock(p_parent::OID::BIGINT);
+
+    v_month := date_trunc('month', p_from)::DATE;
+    WHILE v_month <= p_to LOOP
+        v_name := v_table || '_p' || to_char(v_month, 'YYYYMM');
+        IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                v_schema, v_name, p_parent, v_month, (v_month + INTERVAL '1 month')::DATE
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::DATE;
+    END LOOP;
+
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Copies every non-generated column from one table into another
+CREATE OR REPLACE FUNCTION pg_temp.copy_rows(p_from REGCLASS, p_to REGCLASS)
+RETURNS BIGINT AS $$
+DECLARE
+    v_columns TEXT;
+    v_rows BIGINT;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+    FROM pg_attribute
+    WHERE attrelid = p_from AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+
+    EXECUTE format('INSERT INTO %s (%s) SELECT %s FROM %s', p_to, v_columns, v_columns, p_from);
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ----------------------------------------------------------------------------
+-- Dependencies that cannot survive the swap
+-- ----------------------------------------------------------------------------
+ALTER TABLE regops_app.tbl_globi_eu_am_99_attachments
+    DROP CONSTRAINT IF EXISTS tbl_globi_eu_am_99_attachments_request_id_fkey;
+ALTER TABLE regops_app.tbl_globi_eu_am_99_activity_log
+    DROP CONSTRAINT IF EXISTS tbl_globi_eu_am_99_activity_log_request_id_fkey;
+DROP VIEW IF EXISTS regops_app.vw_request_metrics;
+
+-- ----------------------------------------------------------------------------
+-- Service requests, by submitted_date
+-- ----------------------------------------------------------------------------
+ALTER TABLE regops_app.tbl_globi_eu_am_99_service_requests
+    RENAME TO tbl_globi_eu_am_99_service_requests_unpartitioned;
+
+-- Partition key must be NOT NULL for the primary key
+UPDATE regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned
+SET submitted_date = COALESCE(last_modified_date, CURRENT_TIMESTAMP)
+WHERE submitted_date IS NULL;
+
+CREATE TABLE regops_app.tbl_globi_eu_am_99_service_requests (
+    LIKE regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned
+    INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS
+) PARTITION BY RANGE (submitted_date);
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_service_requests ALTER COLUMN submitted_date SET NOT NULL;
+
+CREATE TABLE regops_app.tbl_globi_eu_am_99_service_requests_pdefault
+    PARTITION OF regops_app.tbl_globi_eu_am_99_service_requests DEFAULT;
+
+-- Every month with data (at least the last two years) up to three months ahead
+SELECT regops_app.create_monthly_partitions(
+    'regops_app.tbl_globi_eu_am_99_service_requests',
+    LEAST(
+        (SELECT MIN(submitted_date) FROM regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned),
+        CURRENT_DATE - INTERVAL '24 months'
+    )::DATE,
+    (CURRENT_DATE + INTERVAL '3 months')::DATE
+);
+
+DO $$
+DECLARE
+    v_expected BIGINT;
+    v_copied BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO v_expected FROM regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned;
+    v_copied := pg_temp.copy_rows(
+        'regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned',
+        'regops_app.tbl_globi_eu_am_99_service_requests'
+    );
+    IF v_copied <> v_expected THEN
+        RAISE EXCEPTION 'service_requests: copied % of % rows', v_copied, v_expected;
+    END IF;
+END $$;
+
+ALTER SEQUENCE regops_app.tbl_globi_eu_am_99_service_requests_id_seq
+    OWNED BY regops_app.tbl_globi_eu_am_99_service_requests.id;
+DROP TABLE regops_app.tbl_globi_eu_am_99_service_requests_unpartitioned;
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_service_requests
+    ADD CONSTRAINT tbl_globi_eu_am_99_service_requests_pkey PRIMARY KEY (id, submitted_date),
+    ADD CONSTRAINT tbl_globi_eu_am_99_service_requests_request_code_key UNIQUE (request_code, submitted_date),
+    ADD CONSTRAINT tbl_globi_eu_am_99_service_requests_customer_number_fkey
+        FOREIGN KEY (customer_number) REFERENCES regops_app.tbl_globi_eu_am_99_customers(customer_number),
+    ADD CONSTRAINT tbl_globi_eu_am_99_service_requests_territory_code_fkey
+        FOREIGN KEY (territory_code) REFERENCES regops_app.tbl_globi_eu_am_99_territories(territory_code);
+
+CREATE INDEX idx_service_requests_customer ON regops_app.tbl_globi_eu_am_99_service_requests(customer_number);
+CREATE INDEX idx_service_requests_territory ON regops_app.tbl_globi_eu_am_99_service_requests(territory_code);
+CREATE INDEX idx_service_requests_status ON regops_app.tbl_globi_eu_am_99_service_requests(status);
+CREATE INDEX idx_service_requests_submitted_date ON regops_app.tbl_globi_eu_am_99_service_requests(submitted_date);
+CREATE INDEX idx_service_requests_po_reference ON regops_app.tbl_globi_eu_am_99_service_requests(po_reference_number);
+CREATE INDEX idx_service_requests_customer_ident ON regops_app.tbl_globi_eu_am_99_service_requests(customer_ident_code);
+CREATE INDEX idx_service_requests_pickup_date ON regops_app.tbl_globi_eu_am_99_service_requests(pickup_date);
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = 'regops_app.tbl_globi_eu_am_99_service_requests'::REGCLASS
+          AND attname = 'search_vector' AND NOT attisdropped
+    ) THEN
+        CREATE INDEX idx_service_requests_search
+            ON regops_app.tbl_globi_eu_am_99_service_requests USING GIN (search_vector);
+    END IF;
+END $$;
+
+-- ----------------------------------------------------------------------------
+-- Activity log, by performed_date
+-- ----------------------------------------------------------------------------
+ALTER TABLE regops_app.tbl_globi_eu_am_99_activity_log
+    RENAME TO tbl_globi_eu_am_99_activity_log_unpartitioned;
+
+UPDATE regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned
+SET performed_date = CURRENT_TIMESTAMP
+WHERE performed_date IS NULL;
+
+CREATE TABLE regops_app.tbl_globi_eu_am_99_activity_log (
+    LIKE regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned
+    INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS
+) PARTITION BY RANGE (performed_date);
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_activity_log ALTER COLUMN performed_date SET NOT NULL;
+
+CREATE TABLE regops_app.tbl_globi_eu_am_99_activity_log_pdefault
+    PARTITION OF regops_app.tbl_globi_eu_am_99_activity_log DEFAULT;
+
+SELECT regops_app.create_monthly_partitions(
+    'regops_app.tbl_globi_eu_am_99_activity_log',
+    LEAST(
+        (SELECT MIN(performed_date) FROM regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned),
+        CURRENT_DATE - INTERVAL '24 months'
+    )::DATE,
+    (CURRENT_DATE + INTERVAL '3 months')::DATE
+);
+
+DO $$
+DECLARE
+    v_expected BIGINT;
+    v_copied BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO v_expected FROM regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned;
+    v_copied := pg_temp.copy_rows(
+        'regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned',
+        'regops_app.tbl_globi_eu_am_99_activity_log'
+    );
+    IF v_copied <> v_expected THEN
+        RAISE EXCEPTION 'activity_log: copied % of % rows', v_copied, v_expected;
+    END IF;
+END $$;
+
+ALTER SEQUENCE regops_app.tbl_globi_eu_am_99_activity_log_id_seq
+    OWNED BY regops_app.tbl_globi_eu_am_99_activity_log.id;
+DROP TABLE regops_app.tbl_globi_eu_am_99_activity_log_unpartitioned;
+
+ALTER TABLE regops_app.tbl_globi_eu_am_99_activity_log
+    ADD CONSTRAINT tbl_globi_eu_am_99_activity_log_pkey PRIMARY KEY (id, performed_date);
+
+CREATE INDEX idx_activity_request_date ON regops_app.tbl_globi_eu_am_99_activity_log(request_id, performed_date DESC);
+
+-- ----------------------------------------------------------------------------
+-- Recreate dependents
+-- ----------------------------------------------------------------------------
+CREATE VIEW regops_app.vw_request_metrics AS
+SELECT
+    country_code,
+    status,
+    repairability_status,
+    DATE(submitted_date) AS submitted_date,
+    COUNT(*) AS request_count,
+    AVG(EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - submitted_date)) / 3600) AS avg_age_in_hours
+FROM regops_app.tbl_globi_eu_am_99_service_requests
+GROUP BY country_code, status, repairability_status, DATE(submitted_date);
+
+-- Request codes are numbered per country and month: only look at this month's partition.
+-- Without a global unique constraint, concurrent callers are serialized on an advisory
+-- lock held until their transaction ends, so each sees the code the previous one inserted.
+CREATE OR REPLACE FUNCTION regops_app.generate_request_code(p_country_code VARCHAR)
+RETURNS VARCHAR AS $$
+DECLARE
+    v_sequence INTEGER;
+    v_year VARCHAR(4);
+    v_month VARCHAR(2);
+    v_request_code VARCHAR(50);
+BEGIN
+    v_year := TO_CHAR(CURRENT_TIMESTAMP, 'YYYY');
+    v_month := TO_CHAR(CURRENT_TIMESTAMP, 'MM');
+
+    PERFORM pg_advisory_xact_lock(hashtext('request_code:' || p_country_code || '-' || v_year || v_month));
+
+    SELECT COALESCE(MAX(CAST(SUBSTRING(request_code FROM POSITION('-' IN SUBSTRING(request_code FROM 9)) + 9) AS INTEGER)), 0) + 1
+    INTO v_sequence
+    FROM regops_app.tbl_globi_eu_am_99_service_requests
+    WHERE request_code LIKE p_country_code || '-' || v_year || v_month || '-%'
+      AND submitted_date >= date_trunc('month', CURRENT_TIMESTAMP);
+
+    v_request_code := p_country_code || '-' || v_year || v_month || '-' || LPAD(v_sequence::TEXT, 6, '0');
+
+    RETURN v_request_code;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
+
+-- Verify
+SELECT parent.relname AS table_name, COUNT(*) AS partitions
+FROM pg_inherits i
+JOIN pg_class parent ON parent.oid = i.inhparent
+JOIN pg_namespace n ON n.oid = parent.relnamespace
+WHERE n.nspname = 'regops_app' AND parent.relkind = 'p'
+GROUP BY parent.relname;
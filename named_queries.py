@@ -0,0 +1,172 @@
+"""
+Named, server-side prepared queries for the hot paths.
+
+    rows = execute_named("lookup_serial", query, (pattern, limit))
+
+The first execution of a name on a pooled connection runs
+`PREPARE app_<name> AS <query>`; later ones send only `EXECUTE app_<name>(...)`,
+so Postgres skips parsing and (after its first few runs) planning. Prepared
+statements live as long as the pooled connection.
+
+Every registered query, with call counts and latency, is listed at
+GET /api/admin/queries and exported as db_named_query_duration_seconds.
+
+A transaction-mode pooler (pgbouncer / Supavisor port 6543) does not keep
+session state, so with DB_PREPARED_STATEMENTS=auto (the default) connections
+to port 6543 send queries as plain text (still counted); true / false force
+it. If the server side loses a statement anyway (DISCARD ALL, a pooler
+switching backends), or already has one this connection doesn't know of, the
+transaction is rolled back and the statement prepared again, once.
+"""
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+import psycopg2.errors
+from dotenv import load_dotenv
+
+import metrics
+import query_budget
+from database import get_db_connection, rows_to_dicts, TimedRealDictCursor
+
+load_dotenv()
+
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "auto").lower()
+TRANSACTION_POOLER_PORT = 6543
+
+_NAME_RE = re.compile(r"^[a-z][a-z0-9_]*$")
+
+db_named_query_duration_seconds = metrics.Histogram(
+    "db_named_query_duration_seconds", "Execution time of named queries", ("query",)
+)
+
+
+class NamedQuery:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.param_count = len(re.findall(r"(?<!%)%s", sql))
+        self.statement = f"app_{name}"
+        self.prepare_sql = self._prepare_statement()
+        placeholders = ", ".join(["%s"] * self.param_count)
+        self.execute_sql = f"EXECUTE {self.statement}({placeholders})" if self.param_count else f"EXECUTE {self.statement}"
+        self.calls = 0
+        self.prepares = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _prepare_statement(self) -> str:
+        # psycopg2's %s placeholders become $1..$n; %% is a literal percent sign
+        counter = iter(range(1, self.param_count + 1))
+        body = re.sub(r"%%|%s", lambda m: "%" if m.group(0) == "%%" else f"${next(counter)}", self.sql)
+        # The PREPARE text goes through psycopg2 without parameters, so % needs no escaping
+        return f"PREPARE {self.statement} AS {body}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "prepares": self.prepares,
+            "total_ms": round(self.total_seconds * 1000, 1),
+            "mean_ms": round(self.total_seconds / self.calls * 1000, 3) if self.calls else None,
+            "max_ms": round(self.max_seconds * 1000, 1),
+            "sql": " ".join(self.sql.split()),
+        }
+
+
+_registry: Dict[str, NamedQuery] = {}
+_lock = threading.Lock()
+
+
+def register(name: str, sql: str) -> NamedQuery:
+    """
+    Declare a query under `name`. Idempotent: the same name may be declared in
+    several places as long as the SQL only differs in whitespace.
+    """
+    query = _registry.get(name)
+    if query is not None:
+        if query.sql != sql and " ".join(query.sql.split()) != " ".join(sql.split()):
+            raise ValueError(f"Named query {name!r} is already registered with different SQL")
+        return query
+    if not _NAME_RE.match(name):
+        raise ValueError(f"Invalid query name {name!r}")
+    with _lock:
+        return _registry.setdefault(name, NamedQuery(name, sql))
+
+
+def _uses_prepared(conn) -> bool:
+    if DB_PREPARED_STATEMENTS == "auto":
+        return conn.info.port != TRANSACTION_POOLER_PORT
+    return DB_PREPARED_STATEMENTS == "true"
+
+
+def _restart_transaction(conn):
+    """Roll back the failed statement's transaction; it held nothing but the query budget."""
+    conn.rollback()
+    budget = query_budget.current_budget()
+    if budget is not None:
+        budget.attach(conn)
+
+
+def _prepare(conn, cursor, query: NamedQuery):
+    try:
+        cursor.execute(query.prepare_sql)
+    except psycopg2.errors.DuplicatePreparedStatement:
+        # The backend has it from an earlier session (or our bookkeeping was reset): replace it
+        _restart_transaction(conn)
+        cursor.execute(f"DEALLOCATE {query.statement}")
+        cursor.execute(query.prepare_sql)
+    conn.prepared.add(query.name)
+    with _lock:
+        query.prepares += 1
+
+
+def execute_named(name: str, sql: str, params: Optional[tuple] = None, fetch: bool = True,
+                  read_only: bool = False, user: Optional[str] = None):
+    """
+    Like database.execute_query, but runs `sql` as the prepared statement `name`.
+    Returns a list of dicts, or the row count when fetch=False. read_only and
+    user route the query as in database.get_db_connection.
+    """
+    query = register(name, sql)
+    params = tuple(params or ())
+    if len(params) != query.param_count:
+        raise ValueError(f"Named query {name!r} takes {query.param_count} parameters, got {len(params)}")
+
+    with get_db_connection(read_only, user) as conn:
+        cursor = conn.cursor(cursor_factory=TimedRealDictCursor)
+        start = time.perf_counter()
+        if not _uses_prepared(conn):
+            cursor.execute(query.sql, params or None)
+        else:
+            for attempt in range(2):
+                if name not in conn.prepared:
+                    _prepare(conn, cursor, query)
+                try:
+                    cursor.execute(query.execute_sql, params)
+                    break
+                except psycopg2.errors.InvalidSqlStatementName:
+                    # Session state was reset underneath us (DISCARD ALL, pooler): prepare again
+                    if attempt:
+                        raise
+                    conn.prepared.clear()
+                    _restart_transaction(conn)
+        result = rows_to_dicts(cursor.fetchall()) if fetch else cursor.rowcount
+        elapsed = time.perf_counter() - start
+
+    with _lock:
+        query.calls += 1
+        query.total_seconds += elapsed
+        query.max_seconds = max(query.max_seconds, elapsed)
+    db_named_query_duration_seconds.observe(elapsed, query=name)
+    return result
+
+
+def catalog() -> List[Dict[str, Any]]:
+    """All registered queries, most total time first."""
+    with _lock:
+        queries = list(_registry.values())
+    return sorted((q.stats() for q in queries), key=lambda s: s["total_ms"], reverse=True)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Monthly partitions of the service request and activity log tables
+(see migrations/partition_by_month.sql).
+
+- The API keeps PARTITION_MONTHS_AHEAD future partitions in place: at
+  startup and every PARTITION_MAINTENANCE_INTERVAL seconds, so new rows
+  never land in the default partition.
+- Partitions older than ARCHIVE_AFTER_MONTHS are archived from the command
+  line (or a cron job): each one is exported as gzip-compressed CSV to blob
+  storage, detached and dropped. Service request partitions are only
+  archived once every request in them is closed; their attachment metadata
+  is exported and removed with them (the files themselves stay in blob storage).
+
+    python partitions.py status
+    python partitions.py maintain
+    python partitions.py archive --dry-run
+    python partitions.py archive --older-than-months 24 [--to-dir ./archive]
+
+Tables that have not been migrated yet are skipped.
+"""
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from database import get_db_connection, execute_query
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MAINTENANCE_ENABLED = os.getenv("PARTITION_MAINTENANCE_ENABLED", "true").lower() == "true"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "21600"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "24"))
+ARCHIVE_CONTAINER = os.getenv("ARCHIVE_CONTAINER", "service-request-archive")
+
+SCHEMA = "regops_app"
+SERVICE_REQUESTS = "tbl_globi_eu_am_99_service_requests"
+ACTIVITY_LOG = "tbl_globi_eu_am_99_activity_log"
+ATTACHMENTS = "tbl_globi_eu_am_99_attachments"
+ATTACHMENT_CONTENTS = "tbl_globi_eu_am_99_attachment_contents"
+
+# Partitioned table -> partition key
+PARTITIONED_TABLES = {
+    SERVICE_REQUESTS: "submitted_date",
+    ACTIVITY_LOG: "performed_date",
+}
+
+# A service request partition is archived only when all its requests are in one of these
+ARCHIVABLE_STATUSES = ("Closed", "Resolved")
+
+_PARTITION_RE = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned(table: str) -> bool:
+    rows = execute_query(
+        """
+        SELECT c.relkind = 'p' AS partitioned
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """,
+        (SCHEMA, table)
+    )
+    return bool(rows and rows[0]['partitioned'])
+
+
+def list_partitions(table: str) -> List[Dict]:
+    """Monthly partitions of `table`, oldest first, with estimated rows and size."""
+    rows = execute_query(
+        """
+        SELECT child.relname AS name,
+               child.reltuples::BIGINT AS estimated_rows,
+               pg_total_relation_size(child.oid) AS bytes
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = parent.relnamespace
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE n.nspname = %s AND parent.relname = %s
+        ORDER BY child.relname
+        """,
+        (SCHEMA, table)
+    )
+    partitions = []
+    for row in rows:
+        match = _PARTITION_RE.search(row['name'])
+        row['month'] = date(int(match.group(1)), int(match.group(2)), 1) if match else None
+        row['estimated_rows'] = max(row['estimated_rows'], 0)
+        partitions.append(row)
+    return partitions
+
+
+def ensure_future_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD) -> Dict[str, int]:
+    """Create any missing partitions from this month to `months_ahead` months ahead."""
+    this_month = date.today().replace(day=1)
+    created = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        rows = execute_query(
+            "SELECT regops_app.create_monthly_partitions(%s::regclass, %s, %s) AS created",
+            (f"{SCHEMA}.{table}", this_month, add_months(this_month, months_ahead))
+        )
+        created[table] = rows[0]['created']
+        if created[table]:
+            logger.info("Created partitions", extra={"table": table, "partitions": created[table]})
+    return created
+
+
+class PartitionMaintainer:
+    """Background thread calling ensure_future_partitions() periodically."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not PARTITION_MAINTENANCE_ENABLED or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                ensure_future_partitions()
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            self._stop.wait(PARTITION_MAINTENANCE_INTERVAL)
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+# ----------------------------------------------------------------------------
+# Archival
+# ----------------------------------------------------------------------------
+
+def _copy_columns(cursor, table: str) -> str:
+    """Column list for export: generated columns are rebuilt on restore."""
+    cursor.execute(
+        """
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        """,
+        (f"{SCHEMA}.{table}",)
+    )
+    return cursor.fetchone()[0]
+
+
+def _checksum(cursor, partition: str) -> Tuple[int, str]:
+    """Row count and content hash; detects changes between export and detach."""
+    cursor.execute(
+        f"SELECT count(*), md5(string_agg(md5(t::text), '' ORDER BY t.id)) FROM {SCHEMA}.{partition} t"
+    )
+    return tuple(cursor.fetchone())
+
+
+def _export(cursor, query: str, path: str):
+    with gzip.open(path, "wb", compresslevel=9) as out:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+
+
+class BlobArchive:
+    def __init__(self, container: str = ARCHIVE_CONTAINER):
+        from azure.storage.blob import BlobServiceClient
+        connection_string = os.getenv("AZURE_BLOB_CONNECTION_STRING")
+        if not connection_string:
+            raise RuntimeError("AZURE_BLOB_CONNECTION_STRING is not set (or use --to-dir)")
+        self._container = BlobServiceClient.from_connection_string(connection_string).get_container_client(container)
+        try:
+            self._container.create_container()
+        except Exception:
+            pass
+
+    def store(self, local_path: str, name: str) -> str:
+        with open(local_path, "rb") as f:
+            self._container.upload_blob(name, f, overwrite=True)
+        size = self._container.get_blob_client(name).get_blob_properties().size
+        if size != os.path.getsize(local_path):
+            raise RuntimeError(f"Uploaded size mismatch for {name}")
+        return f"{self._container.container_name}/{name}"
+
+
+class DirectoryArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def store(self, local_path: str, name: str) -> str:
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(local_path, target)
+        return target
+
+
+def archive_partition(table: str, partition: Dict, archive) -> Dict:
+    """Export one partition to `archive`, then detach and drop it."""
+    name = partition['name']
+    month = partition['month']
+    prefix = f"{table}/{month:%Y}/{name}"
+    result = {"table": table, "partition": name, "month": month.isoformat()}
+
+    with tempfile.TemporaryDirectory(prefix="archive-") as workdir:
+        # Export from one consistent snapshot
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            if table == SERVICE_REQUESTS:
+                placeholders = ", ".join(["%s"] * len(ARCHIVABLE_STATUSES))
+                cursor.execute(
+                    f"SELECT count(*) FROM {SCHEMA}.{name} WHERE status NOT IN ({placeholders})",
+                    ARCHIVABLE_STATUSES
+                )
+                still_open = cursor.fetchone()[0]
+                if still_open:
+                    result.update(status="skipped", reason=f"{still_open} requests not closed")
+                    return result
+
+            checksum = _checksum(cursor, name)
+            columns = _copy_columns(cursor, name)
+            files = {f"{prefix}.csv.gz": f"SELECT {columns} FROM {SCHEMA}.{name} ORDER BY id"}
+            if table == SERVICE_REQUESTS:
+                files[f"{prefix}_attachments.csv.gz"] = (
+                    f"SELECT a.* FROM {SCHEMA}.{ATTACHMENTS} a "
+                    f"WHERE a.request_id IN (SELECT id FROM {SCHEMA}.{name}) ORDER BY a.id"
+                )
+            for blob_name, query in files.items():
+                _export(cursor, query, os.path.join(workdir, os.path.basename(blob_name)))
+
+        stored = [
+            archive.store(os.path.join(workdir, os.path.basename(blob_name)), blob_name)
+            for blob_name in files
+        ]
+
+    # Detach and drop only if nothing changed since the export
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"ALTER TABLE {SCHEMA}.{table} DETACH PARTITION {SCHEMA}.{name}")
+        if _checksum(cursor, name) != checksum:
+            # Leaving the block with an exception rolls the detach back
+            raise RuntimeError(f"{name} changed during export; not archived, retry later")
+        if table == SERVICE_REQUESTS:
+            # The archived rows still point at their files: keep that content out of garbage collection
+            cursor.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.{ATTACHMENT_CONTENTS}",))
+            if cursor.fetchone()[0]:
+                cursor.execute(
+                    f"UPDATE {SCHEMA}.{ATTACHMENT_CONTENTS} SET archived = true WHERE sha256 IN ("
+                    f"SELECT content_sha256 FROM {SCHEMA}.{ATTACHMENTS} "
+                    f"WHERE request_id IN (SELECT id FROM {SCHEMA}.{name}))"
+                )
+            cursor.execute(
+                f"DELETE FROM {SCHEMA}.{ATTACHMENTS} WHERE request_id IN (SELECT id FROM {SCHEMA}.{name})"
+            )
+            result["attachments"] = cursor.rowcount
+        cursor.execute(f"DROP TABLE {SCHEMA}.{name}")
+
+    result.update(status="archived", rows=checksum[0], files=stored)
+    logger.info("Archived partition", extra=result)
+    return result
+
+
+def archive_old_partitions(older_than_months: int = ARCHIVE_AFTER_MONTHS, archive=None,
+                           dry_run: bool = False) -> List[Dict]:
+    """Archive every monthly partition that ended more than `older_than_months` ago."""
+    cutoff = add_months(date.today().replace(day=1), -older_than_months)
+    results = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        for partition in list_partitions(table):
+            if partition['month'] is None or partition['month'] >= cutoff:
+                continue
+            if dry_run:
+                results.append({
+                    "table": table, "partition": partition['name'], "status": "would_archive",
+                    "estimated_rows": partition['estimated_rows'], "bytes": partition['bytes'],
+                })
+                continue
+            if archive is None:
+                archive = BlobArchive()
+            try:
+                results.append(archive_partition(table, partition, archive))
+            except Exception as e:
+                logger.exception("Archiving partition failed", extra={"partition": partition['name']})
+                results.append({"table": table, "partition": partition['name'], "status": "failed", "error": str(e)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and archive monthly table partitions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="List partitions with estimated rows and size")
+    maintain = commands.add_parser("maintain", help="Create missing future partitions")
+    maintain.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive = commands.add_parser("archive", help="Export, detach and drop old partitions")
+    archive.add_argument("--older-than-months", type=int, default=ARCHIVE_AFTER_MONTHS)
+    archive.add_argument("--to-dir", help="Write archives to this directory instead of blob storage")
+    archive.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be archived")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "status":
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table):
+                print(f"{table}: not partitioned (run migrations/partition_by_month.sql)")
+                continue
+            print(table)
+            for p in list_partitions(table):
+                print(f"  {p['name']:<52} {p['estimated_rows']:>10,} rows {p['bytes'] / 2**20:>9.1f} MB")
+    elif args.command == "maintain":
+        for table, created in ensure_future_partitions(args.months_ahead).items():
+            print(f"{table}: {created} partitions created")
+    else:
+        target = DirectoryArchive(args.to_dir) if args.to_dir else None
+        results = archive_old_partitions(args.older_than_months, target, args.dry_run)
+        for r in results:
+            print(" ".join(f"{k}={v}" for k, v in r.items()))
+        if not results:
+            print("Nothing to archive")
+        if any(r["status"] == "failed" for r in results):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Password hashing and verification off the request path.
+
+Verifying a password hash is slow on purpose. It runs in a small dedicated
+thread pool (PASSWORD_HASH_WORKERS per API worker; argon2 and bcrypt release
+the GIL while hashing), so a burst of logins at shift start queues there
+instead of taking over the threadpool every other sync endpoint runs in. At
+most PASSWORD_HASH_QUEUE verifications wait per worker; beyond that login
+answers 503 with Retry-After.
+
+Stored formats: argon2id ($argon2id$...), bcrypt ($2b$...) and - as in the
+PoC seed data - plaintext, accepted while PASSWORD_ALLOW_PLAINTEXT is true.
+Plaintext, the other scheme and outdated cost parameters are replaced with
+a fresh hash on the user's next successful login.
+
+    python passwords.py hash         # prompts for a password, prints the value for password_hash
+    python passwords.py benchmark    # time one verification with the current settings
+"""
+import argparse
+import asyncio
+import getpass
+import hmac
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+import metrics
+
+try:
+    import argon2
+    from argon2.exceptions import InvalidHashError, VerificationError, VerifyMismatchError
+except ImportError:
+    argon2 = None
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "argon2").lower()
+# argon2id defaults: OWASP's 19 MiB / 2 iterations / 1 lane
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_ALLOW_PLAINTEXT = os.getenv("PASSWORD_ALLOW_PLAINTEXT", "true").lower() == "true"
+# Concurrent verifications per API worker, and how many may wait for one
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+password_verifications_total = metrics.Counter(
+    "password_verifications_total", "Password checks by outcome", ("outcome",)
+)
+password_verify_seconds = metrics.Histogram(
+    "password_verify_seconds", "Time to verify (and if needed rehash) one password", (),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+_hasher = None
+
+
+def _argon2_hasher():
+    global _hasher
+    if _hasher is None:
+        if argon2 is None:
+            raise RuntimeError("argon2-cffi is not installed")
+        _hasher = argon2.PasswordHasher(
+            time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM
+        )
+    return _hasher
+
+
+def _is_bcrypt(stored: str) -> bool:
+    return stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password(password: str) -> str:
+    """Hash with the configured scheme and costs."""
+    if PASSWORD_SCHEME == "bcrypt":
+        if bcrypt is None:
+            raise RuntimeError("bcrypt is not installed")
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+    return _argon2_hasher().hash(password)
+
+
+def needs_rehash(stored: str) -> bool:
+    """Stored value is not a hash in the configured scheme with the configured costs."""
+    if PASSWORD_SCHEME == "bcrypt":
+        return not _is_bcrypt(stored) or int(stored.split("$")[2]) != BCRYPT_ROUNDS
+    if not stored.startswith("$argon2"):
+        return True
+    return _argon2_hasher().check_needs_rehash(stored)
+
+
+def verify_password(stored: str, password: str) -> bool:
+    if stored.startswith("$argon2"):
+        if argon2 is None:
+            raise RuntimeError("argon2-cffi is not installed")
+        try:
+            return _argon2_hasher().verify(stored, password)
+        except (VerifyMismatchError, VerificationError, InvalidHashError):
+            return False
+    if _is_bcrypt(stored):
+        if bcrypt is None:
+            raise RuntimeError("bcrypt is not installed")
+        try:
+            return bcrypt.checkpw(password.encode(), stored.encode())
+        except ValueError:
+            return False
+    if not PASSWORD_ALLOW_PLAINTEXT:
+        return False
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+
+_dummy_hash: Optional[str] = None
+
+
+def _check(stored: Optional[str], password: str) -> Tuple[bool, Optional[str]]:
+    global _dummy_hash
+    if stored is None:
+        # Unknown user: spend the same time as for a real one, so response
+        # times don't tell which addresses have an account
+        if _dummy_hash is None:
+            _dummy_hash = hash_password(secrets.token_urlsafe(16))
+        verify_password(_dummy_hash, password)
+        return False, None
+    if not verify_password(stored, password):
+        return False, None
+    return True, hash_password(password) if needs_rehash(stored) else None
+
+
+class PasswordVerifier:
+    """Bounded pool for password checks; admission is limited to PASSWORD_HASH_QUEUE waiting checks."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue: int = PASSWORD_HASH_QUEUE):
+        self.workers = max(workers, 1)
+        self.queue = queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+            return self._executor
+
+    async def check(self, stored: Optional[str], password: str) -> Tuple[bool, Optional[str]]:
+        """
+        (valid, replacement): `replacement` is a new hash to store when the
+        stored value is plaintext or outdated, else None.
+        """
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue:
+                password_verifications_total.inc(outcome="rejected")
+                raise HTTPException(503, "Too many sign-ins at once, please retry", headers={"Retry-After": "1"})
+            self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            valid, replacement = await loop.run_in_executor(self._pool(), _check, stored, password)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        password_verify_seconds.observe(time.perf_counter() - started)
+        password_verifications_total.inc(outcome="valid" if valid else "invalid")
+        return valid, replacement
+
+    def stop(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_verifier = PasswordVerifier()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("hash", help="Prompt for a password and print its hash")
+    benchmark = sub.add_parser("benchmark", help="Time verification with the current settings")
+    benchmark.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "hash":
+        password = getpass.getpass("Password: ")
+        if password != getpass.getpass("Repeat: "):
+            print("Passwords do not match")
+            return 1
+        print(hash_password(password))
+        return 0
+
+    stored = hash_password("benchmark-password")
+    timings = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        verify_password(stored, "benchmark-password")
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"{PASSWORD_SCHEME}: {stored.split('$')[1:4]}")
+    print(f"verify: median {timings[len(timings) // 2] * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms "
+          f"-> about {PASSWORD_HASH_WORKERS / timings[len(timings) // 2]:.0f} logins/s per API worker")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
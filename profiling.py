@@ -0,0 +1,259 @@
+"""
+Opt-in request profiling.
+
+A profile is captured when an Admin sends `X-Profile: 1`, or automatically
+for requests slower than PROFILE_SLOW_MS (disabled by default). A sampling
+thread records the stacks of the threads serving profiled requests every
+PROFILE_INTERVAL_MS; the SQL statements a request executes are collected
+alongside. The last PROFILE_RING_SIZE profiles are kept in memory and can be
+read through /api/admin/profiles.
+
+Sync endpoints run in FastAPI's threadpool, so instrument_routes() wraps each
+endpoint to tell the sampler which thread is working for which request.
+"""
+import functools
+import inspect
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any, Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 = no automatic profiles
+PROFILE_AUTO_SAMPLE_RATE = float(os.getenv("PROFILE_AUTO_SAMPLE_RATE", "1.0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "20"))
+PROFILE_MAX_SQL = 200
+MAX_STACK_DEPTH = 64
+
+_ids = itertools.count(1)
+
+
+class ProfileSession:
+    def __init__(self, method: str, path: str, forced: bool):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.forced = forced
+        self.started_at = time.time()
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.samples: Counter = Counter()
+        self.sql: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_sql(self, sql, duration: float):
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        with self._lock:
+            if len(self.sql) < PROFILE_MAX_SQL:
+                self.sql.append({
+                    "query": " ".join(str(sql).split()),
+                    "duration_ms": round(duration * 1000, 2),
+                    "offset_ms": round((time.time() - self.started_at) * 1000, 2),
+                })
+
+    def add_sample(self, stack: str):
+        with self._lock:
+            self.samples[stack] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "duration_ms": self.duration_ms,
+            "trigger": "header" if self.forced else "slow",
+            "started_at": self.started_at,
+            "samples": sum(self.samples.values()),
+            "sql_count": len(self.sql),
+            "sql_ms": round(sum(q["duration_ms"] for q in self.sql), 2),
+        }
+
+    def detail(self, top: int = 30) -> Dict[str, Any]:
+        with self._lock:
+            samples = Counter(self.samples)
+        total = sum(samples.values()) or 1
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        for stack, count in samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                cumulative[frame] += count
+        result = self.summary()
+        result.update({
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "top_self": [
+                {"frame": f, "samples": c, "pct": round(100.0 * c / total, 1)}
+                for f, c in own.most_common(top)
+            ],
+            "top_cumulative": [
+                {"frame": f, "samples": c, "pct": round(100.0 * c / total, 1)}
+                for f, c in cumulative.most_common(top)
+            ],
+            # Brendan Gregg "folded" format: paste into flamegraph.pl or speedscope
+            "collapsed": [f"{stack} {count}" for stack, count in samples.most_common()],
+            "sql": self.sql,
+        })
+        return result
+
+
+class StackSampler:
+    """Samples the stacks of attached threads while any session is active."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._attached: Dict[int, Set[ProfileSession]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def attach(self, thread_id: int, session: ProfileSession):
+        with self._lock:
+            self._attached.setdefault(thread_id, set()).add(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def detach(self, thread_id: int, session: ProfileSession):
+        with self._lock:
+            sessions = self._attached.get(thread_id)
+            if sessions:
+                sessions.discard(session)
+                if not sessions:
+                    del self._attached[thread_id]
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                attached = {tid: list(s) for tid, s in self._attached.items()}
+            if not attached:
+                # Idle until the next profiled request attaches
+                self._wake.wait(60)
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, sessions in attached.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = _collapse(frame)
+                for session in sessions:
+                    session.add_sample(stack)
+            time.sleep(self.interval)
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0)
+_current_session: ContextVar[Optional[ProfileSession]] = ContextVar("current_profile_session", default=None)
+_profiles = deque(maxlen=PROFILE_RING_SIZE)
+_profiles_lock = threading.Lock()
+
+
+def start_session(method: str, path: str, forced: bool) -> Optional[ProfileSession]:
+    """
+    Begin profiling the current request if it was asked for (forced) or if
+    automatic slow-request profiling is enabled and this request is sampled.
+    """
+    if not forced:
+        if PROFILE_SLOW_MS <= 0 or random.random() >= PROFILE_AUTO_SAMPLE_RATE:
+            return None
+    session = ProfileSession(method, path, forced)
+    _current_session.set(session)
+    return session
+
+
+def finish_session(session: ProfileSession, status_code: int, duration: float) -> bool:
+    """Keep the profile if it was forced or the request crossed the slow threshold."""
+    session.status_code = status_code
+    session.duration_ms = round(duration * 1000, 2)
+    if session.forced or session.duration_ms >= PROFILE_SLOW_MS:
+        with _profiles_lock:
+            _profiles.append(session)
+        return True
+    return False
+
+
+def record_sql(sql, duration: float):
+    """Called by the database layer for every statement."""
+    session = _current_session.get()
+    if session is not None:
+        session.add_sql(sql, duration)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    with _profiles_lock:
+        return [p.summary() for p in reversed(_profiles)]
+
+
+def get_profile(profile_id: int) -> Optional[Dict[str, Any]]:
+    with _profiles_lock:
+        for p in _profiles:
+            if p.id == profile_id:
+                return p.detail()
+    return None
+
+
+def _wrap_endpoint(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            session = _current_session.get()
+            if session is None:
+                return await func(*args, **kwargs)
+            thread_id = threading.get_ident()
+            _sampler.attach(thread_id, session)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _sampler.detach(thread_id, session)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def sync_wrapper(*args, **kwargs):
+        session = _current_session.get()
+        if session is None:
+            return func(*args, **kwargs)
+        thread_id = threading.get_ident()
+        _sampler.attach(thread_id, session)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _sampler.detach(thread_id, session)
+    return sync_wrapper
+
+
+def instrument_routes(app):
+    """
+    Wrap every API endpoint so the sampler knows which thread runs it.
+    Call once, after all routers are included.
+    """
+    from fastapi.routing import APIRoute
+
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route.dependant.call, "_profiled", False):
+            wrapped = _wrap_endpoint(route.dependant.call)
+            wrapped._profiled = True
+            route.dependant.call = wrapped
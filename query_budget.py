@@ -0,0 +1,154 @@
+"""
+Per-route database time budgets and cancellation on client disconnect.
+
+    @router.get("/search", dependencies=[Depends(query_budget("request_search"))])
+
+For the duration of the request every transaction opened through
+database.get_db_connection starts with `SET LOCAL statement_timeout` set to
+what is left of the route's budget, so all of a request's queries share one
+deadline. While the endpoint runs, a watcher waits for the client to go away
+(browser navigated, fetch aborted) and cancels the running statement with
+connection.cancel(), so abandoned queries stop using database CPU.
+
+A statement cancelled by its budget becomes 503; the outcome is counted in
+db_query_cancellations_total{route_class, reason}.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGETS_ENABLED = os.getenv("QUERY_BUDGETS_ENABLED", "true").lower() == "true"
+QUERY_CANCEL_ON_DISCONNECT = os.getenv("QUERY_CANCEL_ON_DISCONNECT", "true").lower() == "true"
+
+# Milliseconds of database time per request, by route class
+DEFAULT_BUDGETS = {
+    "requests_list": 8000,
+    "request_search": 5000,
+    "customer_search": 3000,
+    "lookups": 2000,
+}
+
+db_query_cancellations_total = metrics.Counter(
+    "db_query_cancellations_total", "Statements cancelled by a request's query budget",
+    ("route_class", "reason")
+)
+
+
+def load_budgets() -> Dict[str, int]:
+    """Budgets per route class, overridable as QUERY_TIMEOUT_<CLASS>=milliseconds."""
+    return {
+        name: int(os.getenv(f"QUERY_TIMEOUT_{name.upper()}", str(default)))
+        for name, default in DEFAULT_BUDGETS.items()
+    }
+
+
+BUDGETS = load_budgets()
+
+
+class QueryBudget:
+    def __init__(self, route_class: str, milliseconds: int):
+        self.route_class = route_class
+        self.deadline = time.monotonic() + milliseconds / 1000
+        self.disconnected = False
+        self._connections: Set = set()
+        self._lock = threading.Lock()
+
+    def remaining_ms(self) -> int:
+        # statement_timeout = 0 would mean "no limit"; an exhausted budget cancels at once
+        if self.disconnected:
+            return 1
+        return max(int((self.deadline - time.monotonic()) * 1000), 1)
+
+    def attach(self, conn):
+        """Apply the remaining budget to the transaction just opened on `conn`."""
+        with self._lock:
+            self._connections.add(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = %s", (self.remaining_ms(),))
+
+    def detach(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    def cancel(self):
+        """The client is gone: cancel what is running and fail whatever comes next."""
+        # Under the lock: detach() must not hand a connection back to the pool
+        # (and to another request) while its cancel is in flight
+        with self._lock:
+            self.disconnected = True
+            for conn in self._connections:
+                try:
+                    conn.cancel()
+                except Exception as e:
+                    logger.warning("Could not cancel query: %s", e)
+
+    def record_cancel(self):
+        reason = "client_disconnected" if self.disconnected else "timeout"
+        db_query_cancellations_total.inc(route_class=self.route_class, reason=reason)
+        logger.info("Query cancelled", extra={"route_class": self.route_class, "reason": reason})
+
+
+_current_budget: ContextVar[Optional[QueryBudget]] = ContextVar("current_query_budget", default=None)
+
+
+def current_budget() -> Optional[QueryBudget]:
+    return _current_budget.get()
+
+
+async def _cancel_on_disconnect(request: Request, budget: QueryBudget):
+    # The body (if any) has already been read for the endpoint; what is left is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            budget.cancel()
+            return
+
+
+def query_budget(route_class: str, cancel_on_disconnect: bool = True):
+    """
+    Dependency factory: the route's queries share a BUDGETS[route_class] ms
+    deadline. Pass cancel_on_disconnect=False where a query's result is shared
+    with other waiting requests (single-flight caches).
+    """
+    if route_class not in BUDGETS:
+        raise ValueError(f"Unknown query budget class: {route_class}")
+    milliseconds = BUDGETS[route_class]
+
+    async def dependency(request: Request):
+        if not QUERY_BUDGETS_ENABLED or milliseconds <= 0:
+            yield
+            return
+        budget = QueryBudget(route_class, milliseconds)
+        token = _current_budget.set(budget)
+        watcher = None
+        if cancel_on_disconnect and QUERY_CANCEL_ON_DISCONNECT:
+            watcher = asyncio.create_task(_cancel_on_disconnect(request, budget))
+        try:
+            yield
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            _current_budget.reset(token)
+    return dependency
+
+
+async def query_canceled_handler(request: Request, exc: Exception) -> JSONResponse:
+    """QueryCanceledError -> 503 (the client of a disconnect-cancelled query never sees it)."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The database took too long to answer; please narrow the query or retry"},
+    )
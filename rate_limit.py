@@ -0,0 +1,188 @@
+"""
+Token-bucket rate limiting per caller and route class.
+
+Each route class has a bucket of `capacity` tokens that refills over `period`
+seconds; every request takes one token. Callers are identified by the email
+in their token, or by client IP for anonymous calls and /api/login.
+
+    @router.get("/serial", dependencies=[Depends(rate_limit("lookups"))])
+
+Buckets live in process memory by default. With several gunicorn workers the
+effective limit is then per worker; set RATE_LIMIT_BACKEND=redis (requires the
+`redis` package) to share buckets between workers and instances.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request
+
+import metrics
+from auth import verify_entra_token, TokenData
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Buckets kept by the memory backend; least recently used ones are dropped first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+# Behind Render's proxy the client address is the last X-Forwarded-For hop (the one
+# the proxy appended); earlier hops are client-supplied and can be spoofed
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "true").lower() == "true"
+
+# "<capacity>/<period seconds>": burst size and the time a drained bucket takes to refill
+DEFAULT_LIMITS = {
+    "login": "10/60",
+    "lookups": "30/10",
+    "customer_search": "20/10",
+    "legal": "30/60",
+}
+
+rate_limit_decisions_total = metrics.Counter(
+    "rate_limit_decisions_total", "Rate limiter decisions", ("route_class", "outcome")
+)
+
+
+def _parse_limit(spec: str) -> Tuple[float, float]:
+    capacity, _, period = spec.partition("/")
+    return float(capacity), float(period or 1)
+
+
+def load_limits() -> Dict[str, Tuple[float, float]]:
+    """Limits per route class, overridable as RATE_LIMIT_<CLASS>=capacity/period."""
+    return {
+        name: _parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+        for name, default in DEFAULT_LIMITS.items()
+    }
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, period: float) -> float:
+        """Take one token. Returns 0 if allowed, else seconds until a token is available."""
+        rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+# KEYS[1] bucket; ARGV capacity, period. Uses the Redis clock so all workers agree.
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local rate = capacity / period
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(period) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def take(self, key: str, capacity: float, period: float) -> float:
+        try:
+            return float(self._take(keys=[f"ratelimit:{key}"], args=[capacity, period]))
+        except Exception as e:
+            # Fail open: an unreachable limiter must not take the API down with it
+            logger.warning("Rate limit backend unavailable, allowing request: %s", e)
+            return 0.0
+
+
+class RateLimiter:
+    def __init__(self, backend=None, limits: Dict[str, Tuple[float, float]] = None):
+        self.backend = backend or MemoryBackend()
+        self.limits = limits or load_limits()
+
+    def check(self, route_class: str, subject: str):
+        """Raise 429 with Retry-After if `subject` has used up its bucket for `route_class`."""
+        capacity, period = self.limits[route_class]
+        wait = self.backend.take(f"{route_class}:{subject}", capacity, period)
+        if wait > 0:
+            rate_limit_decisions_total.inc(route_class=route_class, outcome="rejected")
+            logger.info("Rate limit exceeded", extra={"route_class": route_class, "subject": subject})
+            raise HTTPException(
+                429,
+                "Too many requests, please slow down",
+                headers={"Retry-After": str(max(math.ceil(wait), 1))},
+            )
+        rate_limit_decisions_total.inc(route_class=route_class, outcome="allowed")
+
+
+def _create_limiter() -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "redis":
+        return RateLimiter(RedisBackend())
+    return RateLimiter()
+
+
+limiter = _create_limiter()
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(route_class: str, by_ip: bool = False):
+    """
+    Dependency factory. Keys the bucket on the caller's email, or on the client
+    IP when `by_ip` is set (endpoints called before login) or the caller is anonymous.
+    """
+    if route_class not in limiter.limits:
+        raise ValueError(f"Unknown rate limit class: {route_class}")
+
+    if by_ip:
+        def dependency(request: Request):
+            if RATE_LIMIT_ENABLED:
+                limiter.check(route_class, f"ip:{client_ip(request)}")
+        return dependency
+
+    def dependency(request: Request, token_data: TokenData = Depends(verify_entra_token)):
+        if not RATE_LIMIT_ENABLED:
+            return
+        if token_data.email == "anonymous@stryker.com":
+            subject = f"ip:{client_ip(request)}"
+        else:
+            subject = f"user:{token_data.email.lower()}"
+        limiter.check(route_class, subject)
+    return dependency
@@ -0,0 +1,106 @@
+from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from auth import require_role, Roles, TokenData
+import profiling
+from item_index import item_index
+from authorization import access_resolver
+import metrics
+import named_queries
+import partitions
+import media
+import attachment_store
+
+router = APIRouter()
+
+@router.get("/profiles")
+def list_profiles(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Recently captured request profiles, newest first.
+    Send `X-Profile: 1` as an Admin to profile a specific request.
+    """
+    return profiling.list_profiles()
+
+@router.get("/profiles/{profile_id}")
+def get_profile(
+    profile_id: int,
+    token_data: TokenData = Depends(require_role([Roles.ADMIN]))
+):
+    """
+    Stack samples (top frames and folded stacks for flame graphs)
+    and the SQL statements executed by one profiled request
+    """
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(404, "Profile not found (it may have rotated out of the buffer)")
+    return profile
+
+@router.get("/queries")
+def list_named_queries(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Catalog of named (prepared) queries with call counts and latency,
+    most total time first. Numbers are for the worker serving this call.
+    """
+    return named_queries.catalog()
+
+@router.get("/slow-queries")
+def list_slow_queries(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Recent slow statements (SLOW_QUERY_SAMPLES) with normalized SQL,
+    as sampled by the worker serving this call
+    """
+    return metrics.slow_query_samples()
+
+@router.get("/item-index")
+def get_item_index_stats(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    State of the in-memory item index (ITEM_INDEX_ENABLED) and its
+    approximate memory footprint, including MB per million items
+    """
+    return item_index.stats()
+
+@router.get("/partitions")
+def list_table_partitions(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Monthly partitions per table with estimated rows and size, and the
+    partitions the next archive run would pick up
+    """
+    result = {}
+    for table in partitions.PARTITIONED_TABLES:
+        if not partitions.is_partitioned(table):
+            result[table] = {"partitioned": False}
+            continue
+        result[table] = {
+            "partitioned": True,
+            "partitions": partitions.list_partitions(table),
+        }
+    result["archive_candidates"] = partitions.archive_old_partitions(dry_run=True)
+    return result
+
+@router.get("/media")
+def get_media_queue(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Attachments per media processing status (pending, processing, ready,
+    failed, skipped) with the age of the oldest upload in each
+    """
+    return media.queue_status()
+
+@router.get("/storage")
+def get_attachment_storage(token_data: TokenData = Depends(require_role([Roles.ADMIN]))):
+    """
+    Content-addressed attachment storage: distinct contents, bytes stored vs.
+    bytes referenced by attachments, and the deduplication queue
+    """
+    return attachment_store.storage_status()
+
+@router.post("/access-cache/invalidate")
+def invalidate_access_cache(
+    email: Optional[str] = None,
+    token_data: TokenData = Depends(require_role([Roles.ADMIN]))
+):
+    """
+    Drop cached roles/territories for one user (or everyone) after editing
+    customer_users or user_territories. Affects the worker that serves this
+    call; other workers pick the change up within AUTHZ_CACHE_TTL.
+    """
+    access_resolver.invalidate(email)
+    return {"invalidated": email or "all"}
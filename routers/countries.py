@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import List, Dict, Any
 from auth import verify_entra_token, TokenData
-from database import execute_query
+from named_queries import execute_named
+import legal_assets
 
 router = APIRouter()
 
@@ -17,7 +18,7 @@ def get_countries(token_data: TokenData = Depends(verify_entra_token)):
         WHERE is_active = true
         ORDER BY country_name
     """
-    return execute_query(query)
+    return execute_named("active_countries", query, read_only=True)
 
 @router.get("/countries/{country_code}/languages")
 def get_country_languages(
@@ -38,7 +39,7 @@ def get_country_languages(
         )
         AND l.is_active = true
     """
-    return execute_query(query, (country_code,))
+    return execute_named("country_languages", query, (country_code,), read_only=True)
 
 @router.get("/countries/{country_code}/legal")
 def get_legal_documents(
@@ -49,12 +50,26 @@ def get_legal_documents(
     """
     Get Terms & Conditions and Privacy Policy for a country
     UR-031: Terms and Conditions and Privacy Policy
+
+    The texts themselves are static assets at `content_url` (see legal_assets.py)
     """
     query = """
-        SELECT document_type, document_url, document_content, version, effective_date
+        SELECT document_type, document_url, version, effective_date,
+               content_sha256, content_size, content_type
         FROM regops_app.tbl_globi_eu_am_99_legal_documents
         WHERE country_code = %s
         AND language_code = %s
         AND is_active = true
     """
-    return execute_query(query, (country_code, language_code))
+    documents = execute_named("legal_documents", query, (country_code, language_code), read_only=True)
+    for document in documents:
+        document["content_url"] = legal_assets.asset_url(document["content_sha256"], document["content_type"])
+    return documents
+
+@router.get("/legal/{name}")
+def get_legal_document_asset(name: str, request: Request):
+    """
+    Legal document text by content hash, e.g. /api/legal/<sha256>.html
+    Public and immutable: cached for a year, with ranges and gzip/brotli variants
+    """
+    return legal_assets.serve(request, name)
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr, validator
 from datetime import datetime, date
 from auth import verify_entra_token, TokenData
-from database import execute_query, get_db_connection
+from database import get_db_connection, note_write
+from named_queries import execute_named
+from activity_log import log_activity, ActivityType
+from intake_bootstrap import intake_bootstrap
 
 router = APIRouter()
 
@@ -115,46 +118,37 @@ def submit_service_request(
         if not all([request.item_description, request.customer_name]):
             raise HTTPException(400, "Item description and customer name are required for General requests")
 
-    # Generate unique request code (UR-044)
+    # One connection for the whole submit: the lookups run on it before the
+    # request code is generated, whose advisory lock is held until commit
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
-        # Call PostgreSQL function to generate request code
-        cursor.execute(
-            "SELECT regops_app.generate_request_code(%s)",
-            (request.country_code,)
-        )
-        request_code_param = cursor.fetchone()[0]
-
         # Determine repairability status (UR-041)
         repairability_status = None
         if request.serial_number or request.item_number:
             # Auto-assign based on item data
-            item_query = """
+            cursor.execute("""
                 SELECT repairability_status
                 FROM regops_app.tbl_globi_eu_am_99_items
                 WHERE (serial_number = %s OR item_number = %s)
                 AND is_serviceable = true
-            """
-            item_result = execute_query(
-                item_query,
-                (request.serial_number or '', request.item_number or '')
-            )
+            """, (request.serial_number or '', request.item_number or ''))
+            item_result = cursor.fetchone()
             if item_result:
-                repairability_status = item_result[0]['repairability_status']
+                repairability_status = item_result[0]
 
         # Determine territory for routing (UR-046)
         territory_code = None
         if request.customer_number:
-            territory_query = """
+            cursor.execute("""
                 SELECT territory_code
                 FROM regops_app.tbl_globi_eu_am_99_customers
                 WHERE customer_number = %s
                 LIMIT 1
-            """
-            territory_result = execute_query(territory_query, (request.customer_number,))
+            """, (request.customer_number,))
+            territory_result = cursor.fetchone()
             if territory_result:
-                territory_code = territory_result[0]['territory_code']
+                territory_code = territory_result[0]
 
         # If no customer_number (shouldn't happen for Customer role), use user's first territory
         if not territory_code and token_data.territories:
@@ -163,6 +157,13 @@ def submit_service_request(
         if not territory_code:
             raise HTTPException(400, "Unable to determine territory for request")
 
+        # Generate unique request code (UR-044)
+        cursor.execute(
+            "SELECT regops_app.generate_request_code(%s)",
+            (request.country_code,)
+        )
+        request_code_param = cursor.fetchone()[0]
+
         # Insert service request - Updated per UR-1121517
         insert_query = """
             INSERT INTO regops_app.tbl_globi_eu_am_99_service_requests (
@@ -272,14 +273,12 @@ def submit_service_request(
 
         request_id = cursor.fetchone()[0]
 
-        # Log activity
-        cursor.execute("""
-            INSERT INTO regops_app.tbl_globi_eu_am_99_activity_log (request_id, activity_type, activity_description, performed_by)
-            VALUES (%s, 'Created', 'Service request created', %s)
-        """, (request_id, token_data.email))
-
         conn.commit()
 
+    note_write(token_data.email)
+    # Log activity (written asynchronously in batches)
+    log_activity(request_id, ActivityType.CREATED, 'Service request created', token_data.email)
+
     # Return confirmation (UR-045)
     return {
         "success": True,
@@ -306,7 +305,7 @@ def get_issue_reasons(
         ORDER BY display_order, main_reason, sub_reason
     """
 
-    results = execute_query(query, (language_code,))
+    results = execute_named("issue_reasons_by_language", query, (language_code,), read_only=True)
 
     # Group by main_reason
     grouped = {}
@@ -331,4 +330,26 @@ def get_repairability_statuses(token_data: TokenData = Depends(verify_entra_toke
         WHERE is_active = true
         ORDER BY status_name
     """
-    return execute_query(query)
+    return execute_named("repairability_statuses", query, read_only=True)
+
+@router.get("/intake/bootstrap")
+def get_intake_bootstrap(
+    request: Request,
+    country: Optional[str] = None,
+    lang: Optional[str] = None,
+    token_data: TokenData = Depends(verify_entra_token)
+):
+    """
+    Everything the intake form needs before the user can type, in one response:
+    countries, the country's languages, legal documents, issue reasons and
+    repairability statuses. Precomputed (see intake_bootstrap.py); `version`
+    doubles as ETag, so unchanged data revalidates with 304.
+    """
+    payload = intake_bootstrap.get(country, lang)
+    if payload is None:
+        raise HTTPException(404, "Unknown country or language")
+
+    headers = {"ETag": f'"{payload.version}"', "Cache-Control": "private, no-cache"}
+    if payload.version in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(payload.body, media_type="application/json", headers=headers)
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from database import execute_query
-from datetime import datetime
+from named_queries import execute_named
+from authorization import access_resolver
+from passwords import password_verifier
+from last_login import last_login_writer
 
 router = APIRouter()
 
@@ -19,13 +22,13 @@ class LoginResponse(BaseModel):
     territories: Optional[List[str]] = None
 
 @router.post("/login", response_model=LoginResponse)
-def login(credentials: LoginRequest):
+async def login(credentials: LoginRequest):
     """
     Simple email/password authentication for PoC
     Returns user data if credentials are valid
     """
 
-    # Query user from database
+    # User, customer and territories in one round trip
     query = """
         SELECT
             cu.email,
@@ -35,23 +38,31 @@ def login(credentials: LoginRequest):
             cu.password_hash,
             cu.is_active,
             cu.role,
-            c.customer_name
+            c.customer_name,
+            ARRAY(
+                SELECT ut.territory_code
+                FROM regops_app.tbl_globi_eu_am_99_user_territories ut
+                WHERE ut.user_email = cu.email
+            ) AS territories
         FROM regops_app.tbl_globi_eu_am_99_customer_users cu
         LEFT JOIN regops_app.tbl_globi_eu_am_99_customers c
             ON cu.customer_number = c.customer_number
         WHERE cu.email = %s
     """
 
-    result = execute_query(query, (credentials.email,))
+    result = await run_in_threadpool(execute_named, "login_user", query, (credentials.email,))
+    user = result[0] if result else None
 
-    if not result or len(result) == 0:
+    # Verified in the password pool, also for unknown emails (same timing)
+    valid, replacement = await password_verifier.check(
+        user['password_hash'] if user else None, credentials.password
+    )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
 
-    user = result[0]
-
     # Check if user is active
     if not user['is_active']:
         raise HTTPException(
@@ -59,31 +70,13 @@ def login(credentials: LoginRequest):
             detail="Account is inactive. Please contact support."
         )
 
-    # Verify password (plaintext for PoC - NEVER do this in production!)
-    if user['password_hash'] != credentials.password:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid email or password"
-        )
-
-    # Update last login date
-    update_query = """
-        UPDATE regops_app.tbl_globi_eu_am_99_customer_users
-        SET last_login_date = %s
-        WHERE email = %s
-    """
-    execute_query(update_query, (datetime.now(), credentials.email), fetch=False)
+    # Signing in is the natural point to pick up changed roles or territories
+    access_resolver.invalidate(user['email'])
 
-    # Get user territories (all users have territories now)
-    territories = None
-    territory_query = """
-        SELECT territory_code
-        FROM regops_app.tbl_globi_eu_am_99_user_territories
-        WHERE user_email = %s
-    """
-    territory_result = execute_query(territory_query, (user['email'],))
-    if territory_result:
-        territories = [row['territory_code'] for row in territory_result]
+    # last_login_date (and an upgraded password hash) are written behind
+    last_login_writer.record(
+        user['email'], user['password_hash'] if replacement else None, replacement
+    )
 
     # Return user data
     full_name = f"{user['first_name']} {user['last_name']}".strip()
@@ -94,5 +87,5 @@ def login(credentials: LoginRequest):
         customer_number=user['customer_number'],
         customer_name=user['customer_name'],
         role=user.get('role', 'Customer'),
-        territories=territories
+        territories=list(user['territories']) or None
     )
@@ -1,9 +1,28 @@
 from fastapi import APIRouter, Query, Depends
 from auth import verify_entra_token, TokenData
-from database import execute_query
+from named_queries import execute_named
+from lookup_cache import LookupCache
+from item_index import item_index
 
 router = APIRouter()
 
+LOOKUP_LIMIT = 10
+
+# The lookups sort in code-point order (COLLATE "C", item_number breaking ties) so
+# the database and item_index return the same rows in the same order, and since
+# item_number is the primary key every (lot, item) or item "group" is one row.
+# migrations/add_item_lookup_collation.sql adds the matching indexes.
+
+def _contains(value, q: str) -> bool:
+    return value is not None and q in value
+
+serial_cache = LookupCache("serial", LOOKUP_LIMIT, lambda row, q: _contains(row["serial_number"], q))
+lot_cache = LookupCache("lot", LOOKUP_LIMIT, lambda row, q: _contains(row["lot_number"], q))
+item_cache = LookupCache(
+    "item", LOOKUP_LIMIT,
+    lambda row, q: _contains(row["item_number"], q) or _contains(row["item_description"], q)
+)
+
 @router.get("/serial")
 def lookup_serial(
     q: str = Query(..., min_length=2),
@@ -14,12 +33,15 @@ def lookup_serial(
             serial_number, item_number, item_description, lot_number
         FROM regops_app.tbl_globi_eu_am_99_items
         WHERE serial_number LIKE %s
-        ORDER BY serial_number
-        LIMIT 10
+        ORDER BY serial_number COLLATE "C", item_number COLLATE "C"
+        LIMIT %s
     """
 
-    results = execute_query(query, (f"%{q}%",))
-    return results
+    indexed = item_index.search_serial(q, LOOKUP_LIMIT)
+    if indexed is not None:
+        return indexed
+
+    return serial_cache.get(q, lambda term: execute_named("lookup_serial", query, (f"%{term}%", LOOKUP_LIMIT), read_only=True))
 
 @router.get("/lot")
 def lookup_lot(
@@ -28,16 +50,18 @@ def lookup_lot(
 ):
     query = """
         SELECT
-            lot_number, item_number, item_description, COUNT(*) as item_count
+            lot_number, item_number, item_description, 1 AS item_count
         FROM regops_app.tbl_globi_eu_am_99_items
         WHERE lot_number LIKE %s
-        GROUP BY lot_number, item_number, item_description
-        ORDER BY lot_number
-        LIMIT 10
+        ORDER BY lot_number COLLATE "C", item_number COLLATE "C"
+        LIMIT %s
     """
 
-    results = execute_query(query, (f"%{q}%",))
-    return results
+    indexed = item_index.search_lot(q, LOOKUP_LIMIT)
+    if indexed is not None:
+        return indexed
+
+    return lot_cache.get(q, lambda term: execute_named("lookup_lot", query, (f"%{term}%", LOOKUP_LIMIT), read_only=True))
 
 @router.get("/item")
 def lookup_item(
@@ -46,16 +70,20 @@ def lookup_item(
 ):
     query = """
         SELECT
-            item_number, item_description, COUNT(*) as instance_count
+            item_number, item_description, 1 AS instance_count
         FROM regops_app.tbl_globi_eu_am_99_items
         WHERE item_number LIKE %s OR item_description LIKE %s
-        GROUP BY item_number, item_description
-        ORDER BY item_number
-        LIMIT 10
+        ORDER BY item_number COLLATE "C"
+        LIMIT %s
     """
 
-    results = execute_query(query, (f"%{q}%", f"%{q}%"))
-    return results
+    indexed = item_index.search_item(q, LOOKUP_LIMIT)
+    if indexed is not None:
+        return indexed
+
+    return item_cache.get(q, lambda term: execute_named(
+        "lookup_item", query, (f"%{term}%", f"%{term}%", LOOKUP_LIMIT), read_only=True
+    ))
 
 @router.get("/reasons")
 def get_reasons(token_data: TokenData = Depends(verify_entra_token)):
@@ -65,7 +93,7 @@ def get_reasons(token_data: TokenData = Depends(verify_entra_token)):
         ORDER BY main_reason, sub_reason
     """
 
-    results = execute_query(query)
+    results = execute_named("issue_reasons_all", query, read_only=True)
 
     # Group by main reason
     grouped = {}
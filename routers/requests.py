@@ -1,9 +1,18 @@
+import os
+from datetime import date, datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional
 
-from auth import verify_entra_token, require_role, Roles, TokenData
-from database import execute_query, get_db_connection
+from auth import verify_entra_token, Roles, TokenData
+from database import execute_query, execute_query_columnar, get_db_connection, note_write
+from named_queries import execute_named
+from columnar import wants_columnar, columnar_response
+from activity_log import log_activity, ActivityType
+from authorization import UserAccess, get_user_access, require_access_role, scope_predicate
+from partitions import add_months
+from query_budget import query_budget
+from media import preview_links
 
 router = APIRouter()
 
@@ -20,15 +29,123 @@ class ServiceRequestCreate(BaseModel):
 
 class StatusUpdate(BaseModel):
     status: str
+    # last_modified_date the client last saw; the update is refused (409) if it changed since
+    expected_last_modified: Optional[datetime] = None
 
-@router.get("")
+class BulkStatusItem(BaseModel):
+    id: int
+    expected_last_modified: Optional[datetime] = None
+
+class BulkStatusUpdate(BaseModel):
+    status: str
+    items: List[BulkStatusItem]
+
+ALLOWED_STATUSES = ["Open", "Received", "In Progress", "Repair Completed", "Shipped Back", "Resolved", "Closed"]
+BULK_STATUS_MAX_ITEMS = 500
+
+# Opt-in: without from_date the list covers this many months (whole months, so
+# only the newest monthly partitions are scanned); 0 (default) lists everything
+REQUESTS_LIST_WINDOW_MONTHS = int(os.getenv("REQUESTS_LIST_WINDOW_MONTHS", "0"))
+
+# Text search configurations of all supported languages (see
+# migrations/add_request_search.sql); a search without ?language= is
+# stemmed with each of them so it matches tickets in any language
+SEARCH_CONFIGS = [
+    "english", "german", "french", "italian", "spanish", "dutch",
+    "portuguese", "swedish", "danish", "norwegian", "finnish", "simple",
+]
+SEARCH_MAX_PAGE_SIZE = 100
+# Matches beyond this are not counted exactly; `total` is then a lower bound
+SEARCH_COUNT_LIMIT = 1000
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+def _transition_status(new_status: str, items: List[BulkStatusItem], access: UserAccess) -> List[dict]:
+    """
+    Move requests to `new_status` in one statement and report per item:
+    updated, conflict (last_modified_date differs from expected_last_modified),
+    forbidden (outside the caller's territories) or not_found.
+    Each updated request gets a STATUS_CHANGED activity entry.
+    """
+    ids = [item.id for item in items]
+    # last_modified_date has no time zone: compare the wall-clock time the client echoes back
+    expected = [
+        item.expected_last_modified.replace(tzinfo=None) if item.expected_last_modified else None
+        for item in items
+    ]
+
+    # RBAC lives in the UPDATE's WHERE clause; the same predicate classifies refusals
+    allowed_sql, rbac_params = scope_predicate(access)
+
+    query = f"""
+        WITH input AS (
+            SELECT * FROM unnest(%s::int[], %s::timestamp[]) AS t(id, expected)
+        ),
+        target AS (
+            SELECT sr.id, sr.status AS old_status
+            FROM regops_app.tbl_globi_eu_am_99_service_requests sr
+            JOIN input i ON i.id = sr.id
+            WHERE {allowed_sql}
+              AND (i.expected IS NULL OR sr.last_modified_date = i.expected)
+            FOR UPDATE OF sr
+        ),
+        updated AS (
+            UPDATE regops_app.tbl_globi_eu_am_99_service_requests sr
+            SET status = %s, last_modified_date = CURRENT_TIMESTAMP
+            FROM target
+            WHERE sr.id = target.id
+            RETURNING sr.id, target.old_status, sr.last_modified_date
+        )
+        SELECT
+            i.id,
+            u.old_status,
+            COALESCE(u.last_modified_date, sr.last_modified_date) AS last_modified_date,
+            CASE
+                WHEN u.id IS NOT NULL THEN 'updated'
+                WHEN sr.id IS NULL THEN 'not_found'
+                WHEN NOT ({allowed_sql}) THEN 'forbidden'
+                ELSE 'conflict'
+            END AS result,
+            sr.status AS current_status
+        FROM input i
+        LEFT JOIN updated u ON u.id = i.id
+        LEFT JOIN regops_app.tbl_globi_eu_am_99_service_requests sr ON sr.id = i.id
+    """
+    params = [ids, expected] + rbac_params + [new_status] + rbac_params
+    rows = execute_query(query, tuple(params))
+    note_write(access.email)
+
+    by_id = {row['id']: row for row in rows}
+    results = []
+    for item in items:
+        row = by_id[item.id]
+        result = {"id": item.id, "result": row['result']}
+        if row['result'] == 'updated':
+            result["old_status"] = row['old_status']
+            result["last_modified_date"] = row['last_modified_date']
+            log_activity(
+                item.id,
+                ActivityType.STATUS_CHANGED,
+                f"Status changed from {row['old_status']} to {new_status}",
+                access.email,
+                old_value=row['old_status'],
+                new_value=new_status
+            )
+        elif row['result'] == 'conflict':
+            # Let the client refresh its copy without another round trip
+            result["current_status"] = row['current_status']
+            result["last_modified_date"] = row['last_modified_date']
+        results.append(result)
+    return results
+
+@router.get("", dependencies=[Depends(query_budget("requests_list"))])
 def get_requests(
-    token_data: TokenData = Depends(verify_entra_token),
     status: Optional[str] = Query(None),
     from_date: Optional[str] = Query(None),
     to_date: Optional[str] = Query(None),
     item_number: Optional[str] = Query(None),
-    serial_number: Optional[str] = Query(None)
+    serial_number: Optional[str] = Query(None),
+    columnar: bool = Depends(wants_columnar),
+    access: UserAccess = Depends(get_user_access)
 ):
     query = """
         SELECT
@@ -45,23 +162,13 @@ def get_requests(
     """
     params = []
 
-    # RBAC filtering based on territories
-    # All users (Customer, SalesTech, Admin) filter by their assigned territories
-    if not token_data.territories:
-        # No territories = no access
-        return []
-
-    # Filter by territory
-    placeholders = ','.join(['%s'] * len(token_data.territories))
-    query += f" AND sr.territory_code IN ({placeholders})"
-    params.extend(token_data.territories)
+    if access.role == Roles.CUSTOMER and not access.customer_number:
+        raise HTTPException(400, "Customer number not found in authentication token")
 
-    # Additional filtering for Customer role - only see their own customer's requests
-    if token_data.role == Roles.CUSTOMER:
-        if not token_data.customer_number:
-            raise HTTPException(400, "Customer number not found in authentication token")
-        query += " AND sr.customer_number = %s"
-        params.append(token_data.customer_number)
+    # RBAC: territories for SalesTech, own customer number for Customers
+    predicate, scope_params = scope_predicate(access)
+    query += f" AND {predicate}"
+    params.extend(scope_params)
 
     # Filters
     if status:
@@ -71,6 +178,10 @@ def get_requests(
     if from_date:
         query += " AND sr.submitted_date >= %s"
         params.append(from_date)
+    elif REQUESTS_LIST_WINDOW_MONTHS > 0:
+        # A literal date lets the planner prune partitions before planning them
+        query += " AND sr.submitted_date >= %s"
+        params.append(add_months(date.today().replace(day=1), -REQUESTS_LIST_WINDOW_MONTHS))
 
     if to_date:
         query += " AND sr.submitted_date <= %s"
@@ -86,9 +197,128 @@ def get_requests(
 
     query += " ORDER BY sr.submitted_date DESC"
 
-    results = execute_query(query, tuple(params) if params else None)
+    if columnar:
+        return columnar_response(*execute_query_columnar(
+            query, tuple(params) if params else None, read_only=True, user=access.email
+        ))
+
+    results = execute_query(query, tuple(params) if params else None, read_only=True, user=access.email)
     return results
 
+@router.get("/search", dependencies=[Depends(query_budget("request_search"))])
+def search_requests(
+    q: str = Query(..., min_length=2, max_length=200),
+    language: Optional[str] = Query(None, max_length=10),
+    status: Optional[str] = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    access: UserAccess = Depends(get_user_access)
+):
+    """
+    Full-text search over issue_description, customer_notes and internal_notes.
+    `q` uses web search syntax ("quoted phrase", -exclude, or). Results are
+    ranked (issue description weighs most), highlighted with <mark> and paginated.
+    Customers never match on, or see highlights of, internal notes.
+    """
+    if access.role == Roles.CUSTOMER and not access.customer_number:
+        raise HTTPException(400, "Customer number not found in authentication token")
+
+    predicate, scope_params = scope_predicate(access)
+    is_customer = access.role == Roles.CUSTOMER
+    # Weights A/B only: issue_description and customer_notes
+    document = "ts_filter(sr.search_vector, '{a,b}')" if is_customer else "sr.search_vector"
+
+    if language:
+        configs_sql = "SELECT regops_app.request_search_config(%s) AS config"
+        configs_params = [language]
+    else:
+        configs_sql = "SELECT unnest(%s::regconfig[]) AS config"
+        configs_params = [SEARCH_CONFIGS]
+
+    filters = ""
+    filter_params = []
+    if language:
+        filters += " AND sr.language_code = %s"
+        filter_params.append(language)
+    if status:
+        filters += " AND sr.status = %s"
+        filter_params.append(status)
+
+    internal_headline = "NULL" if is_customer else (
+        "ts_headline(m.config, sr.internal_notes, m.query, %s)"
+    )
+
+    query = f"""
+        WITH queries AS (
+            -- The search stemmed once per text search configuration
+            SELECT c.config, websearch_to_tsquery(c.config, %s) AS query
+            FROM ({configs_sql}) c
+        ),
+        candidates AS MATERIALIZED (
+            -- GIN index: rows matching the search in any configuration
+            SELECT sr.id, sr.submitted_date, sr.language_code, {document} AS document
+            FROM regops_app.tbl_globi_eu_am_99_service_requests sr
+            WHERE sr.search_vector @@ (
+                SELECT string_agg('(' || query::text || ')', ' | ')::tsquery
+                FROM queries
+                WHERE numnode(query) > 0
+            )
+              AND {predicate}{filters}
+        ),
+        matches AS (
+            -- Each row is then matched and ranked with its own language's stemming
+            SELECT c.id, c.submitted_date, l.config, l.query, ts_rank_cd(c.document, l.query) AS rank
+            FROM candidates c
+            JOIN queries l ON l.config = regops_app.request_search_config(c.language_code)
+            WHERE c.document @@ l.query
+        ),
+        page AS (
+            SELECT * FROM matches
+            ORDER BY rank DESC, submitted_date DESC, id DESC
+            LIMIT %s OFFSET %s
+        )
+        SELECT
+            sr.id, sr.request_code, sr.request_type, sr.customer_number, sr.customer_name,
+            sr.country_code, sr.territory_code, sr.serial_number, sr.item_number,
+            sr.item_description, sr.main_reason, sr.sub_reason, sr.status,
+            sr.submitted_date, sr.last_modified_date, sr.language_code,
+            round(m.rank::numeric, 4) AS rank,
+            ts_headline(m.config, sr.issue_description, m.query, %s) AS issue_description_highlight,
+            ts_headline(m.config, sr.customer_notes, m.query, %s) AS customer_notes_highlight,
+            {internal_headline} AS internal_notes_highlight,
+            t.total AS _total
+        FROM (SELECT count(*) AS total FROM (SELECT 1 FROM matches LIMIT {SEARCH_COUNT_LIMIT + 1}) c) t
+        -- Always one row, so the total is known even past the last page
+        LEFT JOIN page m ON TRUE
+        LEFT JOIN regops_app.tbl_globi_eu_am_99_service_requests sr ON sr.id = m.id
+        ORDER BY m.rank DESC, m.submitted_date DESC, m.id DESC
+    """
+    params = [q] + configs_params + scope_params + filter_params
+    params += [page_size, (page - 1) * page_size]
+    params += [SEARCH_HEADLINE_OPTIONS, SEARCH_HEADLINE_OPTIONS]
+    if not is_customer:
+        params.append(SEARCH_HEADLINE_OPTIONS)
+
+    rows = execute_query(query, tuple(params), read_only=True, user=access.email)
+
+    total = rows[0]['_total']
+    results = []
+    for row in rows:
+        if row['id'] is None:
+            continue
+        del row['_total']
+        if is_customer:
+            del row['internal_notes_highlight']
+        results.append(row)
+
+    return {
+        "results": results,
+        "page": page,
+        "page_size": page_size,
+        "total": min(total, SEARCH_COUNT_LIMIT),
+        "total_is_exact": total <= SEARCH_COUNT_LIMIT,
+    }
+
 @router.post("", status_code=201)
 def create_request(
     request: ServiceRequestCreate,
@@ -108,7 +338,7 @@ def create_request(
         WHERE customer_number = %s
         LIMIT 1
     """
-    territory_result = execute_query(territory_query, (customer_number,))
+    territory_result = execute_named("customer_territory", territory_query, (customer_number,))
     territory = territory_result[0]['territory_code'] if territory_result else 'UNKNOWN'
 
     # Validation
@@ -149,43 +379,47 @@ def create_request(
         if not new_id:
             raise HTTPException(500, "Failed to create request")
 
+    note_write(token_data.email)
     return {"id": new_id, "status": "created"}
 
 @router.get("/{request_id}")
 def get_request_detail(
     request_id: int,
-    token_data: TokenData = Depends(verify_entra_token)
+    access: UserAccess = Depends(get_user_access)
 ):
-    query = """
-        SELECT sr.*
+    # RBAC is evaluated in the same query so 403 and 404 stay distinguishable
+    predicate, scope_params = scope_predicate(access)
+    query = f"""
+        SELECT sr.*, ({predicate}) AS _allowed
         FROM regops_app.tbl_globi_eu_am_99_service_requests sr
         WHERE sr.id = %s
     """
 
-    results = execute_query(query, (request_id,))
+    results = execute_query(query, tuple(scope_params + [request_id]), read_only=True, user=access.email)
 
     if not results:
         raise HTTPException(404, "Request not found")
 
     request = results[0]
 
-    # RBAC check
-    if token_data.role == Roles.CUSTOMER:
-        if request['customer_number'] != token_data.customer_number:
-            raise HTTPException(403, "Access denied")
-
-    elif token_data.role == Roles.SALES_TECH:
-        if request['territory_code'] not in (token_data.territories or []):
-            raise HTTPException(403, "Access denied")
+    if not request.pop('_allowed'):
+        raise HTTPException(403, "Access denied")
+    # Generated full-text search column, not part of the API
+    request.pop('search_vector', None)
 
     # Get attachments
     attachments_query = """
-        SELECT id, file_name, blob_path, file_size, content_type, uploaded_date
+        SELECT id, file_name, blob_path, file_size, content_type, uploaded_date, media_status, renditions
         FROM regops_app.tbl_globi_eu_am_99_attachments
         WHERE request_id = %s
         ORDER BY uploaded_date DESC
     """
-    attachments = execute_query(attachments_query, (request_id,))
+    attachments = execute_named(
+        "attachments_by_request", attachments_query, (request_id,), read_only=True, user=access.email
+    )
+    # Thumbnails/previews (media.py) so the client never needs the original to show a file
+    for attachment in attachments:
+        attachment['previews'] = preview_links(attachment.pop('renditions'))
     request['attachments'] = attachments
 
     return request
@@ -194,38 +428,54 @@ def get_request_detail(
 def update_request_status(
     request_id: int,
     status_update: StatusUpdate,
-    token_data: TokenData = Depends(require_role([Roles.SALES_TECH, Roles.ADMIN]))
+    access: UserAccess = Depends(require_access_role([Roles.SALES_TECH, Roles.ADMIN]))
 ):
-    allowed_statuses = ["Open", "Received", "In Progress", "Repair Completed", "Shipped Back", "Resolved", "Closed"]
-
-    if status_update.status not in allowed_statuses:
-        raise HTTPException(400, f"Invalid status. Allowed: {allowed_statuses}")
-
-    # RBAC for SalesTech
-    if token_data.role == Roles.SALES_TECH:
-        check_query = """
-            SELECT territory_code
-            FROM regops_app.tbl_globi_eu_am_99_service_requests
-            WHERE id = %s
-        """
-        result = execute_query(check_query, (request_id,))
-
-        if not result:
-            raise HTTPException(404, "Request not found")
-
-        if result[0]['territory_code'] not in (token_data.territories or []):
-            raise HTTPException(403, "Access denied")
-
-    # Update
-    update_query = """
-        UPDATE regops_app.tbl_globi_eu_am_99_service_requests
-        SET status = %s, last_modified_date = CURRENT_TIMESTAMP
-        WHERE id = %s
-    """
+    if status_update.status not in ALLOWED_STATUSES:
+        raise HTTPException(400, f"Invalid status. Allowed: {ALLOWED_STATUSES}")
 
-    rows = execute_query(update_query, (status_update.status, request_id), fetch=False)
+    item = BulkStatusItem(id=request_id, expected_last_modified=status_update.expected_last_modified)
+    result = _transition_status(status_update.status, [item], access)[0]
 
-    if rows == 0:
+    if result["result"] == "not_found":
         raise HTTPException(404, "Request not found")
-
-    return {"message": "Status updated", "new_status": status_update.status}
+    if result["result"] == "forbidden":
+        raise HTTPException(403, "Access denied")
+    if result["result"] == "conflict":
+        raise HTTPException(409, {
+            "error": "Request was modified by someone else",
+            "current_status": result["current_status"],
+            "last_modified_date": result["last_modified_date"]
+        })
+
+    return {
+        "message": "Status updated",
+        "new_status": status_update.status,
+        "last_modified_date": result["last_modified_date"]
+    }
+
+@router.post("/bulk-status")
+def bulk_update_status(
+    update: BulkStatusUpdate,
+    access: UserAccess = Depends(require_access_role([Roles.SALES_TECH, Roles.ADMIN]))
+):
+    """
+    Move many requests to one status in a single statement (e.g. closing out
+    a shipment of repaired units). Items carrying expected_last_modified are
+    only updated if the request has not changed since. Returns one result per
+    item: updated, conflict, forbidden or not_found.
+    """
+    if update.status not in ALLOWED_STATUSES:
+        raise HTTPException(400, f"Invalid status. Allowed: {ALLOWED_STATUSES}")
+    if not update.items:
+        raise HTTPException(400, "No requests given")
+    if len(update.items) > BULK_STATUS_MAX_ITEMS:
+        raise HTTPException(400, f"At most {BULK_STATUS_MAX_ITEMS} requests per call")
+    if len({item.id for item in update.items}) != len(update.items):
+        raise HTTPException(400, "Each request may appear only once")
+
+    results = _transition_status(update.status, update.items, access)
+
+    summary = {}
+    for result in results:
+        summary[result["result"]] = summary.get(result["result"], 0) + 1
+    return {"new_status": update.status, "summary": summary, "results": results}
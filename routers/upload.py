@@ -1,92 +1,393 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from azure.core.exceptions import AzureError
+import mimetypes
 import os
-from typing import List
+import re
+import uuid
+from typing import Dict, List, Optional
+from urllib.parse import quote
 from datetime import datetime, timedelta
-from auth import verify_entra_token, TokenData, Roles
-from database import execute_query, get_db_connection
+from pydantic import BaseModel
+from auth import verify_entra_token, TokenData
+from database import execute_query, get_db_connection, note_write
+from activity_log import log_activity, ActivityType
+from authorization import UserAccess, get_user_access, require_request_access, scope_predicate
+import media
+import attachment_store
 
 router = APIRouter()
 
 BLOB_CONNECTION_STRING = os.getenv("AZURE_BLOB_CONNECTION_STRING")
 CONTAINER_NAME = "service-request-attachments"
+# Lifetime of the create-only SAS URLs handed out by /upload/authorize
+UPLOAD_SAS_TTL = int(os.getenv("UPLOAD_SAS_TTL", "900"))
+UPLOAD_AUTHORIZATIONS = "regops_app.tbl_globi_eu_am_99_upload_authorizations"
 
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+MAX_FILES_PER_UPLOAD = 10
+ALLOWED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.pdf', '.doc', '.docx',
+                      '.xls', '.xlsx', '.zip', '.mov', '.mp4', '.avi', '.3gp']
+
+# Leading bytes each file type must start with; checked on finalize, since the
+# client - not the API - wrote the blob
+_ZIP = (b'PK\x03\x04', b'PK\x05\x06')
+_OLE = (b'\xd0\xcf\x11\xe0',)
+_FILE_SIGNATURES = {
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.png': (b'\x89PNG',),
+    '.pdf': (b'%PDF',),
+    '.zip': _ZIP,
+    '.docx': _ZIP,
+    '.xlsx': _ZIP,
+    '.doc': _OLE,
+    '.xls': _OLE,
+}
+# ISO base media (mp4/mov/3gp): a box type at offset 4
+_MEDIA_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip')
+
+_SHA256_RE = re.compile(r'[0-9a-f]{64}')
+
+class UploadFileInfo(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    # Hex SHA-256 of the file; lets authorize skip files whose content is stored already
+    sha256: Optional[str] = None
+
+class UploadAuthorizeRequest(BaseModel):
+    request_id: int
+    files: List[UploadFileInfo]
+
+class UploadFinalizeRequest(BaseModel):
+    request_id: int
+    blob_paths: List[str]
+    # blob_path -> sha256 for the files authorize reported as already stored
+    sha256: Dict[str, str] = {}
+
+# The Azure SDK takes ~150ms to import; it is loaded on first use, not at startup
 def get_blob_service_client():
     if not BLOB_CONNECTION_STRING:
         raise HTTPException(500, "Azure Blob Storage not configured")
+    from azure.storage.blob import BlobServiceClient
     return BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
 
-@router.post("/upload")
+_container_ready = False
+
+def ensure_container(blob_service):
+    global _container_ready
+    if _container_ready:
+        return
+    try:
+        blob_service.get_container_client(CONTAINER_NAME).create_container()
+    except Exception:
+        pass
+    _container_ready = True
+
+def _check_file(filename: str, size: int):
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(400, f"File type {file_ext} not allowed")
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(400, f"File {filename} exceeds 25MB limit")
+
+def _has_valid_signature(file_ext: str, head: bytes) -> bool:
+    if file_ext in _FILE_SIGNATURES:
+        return head.startswith(_FILE_SIGNATURES[file_ext])
+    if file_ext == '.avi':
+        return head[:4] == b'RIFF' and head[8:12] == b'AVI '
+    if file_ext in ('.mp4', '.mov', '.3gp'):
+        return head[4:8] in _MEDIA_BOXES
+    return False
+
+def blob_sas_url(blob_name: str, permission, expiry: datetime,
+                 content_disposition: Optional[str] = None) -> str:
+    from azure.storage.blob import generate_blob_sas
+    account_name = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
+    sas_token = generate_blob_sas(
+        account_name=account_name,
+        container_name=CONTAINER_NAME,
+        blob_name=blob_name,
+        account_key=os.getenv("AZURE_STORAGE_ACCOUNT_KEY"),
+        permission=permission,
+        expiry=expiry,
+        content_disposition=content_disposition
+    )
+    return f"https://{account_name}.blob.core.windows.net/{CONTAINER_NAME}/{blob_name}?{sas_token}"
+
+def _original_filename(blob_name: str) -> str:
+    # <request_id>/<uuid>_<filename>
+    return blob_name.split('/', 1)[1].split('_', 1)[1]
+
+@router.post("/upload/authorize")
+def authorize_upload(
+    upload: UploadAuthorizeRequest,
+    access: UserAccess = Depends(get_user_access)
+):
+    """
+    Step 1 of a direct upload: returns a short-lived, create-only SAS URL per
+    file. The client PUTs each file to its URL (header x-ms-blob-type:
+    BlockBlob), then calls /upload/finalize with the blob paths. The URL
+    can't overwrite a blob, so a finalized file can't be replaced later;
+    names never finalized are swept after the URL expired.
+
+    Files sent with their sha256 whose content is already attached to a
+    request the caller can access come back with `exists: true` and no URL;
+    the client skips the PUT and passes the hash to finalize instead. Any
+    other content is uploaded and deduplicated server-side.
+    """
+    require_request_access(upload.request_id, access)
+
+    if not upload.files:
+        raise HTTPException(400, "No files given")
+    if len(upload.files) > MAX_FILES_PER_UPLOAD:
+        raise HTTPException(400, f"At most {MAX_FILES_PER_UPLOAD} files per upload")
+
+    for file in upload.files:
+        _check_file(file.filename, file.size)
+        if len(file.filename) > 200:
+            raise HTTPException(400, "File name too long")
+        if file.sha256 is not None and not _SHA256_RE.fullmatch(file.sha256):
+            raise HTTPException(400, f"Invalid sha256 for {file.filename}")
+
+    ensure_container(get_blob_service_client())
+
+    from azure.storage.blob import BlobSasPermissions
+    permission = BlobSasPermissions(create=True)
+    expiry = datetime.utcnow() + timedelta(seconds=UPLOAD_SAS_TTL)
+
+    uploads = []
+    for file in upload.files:
+        filename = os.path.basename(file.filename.replace('\\', '/'))
+        blob_name = f"{upload.request_id}/{uuid.uuid4()}_{filename}"
+        content_type = file.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        if (file.sha256 and attachment_store.ATTACHMENT_DEDUP_ENABLED
+                and attachment_store.lookup_content(file.sha256, file.size, scope=scope_predicate(access))):
+            uploads.append({"filename": filename, "blob_path": blob_name, "exists": True})
+            continue
+        uploads.append({
+            "filename": filename,
+            "blob_path": blob_name,
+            "upload_url": blob_sas_url(blob_name, permission, expiry),
+            "method": "PUT",
+            "headers": {"x-ms-blob-type": "BlockBlob", "Content-Type": content_type},
+            "exists": False,
+        })
+
+    execute_query(f"""
+        INSERT INTO {UPLOAD_AUTHORIZATIONS} (blob_path, request_id, authorized_by, expires_at)
+        SELECT blob_path, %s, %s, %s FROM unnest(%s::varchar[]) AS blob_path
+    """, (upload.request_id, access.email, expiry, [u["blob_path"] for u in uploads]), fetch=False)
+
+    return {"expires_at": expiry.isoformat() + "Z", "files": uploads}
+
+@router.post("/upload/finalize")
+def finalize_upload(
+    upload: UploadFinalizeRequest,
+    token_data: TokenData = Depends(verify_entra_token),
+    access: UserAccess = Depends(get_user_access)
+):
+    """
+    Step 2 of a direct upload: checks each uploaded blob's size and file type
+    and records it as an attachment. A blob that fails the checks is deleted.
+    Uploaded blobs are deduplicated in the background (attachment_store.py);
+    files skipped as already stored are linked to their content directly.
+    """
+    require_request_access(upload.request_id, access)
+
+    if not upload.blob_paths:
+        raise HTTPException(400, "No files given")
+    if len(upload.blob_paths) > MAX_FILES_PER_UPLOAD:
+        raise HTTPException(400, f"At most {MAX_FILES_PER_UPLOAD} files per upload")
+    if len(set(upload.blob_paths)) != len(upload.blob_paths):
+        raise HTTPException(400, "Each file may appear only once")
+
+    prefix = f"{upload.request_id}/"
+    for blob_name in upload.blob_paths:
+        if not blob_name.startswith(prefix) or '_' not in blob_name[len(prefix):] or '/' in blob_name[len(prefix):]:
+            raise HTTPException(400, f"Invalid blob path {blob_name}")
+
+    existing = execute_query(
+        "SELECT blob_path FROM regops_app.tbl_globi_eu_am_99_attachments WHERE blob_path = ANY(%s)",
+        (list(upload.blob_paths),)
+    )
+    if existing:
+        raise HTTPException(409, f"Already finalized: {existing[0]['blob_path']}")
+
+    authorized = {row['blob_path'] for row in execute_query(
+        f"SELECT blob_path FROM {UPLOAD_AUTHORIZATIONS} WHERE blob_path = ANY(%s) AND request_id = %s",
+        (list(upload.blob_paths), upload.request_id)
+    )}
+    for blob_name in upload.blob_paths:
+        if blob_name not in authorized:
+            raise HTTPException(400, f"Upload of {blob_name} was not authorized or has expired")
+
+    from azure.core.exceptions import AzureError, ResourceNotFoundError
+    container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+
+    verified = []
+    for blob_name in upload.blob_paths:
+        filename = _original_filename(blob_name)
+        file_ext = os.path.splitext(filename)[1].lower()
+
+        sha256 = upload.sha256.get(blob_name)
+        content = None
+        if sha256 and _SHA256_RE.fullmatch(sha256) and file_ext in ALLOWED_EXTENSIONS:
+            # Same rule as authorize: the hash only stands in for content the caller can already see
+            content = attachment_store.lookup_content(sha256, scope=scope_predicate(access))
+        if content:
+            content_type = mimetypes.guess_type(filename)[0] or content["content_type"]
+            verified.append((filename, blob_name, content["file_size"], content_type, sha256, "stored"))
+            continue
+
+        blob_client = container_client.get_blob_client(blob_name)
+        try:
+            properties = blob_client.get_blob_properties()
+            size = properties.size
+            head = blob_client.download_blob(offset=0, length=16).readall() if size else b''
+        except ResourceNotFoundError:
+            raise HTTPException(400, f"File {filename} has not been uploaded")
+        except AzureError as e:
+            raise HTTPException(500, f"Upload check failed: {str(e)}")
+
+        problem = None
+        if file_ext not in ALLOWED_EXTENSIONS:
+            problem = f"File type {file_ext} not allowed"
+        elif size == 0:
+            problem = f"File {filename} is empty"
+        elif size > MAX_UPLOAD_BYTES:
+            problem = f"File {filename} exceeds 25MB limit"
+        elif not _has_valid_signature(file_ext, head):
+            problem = f"File {filename} is not a valid {file_ext} file"
+        if problem:
+            try:
+                blob_client.delete_blob()
+            except AzureError:
+                pass
+            raise HTTPException(400, problem)
+
+        content_type = properties.content_settings.content_type or mimetypes.guess_type(filename)[0]
+        verified.append((filename, blob_name, size, content_type, None, attachment_store.initial_status()))
+
+    # Claiming the authorizations and recording the attachments is one statement:
+    # an upload the sweep removed meanwhile is not recorded (and fails the call)
+    insert_query = f"""
+        WITH claimed AS (
+            DELETE FROM {UPLOAD_AUTHORIZATIONS}
+            WHERE blob_path = ANY(%s) AND request_id = %s
+            RETURNING blob_path
+        )
+        INSERT INTO regops_app.tbl_globi_eu_am_99_attachments
+            (request_id, file_name, blob_path, file_size, content_type, media_status,
+             content_sha256, content_status, uploaded_by, uploaded_date)
+        SELECT %s, f.file_name, f.blob_path, f.file_size, f.content_type, f.media_status,
+               f.content_sha256, f.content_status, %s, CURRENT_TIMESTAMP
+        FROM unnest(%s::varchar[], %s::varchar[], %s::bigint[], %s::varchar[], %s::varchar[],
+                    %s::char(64)[], %s::varchar[])
+            AS f(file_name, blob_path, file_size, content_type, media_status, content_sha256, content_status)
+        JOIN claimed c ON c.blob_path = f.blob_path
+        WHERE NOT EXISTS (
+            SELECT 1 FROM regops_app.tbl_globi_eu_am_99_attachments a WHERE a.blob_path = f.blob_path
+        )
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(insert_query, (
+            [v[1] for v in verified],
+            upload.request_id,
+            upload.request_id,
+            token_data.email,
+            [v[0] for v in verified],
+            [v[1] for v in verified],
+            [v[2] for v in verified],
+            [v[3] for v in verified],
+            [media.initial_status(v[0]) for v in verified],
+            [v[4] for v in verified],
+            [v[5] for v in verified]
+        ))
+        if cursor.rowcount != len(verified):
+            raise HTTPException(409, "Upload expired or was finalized concurrently, please retry")
+    note_write(token_data.email)
+    attachment_store.adopt_renditions([v[4] for v in verified if v[4]])
+    attachment_store.content_store.wake()
+    media.media_processor.wake()
+
+    for filename, blob_name, size, *_ in verified:
+        log_activity(
+            upload.request_id,
+            ActivityType.ATTACHMENT_UPLOADED,
+            f"Uploaded {filename}",
+            token_data.email,
+            new_value=blob_name
+        )
+
+    return {
+        "message": f"Uploaded {len(verified)} files",
+        "files": [{"filename": v[0], "blob_path": v[1], "size": v[2]} for v in verified]
+    }
+
+@router.post("/upload", deprecated=True)
 async def upload_files(
     request_id: int = Form(...),
     files: List[UploadFile] = File(...),
-    token_data: TokenData = Depends(verify_entra_token)
+    token_data: TokenData = Depends(verify_entra_token),
+    access: UserAccess = Depends(get_user_access)
 ):
-    # Verify request access
-    request_query = """
-        SELECT customer_number, territory
-        FROM regops_app.tbl_globi_eu_am_99_service_requests
-        WHERE id = %s
     """
-    request_result = execute_query(request_query, (request_id,))
-
-    if not request_result:
-        raise HTTPException(404, "Request not found")
-
-    request_data = request_result[0]
+    Upload through the API. Superseded by /upload/authorize + /upload/finalize,
+    which let the client write to blob storage directly.
 
-    # RBAC check
-    if token_data.role == Roles.CUSTOMER:
-        if request_data['customer_number'] != token_data.customer_number:
-            raise HTTPException(403, "Access denied")
-    elif token_data.role == Roles.SALES_TECH:
-        if request_data['territory'] not in (token_data.territories or []):
-            raise HTTPException(403, "Access denied")
+    Each file is hashed in one pass and stored under its content hash; when
+    that content is stored already, nothing is written to blob storage.
+    """
+    require_request_access(request_id, access)
 
     uploaded_files = []
     blob_service = get_blob_service_client()
+    from azure.core.exceptions import AzureError
+    ensure_container(blob_service)
     container_client = blob_service.get_container_client(CONTAINER_NAME)
 
-    # Ensure container exists
-    try:
-        container_client.create_container()
-    except Exception:
-        pass
-
-    allowed_extensions = ['.jpg', '.jpeg', '.png', '.pdf', '.doc', '.docx',
-                         '.xls', '.xlsx', '.zip', '.mov', '.mp4', '.avi', '.3gp']
-
     for file in files:
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            raise HTTPException(400, f"File type {file_ext} not allowed")
-
-        # Check size (25MB)
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-        file.file.seek(0)
+        # Size (25MB) and content hash in one pass over the spooled upload
+        sha256, file_size = attachment_store.hash_file(file.file)
 
-        if file_size > 25 * 1024 * 1024:
-            raise HTTPException(400, f"File {file.filename} exceeds 25MB limit")
+        _check_file(file.filename, file_size)
 
         # Generate unique blob name
-        import uuid
         blob_name = f"{request_id}/{uuid.uuid4()}_{file.filename}"
 
         try:
-            blob_client = container_client.get_blob_client(blob_name)
-            blob_client.upload_blob(file.file, overwrite=True)
+            content_sha256 = content_status = None
+            if attachment_store.ATTACHMENT_DEDUP_ENABLED:
+                attachment_store.store_content(container_client, file.file, sha256, file_size, file.content_type)
+                content_sha256, content_status = sha256, "stored"
+            else:
+                blob_client = container_client.get_blob_client(blob_name)
+                blob_client.upload_blob(file.file, overwrite=True)
 
             # Save to DB
             insert_query = """
                 INSERT INTO regops_app.tbl_globi_eu_am_99_attachments
-                    (request_id, file_name, blob_path, file_size, content_type, uploaded_date)
-                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    (request_id, file_name, blob_path, file_size, content_type, media_status,
+                     content_sha256, content_status, uploaded_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
             """
             execute_query(insert_query, (
-                request_id, file.filename, blob_name, file_size, file.content_type
+                request_id, file.filename, blob_name, file_size, file.content_type,
+                media.initial_status(file.filename), content_sha256, content_status
             ), fetch=False)
+            note_write(token_data.email)
+            if content_sha256:
+                attachment_store.adopt_renditions([content_sha256])
+            media.media_processor.wake()
+
+            log_activity(
+                request_id,
+                ActivityType.ATTACHMENT_UPLOADED,
+                f"Uploaded {file.filename}",
+                token_data.email,
+                new_value=blob_name
+            )
 
             uploaded_files.append({
                 "filename": file.filename,
@@ -103,40 +404,38 @@ async def upload_files(
 def download_file(
     request_id: int,
     blob_filename: str,
-    token_data: TokenData = Depends(verify_entra_token)
+    token_data: TokenData = Depends(verify_entra_token),
+    access: UserAccess = Depends(get_user_access)
 ):
-    # Verify access
-    request_query = """
-        SELECT customer_number, territory
-        FROM regops_app.tbl_globi_eu_am_99_service_requests
-        WHERE id = %s
-    """
-    request_result = execute_query(request_query, (request_id,))
-
-    if not request_result:
-        raise HTTPException(404, "Request not found")
-
-    request_data = request_result[0]
-
-    # RBAC check
-    if token_data.role == Roles.CUSTOMER:
-        if request_data['customer_number'] != token_data.customer_number:
-            raise HTTPException(403, "Access denied")
-    elif token_data.role == Roles.SALES_TECH:
-        if request_data['territory'] not in (token_data.territories or []):
-            raise HTTPException(403, "Access denied")
+    require_request_access(request_id, access)
 
     blob_name = f"{request_id}/{blob_filename}"
 
-    sas_token = generate_blob_sas(
-        account_name=os.getenv("AZURE_STORAGE_ACCOUNT_NAME"),
-        container_name=CONTAINER_NAME,
-        blob_name=blob_name,
-        account_key=os.getenv("AZURE_STORAGE_ACCOUNT_KEY"),
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.utcnow() + timedelta(hours=1)
+    # Deduplicated attachments are read from their shared content blob,
+    # downloaded under the attachment's own file name
+    rows = execute_query("""
+        SELECT a.file_name, c.blob_path AS content_path
+        FROM regops_app.tbl_globi_eu_am_99_attachments a
+        LEFT JOIN regops_app.tbl_globi_eu_am_99_attachment_contents c ON c.sha256 = a.content_sha256
+        WHERE a.request_id = %s AND a.blob_path = %s
+    """, (request_id, blob_name), read_only=True, user=access.email)
+    storage_path, content_disposition = blob_name, None
+    if rows and rows[0]["content_path"]:
+        storage_path = rows[0]["content_path"]
+        content_disposition = f"attachment; filename*=UTF-8''{quote(rows[0]['file_name'])}"
+
+    from azure.storage.blob import BlobSasPermissions
+    download_url = blob_sas_url(
+        storage_path, BlobSasPermissions(read=True), datetime.utcnow() + timedelta(hours=1),
+        content_disposition=content_disposition
     )
 
-    download_url = f"https://{os.getenv('AZURE_STORAGE_ACCOUNT_NAME')}.blob.core.windows.net/{CONTAINER_NAME}/{blob_name}?{sas_token}"
+    log_activity(
+        request_id,
+        ActivityType.ATTACHMENT_DOWNLOADED,
+        f"Download link issued for {blob_filename}",
+        token_data.email,
+        new_value=blob_name
+    )
 
     return {"download_url": download_url}
@@ -2,7 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException
 from typing import Optional, Dict, Any
 from pydantic import BaseModel
 from auth import verify_entra_token, TokenData
-from database import execute_query
+from database import execute_query, execute_query_columnar
+from named_queries import execute_named
+from columnar import wants_columnar, columnar_response
+from rate_limit import rate_limit
+from query_budget import query_budget
+from item_index import item_index
+from authorization import UserAccess, get_user_access, scope_predicate
+import logging
+from psycopg2.extensions import QueryCanceledError
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -28,51 +38,56 @@ def validate_item(
 
     # Check by Serial Number first (primary input - UR-034)
     if request.serial_number:
-        query = """
-            SELECT
-                item_number,
-                item_description,
-                serial_number,
-                lot_number,
-                product_family,
-                product_line,
-                is_serviceable,
-                repairability_status,
-                install_base_status,
-                eligibility_countries
-            FROM regops_app.tbl_globi_eu_am_99_items
-            WHERE serial_number = %s
-        """
-        results = execute_query(query, (request.serial_number,))
-
-        if not results:
-            raise HTTPException(404, "Serial number not found in system")
-
-        item = results[0]
+        item = item_index.find_by_serial(request.serial_number)
+        # Index disabled, still loading, or the item was added since its last refresh
+        if item is None:
+            query = """
+                SELECT
+                    item_number,
+                    item_description,
+                    serial_number,
+                    lot_number,
+                    product_family,
+                    product_line,
+                    is_serviceable,
+                    repairability_status,
+                    install_base_status,
+                    eligibility_countries
+                FROM regops_app.tbl_globi_eu_am_99_items
+                WHERE serial_number = %s
+            """
+            results = execute_named("item_by_serial", query, (request.serial_number,), read_only=True)
+
+            if not results:
+                raise HTTPException(404, "Serial number not found in system")
+
+            item = results[0]
 
     # Check by Item Number (secondary input - UR-034)
     elif request.item_number:
-        query = """
-            SELECT
-                item_number,
-                item_description,
-                serial_number,
-                lot_number,
-                product_family,
-                product_line,
-                is_serviceable,
-                repairability_status,
-                install_base_status,
-                eligibility_countries
-            FROM regops_app.tbl_globi_eu_am_99_items
-            WHERE item_number = %s
-        """
-        results = execute_query(query, (request.item_number,))
-
-        if not results:
-            raise HTTPException(404, "Item number not found in system")
-
-        item = results[0]
+        item = item_index.get_item(request.item_number)
+        if item is None:
+            query = """
+                SELECT
+                    item_number,
+                    item_description,
+                    serial_number,
+                    lot_number,
+                    product_family,
+                    product_line,
+                    is_serviceable,
+                    repairability_status,
+                    install_base_status,
+                    eligibility_countries
+                FROM regops_app.tbl_globi_eu_am_99_items
+                WHERE item_number = %s
+            """
+            results = execute_named("item_by_number", query, (request.item_number,), read_only=True)
+
+            if not results:
+                raise HTTPException(404, "Item number not found in system")
+
+            item = results[0]
 
     # Validate serviceability (UR-028)
     if not item['is_serviceable']:
@@ -140,7 +155,7 @@ def validate_customer(
         AND c.is_active = true
     """
 
-    results = execute_query(query, (email,))
+    results = execute_named("customer_user_by_email", query, (email,), read_only=True)
 
     if not results:
         # Return empty result - will trigger manual entry (UR-039)
@@ -163,20 +178,23 @@ def validate_customer(
         "message": "Customer found. Form will be auto-filled."
     }
 
-@router.get("/customers/search")
+@router.get("/customers/search", dependencies=[Depends(rate_limit("customer_search")),
+                                                Depends(query_budget("customer_search"))])
 def search_customers(
     query: Optional[str] = None,
-    token_data: TokenData = Depends(verify_entra_token)
+    columnar: bool = Depends(wants_columnar),
+    access: UserAccess = Depends(get_user_access)
 ):
     """
     Search customers for sales/tech/admin users
     - Admin can see all customers
     - Sales/Tech can see only customers in their territories
+    - Customers only see their own customer record
     """
-    from auth import Roles
+    predicate, params = scope_predicate(access, "c.territory_code", "c.customer_number")
 
     try:
-        sql = """
+        sql = f"""
             SELECT DISTINCT
                 c.customer_number,
                 c.customer_name,
@@ -184,17 +202,9 @@ def search_customers(
                 c.country_code
             FROM regops_app.tbl_globi_eu_am_99_customers c
             WHERE c.is_active = true
+              AND {predicate}
         """
 
-        params = []
-
-        # Territory filtering for Sales/Tech (not for Admin)
-        if token_data.role == Roles.SALES_TECH:
-            if token_data.territories and len(token_data.territories) > 0:
-                placeholders = ','.join(['%s'] * len(token_data.territories))
-                sql += f" AND c.territory_code IN ({placeholders})"
-                params.extend(token_data.territories)
-
         # Search query
         if query:
             sql += " AND (c.customer_name ILIKE %s OR c.customer_number ILIKE %s)"
@@ -203,10 +213,14 @@ def search_customers(
 
         sql += " ORDER BY c.customer_name LIMIT 50"
 
-        results = execute_query(sql, tuple(params) if params else None)
+        if columnar:
+            return columnar_response(*execute_query_columnar(sql, tuple(params) if params else None, read_only=True))
+
+        results = execute_query(sql, tuple(params) if params else None, read_only=True)
         return results
+    except QueryCanceledError:
+        # Over its query budget: 503 from the app-wide handler, not a 500
+        raise
     except Exception as e:
-        print(f"Error in customer search: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in customer search")
         raise HTTPException(500, f"Failed to search customers: {str(e)}")
@@ -1,62 +1,525 @@
 #!/usr/bin/env python3
 """
-Run SQL migration script on the database
+Database migrations: versioned, one runner at a time, online backfills.
+
+    python run_migration.py status
+    python run_migration.py up --dry-run         # what `up` would do
+    python run_migration.py up [--to NAME]
+    python run_migration.py baseline [--to NAME] # database migrated by hand before this runner
+    python run_migration.py apply FILE [--dry-run]   # one-off scripts (data fixes)
+
+MIGRATIONS lists the schema migrations in the order they are applied. Each
+one that ran is recorded in regops_app.schema_version with the checksum of
+its file, and `up` applies the ones not recorded yet. A session advisory
+lock makes a second runner (another instance deploying at the same time)
+wait for the first and then find nothing left to do.
+
+A migration file is plain SQL, split into steps by directive comments:
+
+    -- migrate:step                  statements run in one transaction (the default)
+    -- migrate:step no-transaction   one statement that can't run in a transaction
+                                     (CREATE INDEX CONCURRENTLY)
+    -- migrate:backfill table=regops_app.<table> key=id [batch=5000] [sleep=100]
+    UPDATE regops_app.<table> SET ...
+    WHERE id >= %(lo)s AND id < %(hi)s AND <row not done yet>;
+
+A backfill runs its UPDATE once per key range, each range in its own short
+transaction with a pause in between, so it never holds row locks across the
+table and leaves room for intake traffic. Write the WHERE clause so done
+rows are skipped: an interrupted migration is simply run again (steps must
+be re-runnable, as IF NOT EXISTS makes the DDL). Literal % in a backfill
+statement is written %%.
+
+Steps run with lock_timeout = MIGRATION_LOCK_TIMEOUT and are retried when
+they hit it, so an ALTER TABLE stuck behind a long query gives up instead of
+queueing every request behind its lock. A CREATE INDEX CONCURRENTLY that
+fails part-way leaves an INVALID index behind, which IF NOT EXISTS would
+then accept; a no-transaction step drops it before (re)trying, and fails
+rather than record a migration whose index is still invalid.
+
+Connect directly (port 5432), not through a transaction-mode pooler: the
+advisory lock belongs to the session.
 """
+import argparse
+import hashlib
 import os
+import re
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
 import psycopg2
+import psycopg2.errors
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def run_migration(sql_file):
-    """Execute SQL migration file"""
-    # Get database URL from environment
-    db_url = os.getenv('SUPABASE_DB_URL')
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(REPO_ROOT, "migrations")
 
-    if not db_url:
-        print("Error: SUPABASE_DB_URL not found in environment")
-        return False
+# Applied in this order; names are files in migrations/
+MIGRATIONS = [
+    "add_customer_address_columns",
+    "add_repair_form_fields",
+    "add_request_search",
+    "partition_by_month",
+    "add_attachment_media",
+    "add_attachment_content",
+    "add_legal_document_assets",
+    "add_upload_authorizations",
+    "add_item_lookup_collation",
+]
 
-    try:
-        # Read SQL file
-        with open(sql_file, 'r') as f:
-            sql = f.read()
+LEDGER = "regops_app.schema_version"
+# pg_advisory_lock key shared by every runner
+MIGRATION_LOCK_KEY = 4731190457
+# Milliseconds a statement may wait for a table lock before the step is retried
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "5000"))
+MIGRATION_LOCK_RETRIES = int(os.getenv("MIGRATION_LOCK_RETRIES", "5"))
+# Seconds to wait for another runner to finish
+MIGRATION_WAIT = int(os.getenv("MIGRATION_WAIT", "1800"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "5000"))
+BACKFILL_SLEEP_MS = int(os.getenv("BACKFILL_SLEEP_MS", "100"))
 
-        # Connect to database
-        print(f"Connecting to database...")
-        conn = psycopg2.connect(db_url)
-        cursor = conn.cursor()
+_DIRECTIVE_RE = re.compile(r"^--\s*migrate:(step|backfill)\b([^\n]*)$", re.MULTILINE)
+_IDENTIFIER_RE = re.compile(r"[a-z_][a-z0-9_]*(\.[a-z_][a-z0-9_]*)?")
+_STATEMENT_RE = re.compile(
+    r"^(CREATE|ALTER|DROP|UPDATE|INSERT|DELETE|COMMENT|DO|TRUNCATE|GRANT|SELECT|WITH)\b[^\n]*",
+    re.MULTILINE
+)
+_CONCURRENT_INDEX_RE = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(?:ONLY\s+)?([\w.]+)",
+    re.IGNORECASE
+)
+
+
+# ----------------------------------------------------------------------------
+# Migration files
+# ----------------------------------------------------------------------------
+
+def _strip_comments(sql: str) -> str:
+    sql = re.sub(r"/\*.*?\*/", "", sql, flags=re.DOTALL)
+    return re.sub(r"--[^\n]*", "", sql)
+
+
+def parse_steps(sql: str) -> List[Dict[str, Any]]:
+    """Split a migration file into its steps (see the module docstring)."""
+    steps = []
+    matches = list(_DIRECTIVE_RE.finditer(sql))
+    head = sql[:matches[0].start()] if matches else sql
+    if _strip_comments(head).strip():
+        steps.append({"kind": "sql", "sql": head, "transaction": True})
+
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(sql)
+        body = sql[match.end():end]
+        kind, options = match.group(1), match.group(2).split()
+        if kind == "step":
+            unknown = set(options) - {"no-transaction"}
+            if unknown:
+                raise ValueError(f"Unknown step option: {' '.join(unknown)}")
+            steps.append({"kind": "sql", "sql": body, "transaction": "no-transaction" not in options})
+            continue
+
+        params = dict(option.split("=", 1) for option in options)
+        table, key = params.get("table", ""), params.get("key", "id")
+        if not _IDENTIFIER_RE.fullmatch(table) or not _IDENTIFIER_RE.fullmatch(key):
+            raise ValueError(f"Backfill needs table=<schema.table> and key=<column>: {match.group(0)}")
+        statement = _strip_comments(body).strip().rstrip(";").strip()
+        if "%(lo)s" not in statement or "%(hi)s" not in statement:
+            raise ValueError(f"Backfill on {table} must restrict {key} to %(lo)s <= {key} < %(hi)s")
+        steps.append({
+            "kind": "backfill",
+            "sql": statement,
+            "table": table,
+            "key": key,
+            "batch": int(params.get("batch", BACKFILL_BATCH_SIZE)),
+            "sleep": int(params.get("sleep", BACKFILL_SLEEP_MS)),
+        })
+    return steps
+
+
+def migration_path(name: str) -> str:
+    return os.path.join(MIGRATIONS_DIR, f"{name}.sql")
+
+
+def read_migration(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        sql = f.read()
+    return {
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "path": path,
+        "checksum": hashlib.sha256(sql.encode()).hexdigest(),
+        "steps": parse_steps(sql),
+    }
+
+
+# ----------------------------------------------------------------------------
+# Running steps
+# ----------------------------------------------------------------------------
+
+def _invalid_index(conn, step: Dict[str, Any]) -> Optional[str]:
+    """
+    Qualified name of the index a CREATE INDEX CONCURRENTLY step builds, if it
+    exists but is INVALID - what a build that was cancelled (lock_timeout) or
+    interrupted leaves behind, and what IF NOT EXISTS would then skip.
+    """
+    match = _CONCURRENT_INDEX_RE.search(_strip_comments(step["sql"]))
+    if not match:
+        return None
+    index, table = match.groups()
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT format('%%I.%%I', n.nspname, c.relname)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relname = %s AND i.indrelid = to_regclass(%s) AND NOT i.indisvalid
+        """, (index.lower(), table))
+        row = cursor.fetchone()
+    conn.rollback()
+    return row[0] if row else None
+
+
+def _run_sql(conn, step: Dict[str, Any]):
+    for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+        try:
+            if step["transaction"]:
+                with conn.cursor() as cursor:
+                    cursor.execute(step["sql"])
+                conn.commit()
+            else:
+                invalid = _invalid_index(conn, step)
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cursor:
+                        if invalid:
+                            print(f"    dropping invalid index {invalid} left by an earlier attempt")
+                            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {invalid}")
+                        cursor.execute(step["sql"])
+                finally:
+                    conn.autocommit = False
+                invalid = _invalid_index(conn, step)
+                if invalid:
+                    raise RuntimeError(f"Index {invalid} was left INVALID")
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == MIGRATION_LOCK_RETRIES:
+                raise
+            wait = min(2 ** attempt, 30)
+            print(f"    table busy (lock_timeout), retrying in {wait}s")
+            time.sleep(wait)
+
+
+def _run_backfill(conn, step: Dict[str, Any]) -> int:
+    """Run the backfill UPDATE over [min(key), max(key)] in key ranges; returns rows updated."""
+    table, key = step["table"], step["key"]
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT min({key}), max({key}) FROM {table}")
+        low, high = cursor.fetchone()
+    conn.commit()
+    if low is None:
+        return 0
+    if not isinstance(low, int):
+        raise ValueError(f"Backfill key {table}.{key} must be an integer column")
+
+    batch = step["batch"]
+    sleep = step["sleep"] / 1000
+    updated, failures = 0, 0
+    started = last_report = time.perf_counter()
+    lo = low
+    while lo <= high:
+        hi = lo + batch
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(step["sql"], {"lo": lo, "hi": hi})
+                updated += cursor.rowcount
+            conn.commit()
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            failures += 1
+            if failures > MIGRATION_LOCK_RETRIES:
+                raise
+            # Rows in this range are busy: retry with a smaller range, after a longer pause
+            batch = max(batch // 2, 1)
+            time.sleep(max(sleep, 0.1) * 2 ** failures)
+            continue
+        failures = 0
+        batch = min(batch * 2, step["batch"])
+        lo = hi
+        if time.perf_counter() - last_report > 10:
+            last_report = time.perf_counter()
+            done = (lo - low) / (high - low + 1)
+            print(f"    {table}: {min(done, 1):.0%} of key range, {updated:,} rows updated")
+        time.sleep(sleep)
+    print(f"    {table}: {updated:,} rows updated in {time.perf_counter() - started:.1f}s")
+    return updated
+
+
+def run_steps(conn, steps: List[Dict[str, Any]]):
+    """Execute parsed steps on `conn` (no ledger, no lock; used by seeding too)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SET lock_timeout = %s", (MIGRATION_LOCK_TIMEOUT,))
+    conn.commit()
+    for step in steps:
+        if step["kind"] == "backfill":
+            _run_backfill(conn, step)
+        else:
+            _run_sql(conn, step)
+
+
+def describe_step(conn, step: Dict[str, Any]) -> List[str]:
+    """Plan lines for a step, for --dry-run."""
+    if step["kind"] == "sql":
+        mode = "" if step["transaction"] else " (no transaction)"
+        statements = [m.group(0)[:100] for m in _STATEMENT_RE.finditer(_strip_comments(step["sql"]))]
+        return [f"sql{mode}: {len(statements)} statements"] + [f"  {s}" for s in statements]
+
+    table, key = step["table"], step["key"]
+    line = f"backfill {table} by {key}, batches of {step['batch']}, {step['sleep']}ms apart"
+    if conn is None:
+        return [line]
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", (table,))
+        if cursor.fetchone()[0] is None:
+            return [line, "  table does not exist yet"]
+        cursor.execute(f"SELECT min({key}), max({key}) FROM {table}")
+        low, high = cursor.fetchone()
+    conn.rollback()
+    if low is None:
+        return [line, "  table is empty"]
+    return [line, f"  {key} {low}..{high}: up to {(high - low) // step['batch'] + 1} batches"]
+
+
+# ----------------------------------------------------------------------------
+# Ledger and lock
+# ----------------------------------------------------------------------------
+
+def connect():
+    from database import get_connection_string
+    params = get_connection_string()
+    params["application_name"] = "run_migration"
+    return psycopg2.connect(**params)
 
-        # Execute SQL
-        print(f"Executing migration: {sql_file}")
-        cursor.execute(sql)
 
-        # Commit changes
+def ensure_ledger(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS regops_app")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {LEDGER} (
+                version VARCHAR(200) PRIMARY KEY,
+                checksum CHAR(64) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INTEGER,
+                applied_by VARCHAR(200),
+                baseline BOOLEAN NOT NULL DEFAULT false
+            )
+        """)
+    conn.commit()
+
+
+def applied_versions(conn) -> Dict[str, Dict[str, Any]]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", (LEDGER,))
+        if cursor.fetchone()[0] is None:
+            conn.rollback()
+            return {}
+        cursor.execute(f"SELECT version, checksum, applied_at, baseline FROM {LEDGER}")
+        rows = cursor.fetchall()
+    conn.rollback()
+    return {
+        version: {"checksum": checksum, "applied_at": applied_at, "baseline": baseline}
+        for version, checksum, applied_at, baseline in rows
+    }
+
+
+def record_version(conn, migration: Dict[str, Any], duration_ms: Optional[int], baseline: bool = False):
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {LEDGER} (version, checksum, duration_ms, applied_by, baseline)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (version) DO UPDATE
+            SET checksum = EXCLUDED.checksum, applied_at = CURRENT_TIMESTAMP,
+                duration_ms = EXCLUDED.duration_ms, applied_by = EXCLUDED.applied_by,
+                baseline = EXCLUDED.baseline
+        """, (migration["name"], migration["checksum"], duration_ms, socket.gethostname(), baseline))
+    conn.commit()
+
+
+def acquire_lock(conn, wait: int = MIGRATION_WAIT):
+    """Session advisory lock; waits up to `wait` seconds for another runner."""
+    deadline = time.monotonic() + wait
+    announced = False
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            locked = cursor.fetchone()[0]
         conn.commit()
-        print("✓ Migration completed successfully")
+        if locked:
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError("Another migration run still holds the lock")
+        if not announced:
+            print("Another migration run is in progress; waiting for it to finish...")
+            announced = True
+        time.sleep(2)
 
-        # Close connection
-        cursor.close()
-        conn.close()
 
-        return True
+def release_lock(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    conn.commit()
 
-    except Exception as e:
-        print(f"❌ Migration failed: {e}")
-        return False
 
-if __name__ == "__main__":
-    import sys
+# ----------------------------------------------------------------------------
+# Commands
+# ----------------------------------------------------------------------------
+
+def _selected(to: Optional[str]) -> List[str]:
+    if to is None:
+        return MIGRATIONS
+    if to not in MIGRATIONS:
+        raise SystemExit(f"Unknown migration: {to}")
+    return MIGRATIONS[:MIGRATIONS.index(to) + 1]
+
+
+def _print_plan(conn, migration: Dict[str, Any]):
+    print(f"{migration['name']}")
+    for step in migration["steps"]:
+        for line in describe_step(conn, step):
+            print(f"    {line}")
+
+
+def status(conn):
+    applied = applied_versions(conn)
+    print(f"{'migration':<34} {'state':<10} applied")
+    for name in MIGRATIONS:
+        migration = read_migration(migration_path(name))
+        entry = applied.get(name)
+        if entry is None:
+            print(f"{name:<34} {'pending':<10}")
+            continue
+        state = "baseline" if entry["baseline"] else "applied"
+        if entry["checksum"] != migration["checksum"]:
+            state += "*"
+        print(f"{name:<34} {state:<10} {entry['applied_at']:%Y-%m-%d %H:%M}")
+    for name in sorted(set(applied) - set(MIGRATIONS)):
+        print(f"{name:<34} {'one-off':<10} {applied[name]['applied_at']:%Y-%m-%d %H:%M}")
+    if any(entry["checksum"] != read_migration(migration_path(name))["checksum"]
+           for name, entry in applied.items() if name in MIGRATIONS):
+        print("\n* file changed since it was applied")
+
+
+def up(conn, to: Optional[str] = None, dry_run: bool = False) -> int:
+    """Apply pending migrations in order; returns how many were applied."""
+    names = _selected(to)
+    if dry_run:
+        pending = [name for name in names if name not in applied_versions(conn)]
+        if not pending:
+            print("Nothing to apply")
+        for name in pending:
+            _print_plan(conn, read_migration(migration_path(name)))
+        return 0
+
+    ensure_ledger(conn)
+    acquire_lock(conn)
+    try:
+        # Read after taking the lock: a runner we waited for may have applied them
+        applied = applied_versions(conn)
+        count = 0
+        for name in names:
+            if name in applied:
+                continue
+            migration = read_migration(migration_path(name))
+            print(f"Applying {name}")
+            started = time.perf_counter()
+            run_steps(conn, migration["steps"])
+            record_version(conn, migration, int((time.perf_counter() - started) * 1000))
+            count += 1
+        print(f"Applied {count} migrations" if count else "Nothing to apply")
+        return count
+    finally:
+        release_lock(conn)
+
+
+def baseline(conn, to: Optional[str] = None):
+    """Record migrations as applied without running them."""
+    ensure_ledger(conn)
+    acquire_lock(conn)
+    try:
+        applied = applied_versions(conn)
+        for name in _selected(to):
+            if name not in applied:
+                record_version(conn, read_migration(migration_path(name)), None, baseline=True)
+                print(f"Recorded {name} as applied")
+    finally:
+        release_lock(conn)
+
+
+def apply_file(conn, sql_file: str, dry_run: bool = False):
+    """Run one file (whether or not it ran before) and record it under its file name."""
+    migration = read_migration(sql_file)
+    if dry_run:
+        _print_plan(conn, migration)
+        return
+    ensure_ledger(conn)
+    acquire_lock(conn)
+    try:
+        print(f"Executing migration: {sql_file}")
+        started = time.perf_counter()
+        run_steps(conn, migration["steps"])
+        record_version(conn, migration, int((time.perf_counter() - started) * 1000))
+    finally:
+        release_lock(conn)
+
 
-    if len(sys.argv) < 2:
-        print("Usage: python run_migration.py <sql_file>")
-        sys.exit(1)
+def main():
+    # `python run_migration.py file.sql` keeps working
+    argv = sys.argv[1:]
+    if argv and argv[0].endswith(".sql"):
+        argv.insert(0, "apply")
 
-    sql_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Database migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Applied and pending migrations")
+    up_parser = sub.add_parser("up", help="Apply pending migrations")
+    up_parser.add_argument("--to", help="Stop after this migration")
+    up_parser.add_argument("--dry-run", action="store_true", help="Show the plan, change nothing")
+    baseline_parser = sub.add_parser("baseline", help="Record migrations as applied without running them")
+    baseline_parser.add_argument("--to", help="Stop after this migration")
+    apply_parser = sub.add_parser("apply", help="Run one SQL file")
+    apply_parser.add_argument("sql_file")
+    apply_parser.add_argument("--dry-run", action="store_true", help="Show the plan, change nothing")
+    args = parser.parse_args(argv)
 
-    if not os.path.exists(sql_file):
-        print(f"Error: File not found: {sql_file}")
-        sys.exit(1)
+    if args.command == "apply" and not os.path.exists(args.sql_file):
+        print(f"Error: File not found: {args.sql_file}")
+        return 1
 
-    success = run_migration(sql_file)
-    sys.exit(0 if success else 1)
+    try:
+        conn = connect()
+    except (ValueError, psycopg2.Error) as e:
+        print(f"Error: {e}")
+        return 1
+
+    try:
+        if args.command == "status":
+            status(conn)
+        elif args.command == "up":
+            up(conn, args.to, args.dry_run)
+        elif args.command == "baseline":
+            baseline(conn, args.to)
+        else:
+            apply_file(conn, args.sql_file, args.dry_run)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
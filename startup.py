@@ -0,0 +1,137 @@
+"""
+Cold start: import timing and warm-up before the first request.
+
+Render stops idle instances; the first request after a wake-up used to pay
+for the module imports and a cold TLS connect to Supabase. main.py records
+how long its imports took, and its lifespan hook calls warm_up(), which runs
+these concurrently (bounded by STARTUP_WARMUP_TIMEOUT):
+
+- database: open WARMUP_DB_CONNECTIONS pooled connections in parallel
+- item_index: load the in-memory item index (only if ITEM_INDEX_ENABLED)
+- legal_assets: publish active legal documents missing from LEGAL_ASSET_DIR
+
+A task that fails or runs past the timeout is logged and left behind; the
+app starts regardless. Durations are exported as app_startup_seconds{phase}.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "10"))
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+
+app_startup_seconds = metrics.Gauge(
+    "app_startup_seconds", "Time spent per startup phase in this process", ("phase",),
+    multiprocess_mode="max"
+)
+
+
+def record_phase(phase: str, seconds: float):
+    app_startup_seconds.set(round(seconds, 4), phase=phase)
+
+
+def warm_database():
+    """Open connections concurrently so requests don't pay for the TLS handshake."""
+    from database import get_pool
+
+    pool = get_pool()
+    count = max(min(WARMUP_DB_CONNECTIONS, pool.maxconn), 1)
+
+    def open_one(_):
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except Exception:
+            pool.putconn(conn, broken=True)
+            raise
+        return conn
+
+    # Hold every connection until all are open, or the pool would hand back the same one.
+    # Those that did open go back to the pool even when another one failed.
+    connections = []
+    error = None
+    try:
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="warmup-db") as executor:
+            for future in as_completed([executor.submit(open_one, i) for i in range(count)]):
+                if future.exception() is None:
+                    connections.append(future.result())
+                elif error is None:
+                    error = future.exception()
+    finally:
+        for conn in connections:
+            pool.putconn(conn)
+    if error is not None:
+        raise error
+
+
+def warm_item_index():
+    from item_index import item_index, ITEM_INDEX_ENABLED
+    if ITEM_INDEX_ENABLED and not item_index.ready:
+        item_index.load()
+
+
+def warm_legal_assets():
+    import legal_assets
+    legal_assets.publish()
+
+
+WARMUP_TASKS: Dict[str, Callable[[], None]] = {
+    "database": warm_database,
+    "item_index": warm_item_index,
+    "legal_assets": warm_legal_assets,
+}
+
+
+async def warm_up(timeout: float = STARTUP_WARMUP_TIMEOUT) -> Dict[str, str]:
+    """Run WARMUP_TASKS concurrently in threads; returns task -> ok / failed / timeout."""
+    if not STARTUP_WARMUP:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    durations: Dict[str, float] = {}
+
+    def timed(name: str, task: Callable[[], None]):
+        start = time.perf_counter()
+        try:
+            task()
+        finally:
+            durations[name] = time.perf_counter() - start
+
+    futures = {
+        name: loop.run_in_executor(None, timed, name, task)
+        for name, task in WARMUP_TASKS.items()
+    }
+    done, _ = await asyncio.wait(futures.values(), timeout=timeout)
+
+    outcome = {}
+    for name, future in futures.items():
+        if future not in done:
+            outcome[name] = "timeout"
+        elif future.exception() is not None:
+            outcome[name] = "failed"
+            logger.warning("Warm-up task failed", extra={"task": name, "error": str(future.exception())})
+        else:
+            outcome[name] = "ok"
+            record_phase(f"warmup_{name}", durations[name])
+
+    total = time.perf_counter() - started
+    record_phase("warmup", total)
+    logger.info("Warm-up finished", extra={
+        "seconds": round(total, 3), **{f"warmup_{name}": result for name, result in outcome.items()}
+    })
+    return outcome
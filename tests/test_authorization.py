@@ -0,0 +1,70 @@
+import pytest
+from fastapi import HTTPException
+
+import authorization
+from auth import Roles, TokenData
+from authorization import AccessResolver, UserAccess, require_access_role, scope_predicate
+
+
+def _resolve_inactive(monkeypatch, role):
+    rows = [{"email": "former@stryker.com", "role": role, "customer_number": "C-1",
+             "is_active": False, "territories": ["DE-BW"]}]
+    monkeypatch.setattr(authorization, "execute_named", lambda *args, **kwargs: rows)
+    token = TokenData(email="former@stryker.com", name="Former", role=role, territories=["DE-BW"])
+    return AccessResolver(ttl=0).resolve(token)
+
+
+@pytest.mark.parametrize("role", [Roles.ADMIN, Roles.SALES_TECH, Roles.CUSTOMER])
+def test_deactivated_user_sees_nothing(monkeypatch, role):
+    access = _resolve_inactive(monkeypatch, role)
+    assert not access.active
+    assert scope_predicate(access) == ("FALSE", [])
+
+
+def test_deactivated_admin_fails_role_check(monkeypatch):
+    access = _resolve_inactive(monkeypatch, Roles.ADMIN)
+    with pytest.raises(HTTPException) as exc:
+        require_access_role([Roles.ADMIN])(access)
+    assert exc.value.status_code == 403
+
+
+def test_active_admin_sees_everything():
+    access = UserAccess("admin@stryker.com", Roles.ADMIN, None, [])
+    assert scope_predicate(access) == ("TRUE", [])
+    assert require_access_role([Roles.ADMIN])(access) is access
+
+
+def _count_loads(monkeypatch):
+    loads = []
+
+    def execute_named(name, query, params):
+        loads.append(params[0])
+        return []
+    monkeypatch.setattr(authorization, "execute_named", execute_named)
+    return loads
+
+
+def _token(email):
+    return TokenData(email=email, name="Someone", role=Roles.CUSTOMER, customer_number="C-1")
+
+
+def test_cache_is_bounded_least_recently_used_first(monkeypatch):
+    loads = _count_loads(monkeypatch)
+    resolver = AccessResolver(ttl=300, max_entries=2)
+    for email in ("a@x.com", "b@x.com", "a@x.com", "c@x.com"):
+        resolver.resolve(_token(email))
+    assert list(resolver._entries) == ["a@x.com", "c@x.com"]
+    resolver.resolve(_token("a@x.com"))
+    assert loads == ["a@x.com", "b@x.com", "c@x.com"]
+
+
+def test_expired_entries_are_evicted_on_insert(monkeypatch):
+    _count_loads(monkeypatch)
+    now = [1000.0]
+    monkeypatch.setattr(authorization.time, "monotonic", lambda: now[0])
+    resolver = AccessResolver(ttl=10, max_entries=100)
+    for n in range(50):
+        resolver.resolve(_token(f"made-up-{n}@x.com"))
+    now[0] += 11
+    resolver.resolve(_token("real@x.com"))
+    assert list(resolver._entries) == ["real@x.com"]
@@ -0,0 +1,106 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.extensions
+import pytest
+
+import database
+from auth import Roles, TokenData
+from routers import intake
+
+POOL_SIZE = 2
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+
+    def execute(self, query, params=None):
+        if "generate_request_code" in query:
+            # pg_advisory_xact_lock: held until the transaction ends
+            if not self.conn.server.request_code_lock.acquire(timeout=5):
+                raise RuntimeError("request code lock not released")
+            self.conn.holds_lock = True
+            time.sleep(0.2)  # let the other submits queue up behind it
+            self.conn.server.codes += 1
+            self.row = (f"DE-202610-{self.conn.server.codes:06d}",)
+        elif "territory_code" in query:
+            self.row = ("DE-BW",)
+        elif "INSERT INTO" in query:
+            self.row = (self.conn.server.codes,)
+        else:
+            self.row = None
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+        self.holds_lock = False
+        self.info = type("Info", (), {"transaction_status": psycopg2.extensions.TRANSACTION_STATUS_IDLE})()
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def _end_transaction(self):
+        if self.holds_lock:
+            self.holds_lock = False
+            self.server.request_code_lock.release()
+
+    commit = rollback = _end_transaction
+
+
+class FakeServer:
+    """What psycopg2's ThreadedConnectionPool would connect to."""
+
+    def __init__(self):
+        self.request_code_lock = threading.Lock()
+        self.codes = 0
+
+    def getconn(self):
+        return FakeConnection(self)
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = database.ConnectionPool(POOL_SIZE, params={"dbname": "unused"})
+    pool._pool = FakeServer()
+    # Fail fast instead of after DB_POOL_TIMEOUT
+    monkeypatch.setattr(pool, "getconn", functools.partial(database.ConnectionPool.getconn, pool, timeout=2))
+    monkeypatch.setattr(database, "get_pool", lambda: pool)
+    monkeypatch.setattr(database, "DB_REPLICA_URL", None)
+    monkeypatch.setattr(intake, "log_activity", lambda *args, **kwargs: None)
+    return pool
+
+
+def _submit(barrier):
+    request = intake.ServiceRequestCreate(
+        request_type="Serial", serial_number="SN-1", country_code="DE",
+        contact_email="buyer@klinikum.de", contact_name="Buyer", contact_phone="+49 1",
+        main_reason="Device Malfunction", customer_number="C-1",
+        pickup_date="2026-11-02", pickup_time="10:00",
+        po_reference_number="PO-1", customer_ident_code="ID-1",
+    )
+    token = TokenData(email="buyer@klinikum.de", name="Buyer", role=Roles.CUSTOMER, customer_number="C-1")
+    barrier.wait()
+    return intake.submit_service_request(request, token)["request_code"]
+
+
+def test_concurrent_submits_do_not_exhaust_the_pool(pool):
+    # One more submit than connections, all for the same country and month
+    submits = POOL_SIZE + 1
+    barrier = threading.Barrier(submits)
+    with ThreadPoolExecutor(max_workers=submits) as executor:
+        codes = list(executor.map(lambda _: _submit(barrier), range(submits)))
+    assert sorted(codes) == [f"DE-202610-{n:06d}" for n in range(1, submits + 1)]
+    # Every connection went back
+    assert all(pool._slots.acquire(blocking=False) for _ in range(POOL_SIZE))
@@ -0,0 +1,64 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import legal_assets
+import rate_limit
+
+UNKNOWN = "0" * 64 + ".html"
+
+
+def _request(ip="203.0.113.7"):
+    return Request({"type": "http", "method": "GET", "path": f"/api/legal/{UNKNOWN}",
+                    "headers": [], "client": (ip, 50000)})
+
+
+@pytest.fixture
+def lookups(monkeypatch, tmp_path):
+    queries = []
+
+    def execute_query(query, params=None, **kwargs):
+        queries.append(params)
+        return []
+    monkeypatch.setattr(legal_assets, "execute_query", execute_query)
+    monkeypatch.setattr(legal_assets, "LEGAL_ASSET_DIR", str(tmp_path))
+    monkeypatch.setattr(legal_assets, "_misses", legal_assets.OrderedDict())
+    monkeypatch.setattr(rate_limit, "TRUST_FORWARDED_FOR", False)
+    return queries
+
+
+def _serve(request):
+    with pytest.raises(HTTPException) as exc:
+        legal_assets.serve(request, UNKNOWN)
+    return exc.value.status_code
+
+
+def test_unknown_name_is_looked_up_once(lookups, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", False)
+    assert [_serve(_request()) for _ in range(5)] == [404] * 5
+    assert len(lookups) == 1
+
+
+def test_unknown_name_is_looked_up_again_after_the_ttl(lookups, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(legal_assets, "LEGAL_ASSET_MISS_TTL", -1)
+    _serve(_request())
+    _serve(_request())
+    assert len(lookups) == 2
+
+
+def test_database_lookups_are_rate_limited_per_ip(lookups, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "limiter", rate_limit.RateLimiter(limits={"legal": (2, 60)}))
+    # Every name is new, so each one would reach the database
+    names = [f"{n:064x}.html" for n in range(1, 4)]
+    outcomes = []
+    for name in names:
+        try:
+            legal_assets.serve(_request(), name)
+        except HTTPException as e:
+            outcomes.append(e.status_code)
+    assert outcomes == [404, 404, 429]
+    assert len(lookups) == 2
+    # Another client still gets through
+    assert _serve(_request("198.51.100.2")) == 404
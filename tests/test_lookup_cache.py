@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lookup_cache import LookupCache
+
+LIMIT = 3
+
+SERIALS = ["SN-1200", "SN-1201", "SN-1234", "SN-1235", "SN-1299", "SN-4567"]
+
+
+def _contains(row, q):
+    return q in row["serial_number"]
+
+
+def _query(q):
+    """What `WHERE serial_number LIKE '%q%' ORDER BY serial_number LIMIT 3` returns."""
+    return [{"serial_number": s} for s in sorted(SERIALS) if q in s][:LIMIT]
+
+
+class Loader:
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, q):
+        with self._lock:
+            self.calls.append(q)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return _query(q)
+
+
+def _concurrently(cache, q, loader, callers=8):
+    barrier = threading.Barrier(callers)
+
+    def lookup(_):
+        barrier.wait()
+        try:
+            return cache.get(q, loader)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        return list(executor.map(lookup, range(callers)))
+
+
+def test_concurrent_identical_lookups_run_the_query_once():
+    cache = LookupCache("test", LIMIT, _contains)
+    loader = Loader(delay=0.2)
+
+    results = _concurrently(cache, "SN-12", loader)
+
+    assert loader.calls == ["SN-12"]
+    assert all(rows == _query("SN-12") for rows in results)
+
+
+def test_errors_are_shared_but_not_cached():
+    cache = LookupCache("test", LIMIT, _contains)
+    failing = Loader(delay=0.2, error=RuntimeError("database unavailable"))
+
+    results = _concurrently(cache, "SN-12", failing)
+
+    assert failing.calls == ["SN-12"]
+    assert all(isinstance(e, RuntimeError) for e in results)
+    # The next lookup asks the database again
+    loader = Loader()
+    assert cache.get("SN-12", loader) == _query("SN-12")
+    assert loader.calls == ["SN-12"]
+
+
+def test_complete_prefix_result_answers_longer_query():
+    cache = LookupCache("test", LIMIT, _contains)
+    loader = Loader()
+    cache.get("SN-4", loader)
+
+    assert cache.get("SN-45", loader) == _query("SN-45")
+    assert loader.calls == ["SN-4"]
+
+
+def test_truncated_prefix_result_is_not_used():
+    cache = LookupCache("test", LIMIT, _contains)
+    loader = Loader()
+    prefix_rows = cache.get("SN-12", loader)
+    assert len(prefix_rows) == LIMIT
+
+    # Filtering the truncated "SN-12" rows would give only SN-1234
+    rows = cache.get("SN-123", loader)
+
+    assert rows == _query("SN-123") == [{"serial_number": "SN-1234"}, {"serial_number": "SN-1235"}]
+    assert loader.calls == ["SN-12", "SN-123"]
+
+
+@pytest.mark.parametrize("q", ["SN-4_", "SN-4%", "SN-4\\"])
+def test_like_wildcards_are_never_derived(q):
+    cache = LookupCache("test", LIMIT, _contains)
+    loader = Loader()
+    cache.get("SN-4", loader)
+
+    cache.get(q, loader)
+
+    assert loader.calls == ["SN-4", q]
@@ -0,0 +1,78 @@
+import json
+import os
+
+import metrics
+import startup
+
+OTHER_WORKER = 999999
+
+
+def _write_other_worker(directory, requests, in_progress, startup_seconds):
+    snapshot = {
+        "http_requests_total": {
+            "type": "counter",
+            "series": [[["GET", "/api/requests", "200"], requests]],
+        },
+        "http_requests_in_progress": {"type": "gauge", "series": [[[], in_progress]]},
+        "app_startup_seconds": {"type": "gauge", "series": [[["imports"], startup_seconds]]},
+        "db_connection_acquire_seconds": {
+            "type": "histogram",
+            "series": [[[], [[1] + [0] * len(metrics.LATENCY_BUCKETS), 0.001]]],
+        },
+    }
+    with open(os.path.join(directory, f"{OTHER_WORKER}.json"), "w") as f:
+        json.dump(snapshot, f)
+
+
+def _sample(text, line_start):
+    for line in text.splitlines():
+        if line.startswith(line_start + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def _isolated_metrics(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "MULTIPROC_DIR", str(tmp_path))
+    for gauge_or_counter in (metrics.http_requests_total, metrics.http_requests_in_progress,
+                             startup.app_startup_seconds):
+        monkeypatch.setattr(gauge_or_counter, "_values", {})
+    monkeypatch.setattr(metrics.db_connection_acquire_seconds, "_series", {})
+
+
+def test_scrape_adds_up_every_worker(monkeypatch, tmp_path):
+    _isolated_metrics(monkeypatch, tmp_path)
+    _write_other_worker(tmp_path, requests=5, in_progress=2, startup_seconds=0.9)
+    metrics.http_requests_total.inc(3, method="GET", route="/api/requests", status=200)
+    metrics.http_requests_in_progress.inc()
+    metrics.db_connection_acquire_seconds.observe(0.002)
+    startup.record_phase("imports", 0.6)
+
+    text = metrics.render_prometheus()
+
+    assert _sample(text, 'http_requests_total{method="GET",route="/api/requests",status="200"}') == 8
+    assert _sample(text, "http_requests_in_progress") == 3
+    assert _sample(text, 'app_startup_seconds{phase="imports"}') == 0.9
+    assert _sample(text, "db_connection_acquire_seconds_count") == 2
+    assert _sample(text, 'db_connection_acquire_seconds_bucket{le="0.005"}') == 2
+    # This worker's own file was written by the scrape
+    assert os.path.exists(tmp_path / f"{os.getpid()}.json")
+
+
+def test_exited_worker_keeps_counters_but_not_gauges(monkeypatch, tmp_path):
+    _isolated_metrics(monkeypatch, tmp_path)
+    _write_other_worker(tmp_path, requests=5, in_progress=2, startup_seconds=0.9)
+
+    metrics.mark_process_dead(OTHER_WORKER)
+    text = metrics.render_prometheus()
+
+    assert _sample(text, 'http_requests_total{method="GET",route="/api/requests",status="200"}') == 5
+    assert _sample(text, "http_requests_in_progress") is None
+
+
+def test_clear_removes_files_from_a_previous_run(monkeypatch, tmp_path):
+    _isolated_metrics(monkeypatch, tmp_path)
+    _write_other_worker(tmp_path, requests=5, in_progress=2, startup_seconds=0.9)
+
+    metrics.clear_multiproc_dir()
+
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from auth import Roles
+from authorization import UserAccess
+from routers import requests
+from routers.requests import BulkStatusItem, BulkStatusUpdate, StatusUpdate
+
+SEEN = datetime(2026, 10, 1, 9, 30)
+CHANGED = datetime(2026, 10, 1, 9, 45)
+NOW = datetime(2026, 10, 2, 8, 0)
+
+SALES_TECH = UserAccess("tech@stryker.com", Roles.SALES_TECH, None, ["DE-BW"])
+
+
+class FakeRequests:
+    """
+    The service request table as the status CTE sees it, for a SalesTech caller
+    (scope predicate `sr.territory_code = ANY(%s)`).
+    """
+
+    def __init__(self):
+        self.rows = {
+            1: {"status": "Open", "territory_code": "DE-BW", "last_modified_date": SEEN},
+            2: {"status": "Received", "territory_code": "DE-BW", "last_modified_date": CHANGED},
+            3: {"status": "Open", "territory_code": "DE-BY", "last_modified_date": SEEN},
+        }
+        self.statements = 0
+
+    def execute_query(self, query, params):
+        self.statements += 1
+        assert "sr.territory_code = ANY(%s)" in query
+        ids, expected, territories, new_status, _ = params
+        result = []
+        for request_id, expected_at in zip(ids, expected):
+            row = self.rows.get(request_id)
+            if row is None:
+                result.append({"id": request_id, "old_status": None, "last_modified_date": None,
+                               "result": "not_found", "current_status": None})
+            elif row["territory_code"] not in territories:
+                result.append({"id": request_id, "old_status": None, "last_modified_date": row["last_modified_date"],
+                               "result": "forbidden", "current_status": row["status"]})
+            elif expected_at is not None and expected_at != row["last_modified_date"]:
+                result.append({"id": request_id, "old_status": None, "last_modified_date": row["last_modified_date"],
+                               "result": "conflict", "current_status": row["status"]})
+            else:
+                old_status = row["status"]
+                row.update(status=new_status, last_modified_date=NOW)
+                result.append({"id": request_id, "old_status": old_status, "last_modified_date": NOW,
+                               "result": "updated", "current_status": new_status})
+        return result
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeRequests()
+    monkeypatch.setattr(requests, "execute_query", table.execute_query)
+    monkeypatch.setattr(requests, "note_write", lambda email: None)
+    return table
+
+
+@pytest.fixture
+def activity(monkeypatch):
+    entries = []
+    monkeypatch.setattr(requests, "log_activity", lambda request_id, *args, **kwargs: entries.append(request_id))
+    return entries
+
+
+def _patch(request_id, expected=None):
+    return requests.update_request_status(
+        request_id, StatusUpdate(status="Received", expected_last_modified=expected), SALES_TECH
+    )
+
+
+def test_stale_expected_last_modified_is_a_conflict(table, activity):
+    with pytest.raises(HTTPException) as exc:
+        _patch(2, expected=SEEN)
+    assert exc.value.status_code == 409
+    assert exc.value.detail["current_status"] == "Received"
+    assert exc.value.detail["last_modified_date"] == CHANGED
+    assert table.rows[2]["last_modified_date"] == CHANGED
+    assert activity == []
+
+
+def test_expected_last_modified_compares_wall_clock_time(table, activity):
+    # The client echoes the timestamp back with its offset; the column has none
+    result = _patch(1, expected=datetime.fromisoformat("2026-10-01T09:30:00+02:00"))
+    assert result["last_modified_date"] == NOW
+    assert activity == [1]
+
+
+def test_out_of_scope_request_is_forbidden(table, activity):
+    with pytest.raises(HTTPException) as exc:
+        _patch(3, expected=SEEN)
+    assert exc.value.status_code == 403
+    assert table.rows[3]["status"] == "Open"
+    assert activity == []
+
+
+def test_missing_request_is_not_found(table, activity):
+    with pytest.raises(HTTPException) as exc:
+        _patch(404)
+    assert exc.value.status_code == 404
+    assert activity == []
+
+
+def test_mixed_bulk_batch_reports_each_item_in_order(table, activity):
+    update = BulkStatusUpdate(status="Received", items=[
+        BulkStatusItem(id=3),
+        BulkStatusItem(id=1, expected_last_modified=SEEN),
+        BulkStatusItem(id=404),
+        BulkStatusItem(id=2, expected_last_modified=SEEN),
+    ])
+    response = requests.bulk_update_status(update, SALES_TECH)
+
+    assert [(r["id"], r["result"]) for r in response["results"]] == [
+        (3, "forbidden"), (1, "updated"), (404, "not_found"), (2, "conflict"),
+    ]
+    assert response["summary"] == {"forbidden": 1, "updated": 1, "not_found": 1, "conflict": 1}
+    assert response["results"][1] == {"id": 1, "result": "updated", "old_status": "Open", "last_modified_date": NOW}
+    assert response["results"][3]["current_status"] == "Received"
+    # One statement for the whole batch, and only the updated request is logged
+    assert table.statements == 1
+    assert activity == [1]
+
+
+def test_bulk_batch_rejects_duplicate_ids(table):
+    update = BulkStatusUpdate(status="Received", items=[BulkStatusItem(id=1), BulkStatusItem(id=1)])
+    with pytest.raises(HTTPException) as exc:
+        requests.bulk_update_status(update, SALES_TECH)
+    assert exc.value.status_code == 400
+    assert table.statements == 0